@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Summarize every saved run with NumPy rather than per-column SQL.
+
+The bones table's stat and skill columns are loaded into arrays once and
+cached next to the database, in <database>.columns.npz. Later runs only read
+the rows past the cache's highest id, a batch at a time over a read-only
+connection, so a refresh never holds up live saves for long:
+
+    python chargen/analytics.py
+    python chargen/analytics.py --database data/global-bones.sqlite --top 30
+
+It reports the distribution of each stat, the skills most often taken
+together (from one matrix product over the skill columns) and each skill's
+score lift: the mean score of runs with the skill minus that of runs
+without it. Runs that archive_seasons.py later moves out of the database
+stay in the cache; --rebuild starts it again from what is there now.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy
+import sqlalchemy
+
+import main
+from main import SKILLS, STATS
+
+
+STAT_NAMES = [stat.name for stat in STATS]
+SKILL_NAMES = [skill.name for skill in SKILLS]
+PERCENTILES = [5, 25, 50, 75, 95]
+
+
+class BonesColumns:
+    """ The stat and skill columns of the bones table, one row per run
+
+    Rows are in id order. Missing values, from runs saved before a column
+    existed, are 0 and False.
+    """
+
+    def __init__(self, ids, stats, skills):
+        self.ids = ids
+        self.stats = stats
+        self.skills = skills
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            numpy.empty(0, dtype=numpy.int64),
+            numpy.empty((0, len(STATS)), dtype=numpy.int32),
+            numpy.empty((0, len(SKILLS)), dtype=bool),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """ The columns cached at path, or none if it is missing or outdated """
+        if not os.path.exists(path):
+            return cls.empty()
+        with numpy.load(path) as cached:
+            if (
+                list(cached["stat_names"]) != STAT_NAMES
+                or list(cached["skill_names"]) != SKILL_NAMES
+            ):
+                logging.info(f"{path} has other columns; rebuilding it")
+                return cls.empty()
+            return cls(cached["ids"], cached["stats"], cached["skills"])
+
+    def save(self, path):
+        with open(f"{path}.tmp", "wb") as f:
+            numpy.savez(
+                f,
+                ids=self.ids,
+                stats=self.stats,
+                skills=self.skills,
+                stat_names=STAT_NAMES,
+                skill_names=SKILL_NAMES,
+            )
+        os.replace(f"{path}.tmp", path)
+
+    @property
+    def last_id(self):
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    def append(self, batches):
+        """ Adds (id, *stats, *skills) rows, as arrays, after the current ones """
+        if not batches:
+            return
+        rows = numpy.concatenate(batches)
+        stats_end = 1 + len(STATS)
+        self.ids = numpy.concatenate([self.ids, rows[:, 0]])
+        self.stats = numpy.concatenate(
+            [self.stats, rows[:, 1:stats_end].astype(numpy.int32)]
+        )
+        self.skills = numpy.concatenate(
+            [self.skills, rows[:, stats_end:].astype(bool)]
+        )
+
+
+def refresh(columns, path, batch_size):
+    """ Appends the runs saved at path since columns was last refreshed
+
+    Returns the columns, which are read again from the start if the database
+    was replaced by one with fewer runs, and how many runs were read.
+    """
+    engine = sqlalchemy.create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+    # older databases may predate some columns
+    present = {c["name"] for c in sqlalchemy.inspect(engine).get_columns("bones")}
+    bones = main.BONES_TABLE.c
+    selected = [bones.id] + [
+        sqlalchemy.func.coalesce(bones[name], 0)
+        if name in present
+        else sqlalchemy.literal(0)
+        for name in STAT_NAMES + SKILL_NAMES
+    ]
+    batches = []
+    with engine.connect() as conn:
+        if columns.last_id > (conn.execute(main.LAST_BONES_ID).scalar() or 0):
+            logging.warning(f"{path} was replaced; reading it from the start")
+            columns = BonesColumns.empty()
+        last_id = columns.last_id
+        while True:
+            # each batch is its own short read, so saves can commit in between
+            query = (
+                sqlalchemy.select(*selected)
+                .where(bones.id > last_id)
+                .order_by(bones.id)
+                .limit(batch_size)
+            )
+            rows = conn.execute(query).fetchall()
+            if not rows:
+                break
+            batch = numpy.array(rows, dtype=numpy.int64)
+            batches.append(batch)
+            last_id = int(batch[-1, 0])
+    engine.dispose()
+    columns.append(batches)
+    return (columns, sum(len(batch) for batch in batches))
+
+
+def stat_distributions(columns):
+    """ {stat: summary} of every stat over every run """
+    if not len(columns.ids):
+        return {}
+    percentiles = numpy.percentile(columns.stats, PERCENTILES, axis=0)
+    means = columns.stats.mean(axis=0)
+    stdevs = columns.stats.std(axis=0)
+    lows = columns.stats.min(axis=0)
+    highs = columns.stats.max(axis=0)
+    return {
+        stat.value: {
+            "mean": float(means[i]),
+            "stdev": float(stdevs[i]),
+            "min": int(lows[i]),
+            "max": int(highs[i]),
+            **{
+                f"p{p}": float(percentiles[j, i])
+                for (j, p) in enumerate(PERCENTILES)
+            },
+        }
+        for (i, stat) in enumerate(STATS)
+    }
+
+
+def skill_cooccurrence(columns):
+    """ The runs having both of each pair of skills, as a skills x skills matrix
+
+    The diagonal is how many runs have each skill.
+    """
+    skills = columns.skills.astype(numpy.int64)
+    return skills.T @ skills
+
+
+def score_lift(columns):
+    """ {skill: (runs, mean PTS with it, mean PTS without it)}
+
+    A mean over no runs is None.
+    """
+    pts = columns.stats[:, list(STATS).index(STATS.PTS)].astype(numpy.float64)
+    runs = columns.skills.sum(axis=0)
+    with_total = pts @ columns.skills
+    without_total = pts.sum() - with_total
+    without_runs = len(pts) - runs
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        with_mean = with_total / runs
+        without_mean = without_total / without_runs
+
+    def mean(value):
+        return None if numpy.isnan(value) else float(value)
+
+    return {
+        skill.value: (int(runs[i]), mean(with_mean[i]), mean(without_mean[i]))
+        for (i, skill) in enumerate(SKILLS)
+    }
+
+
+def top_pairs(cooccurrence, n):
+    """ The n pairs of skills most often taken together, and their Jaccard index """
+    having = numpy.diag(cooccurrence)
+    (first, second) = numpy.triu_indices(len(SKILLS), k=1)
+    together = cooccurrence[first, second]
+    either = having[first] + having[second] - together
+    order = numpy.argsort(-together, kind="stable")[:n]
+    return [
+        (
+            list(SKILLS)[first[i]].value,
+            list(SKILLS)[second[i]].value,
+            int(together[i]),
+            float(together[i] / either[i]) if either[i] else 0.0,
+        )
+        for i in order
+        if together[i]
+    ]
+
+
+def report(columns, top):
+    distributions = stat_distributions(columns)
+    cooccurrence = skill_cooccurrence(columns)
+    lift = score_lift(columns)
+    print(f"== {len(columns.ids)} runs")
+    print(f"{'stat':>6} {'mean':>8} {'stdev':>8} {'min':>6}", end="")
+    print("".join(f" {f'p{p}':>6}" for p in PERCENTILES), f"{'max':>6}")
+    for (stat, summary) in distributions.items():
+        print(
+            f"{stat:>6} {summary['mean']:8.2f} {summary['stdev']:8.2f}"
+            f" {summary['min']:6}"
+            + "".join(f" {summary[f'p{p}']:6.1f}" for p in PERCENTILES)
+            + f" {summary['max']:6}"
+        )
+    print("== skills most often taken together")
+    pairs = top_pairs(cooccurrence, top)
+    for (first, second, together, jaccard) in pairs:
+        print(f"  {together:9} {jaccard:6.1%}  {first} + {second}")
+    print("== score lift (mean PTS with the skill minus without)")
+    taken = [
+        (with_mean - without_mean, skill, runs, with_mean, without_mean)
+        for (skill, (runs, with_mean, without_mean)) in lift.items()
+        if with_mean is not None and without_mean is not None
+    ]
+    taken.sort(reverse=True)
+    for (difference, skill, runs, with_mean, without_mean) in taken:
+        print(
+            f"  {difference:+7.2f} {runs:9} runs"
+            f" {with_mean:7.2f} vs {without_mean:7.2f}  {skill}"
+        )
+    return {
+        "runs": len(columns.ids),
+        "stats": distributions,
+        "skill_cooccurrence": {
+            "skills": [skill.value for skill in SKILLS],
+            "runs": cooccurrence.tolist(),
+        },
+        "top_pairs": pairs,
+        "score_lift": lift,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database", default="data/bones.sqlite")
+    parser.add_argument("--cache", help="default: <database>.columns.npz")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the cache")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=50000,
+        help="runs read at a time (default: 50000)",
+    )
+    parser.add_argument("--top", type=int, default=15, help="skill pairs to list")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    main.log_to_stderr()
+    path = os.path.abspath(args.database)
+    cache = args.cache or f"{args.database}.columns.npz"
+    started = time.perf_counter()
+    columns = BonesColumns.empty() if args.rebuild else BonesColumns.load(cache)
+    (columns, read) = refresh(columns, path, args.batch_size)
+    columns.save(cache)
+    print(
+        f"Read {read} new runs from {args.database}"
+        f" in {time.perf_counter() - started:.2f}s"
+    )
+    started = time.perf_counter()
+    results = report(columns, args.top)
+    print(f"Computed in {time.perf_counter() - started:.3f}s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
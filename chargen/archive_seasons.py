@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Move finished seasons of runs out of the live bones database.
+
+A season is a calendar quarter (see main.season_of). Each finished season's
+runs are copied into their own file, data/seasons/bones-<season>.sqlite, and
+deleted from data/bones.sqlite, so saves, leaderboards and neighbour queries
+in the game only ever touch the current season. Runs still on a leaderboard
+stay behind as well, so every board keeps working. Seasons older than
+--keep-uncompressed are then lzma-compressed:
+
+    python chargen/archive_seasons.py
+    python chargen/archive_seasons.py --vacuum
+    python chargen/archive_seasons.py --list
+    python chargen/archive_seasons.py --top 10 --season 2026-Q1 2026-Q2
+
+Archived seasons are ATTACHed on demand for queries across seasons, and
+compressed ones are unpacked to a temporary file first. Archived runs leave
+the name search index too, but the score histogram is left alone, so ranks
+still count every run ever saved.
+
+Deleting the runs leaves free pages in data/bones.sqlite rather than
+shrinking it. --vacuum then rebuilds its indexes and the file itself, which
+holds the write lock until it is done. Saves wait on it and fail after
+SQLite's 5 second busy timeout, so only pass it when no one is playing.
+"""
+import argparse
+import contextlib
+from datetime import datetime
+import logging
+import lzma
+import os
+import shutil
+import tempfile
+
+import sqlalchemy
+
+import main
+
+
+SEASONS_DIR = "data/seasons"
+# the season of each run, as main.season_of would give for its saved_at
+BONES_SEASON = sqlalchemy.literal_column(
+    "case when bones.saved_at is null then 'undated' "
+    "else strftime('%Y', bones.saved_at) || '-Q' || "
+    "((cast(strftime('%m', bones.saved_at) as integer) + 2) / 3) end"
+)
+SEASONS = (
+    sqlalchemy.select(BONES_SEASON, sqlalchemy.func.count())
+    .select_from(main.BONES_TABLE)
+    .group_by(BONES_SEASON)
+    .order_by(BONES_SEASON)
+)
+# columns by name, since older databases added some of them out of order
+COLUMNS = ", ".join(column.name for column in main.BONES_TABLE.columns)
+COPY_SEASON = sqlalchemy.text(
+    f"insert or ignore into season.bones ({COLUMNS}) "
+    f"select {COLUMNS} from main.bones where {BONES_SEASON} = :season"
+)
+# runs on a leaderboard stay, and so does the highest id so that sqlite never
+# hands out an archived id again
+MOVABLE = (
+    f"from main.bones where {BONES_SEASON} = :season "
+    "and id not in (select bones_id from leaderboard) "
+    "and id < (select max(id) from main.bones)"
+)
+COUNT_MOVABLE = sqlalchemy.text(f"select count(*) {MOVABLE}")
+UNINDEX_SEASON = sqlalchemy.text(
+    f"delete from main.bones_names where rowid in (select id {MOVABLE})"
+)
+DELETE_SEASON = sqlalchemy.text(f"delete {MOVABLE}")
+SEASON_RANK_INDEX = sqlalchemy.text(
+    "create index if not exists season.bones_rank on bones (PTS, id desc)"
+)
+
+
+def season_path(season):
+    return os.path.join(SEASONS_DIR, f"bones-{season}.sqlite")
+
+
+def archived_seasons():
+    """ {season: path} for every archived season, compressed or not """
+    seasons = {}
+    if os.path.isdir(SEASONS_DIR):
+        for filename in sorted(os.listdir(SEASONS_DIR)):
+            (name, _, extension) = filename.partition(".")
+            (prefix, _, season) = name.partition("-")
+            if prefix == "bones" and extension in ("sqlite", "sqlite.xz"):
+                seasons[season] = os.path.join(SEASONS_DIR, filename)
+    return seasons
+
+
+@contextlib.contextmanager
+def attached_season(conn, season):
+    """ ATTACHes an archived season to conn as "season"; yields its bones table
+
+    SQLite can only attach outside a transaction.
+    """
+    path = season_path(season)
+    unpacked = None
+    if not os.path.exists(path):
+        with lzma.open(f"{path}.xz") as compressed:
+            with tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False) as f:
+                unpacked = f.name
+                shutil.copyfileobj(compressed, f)
+        path = unpacked
+    conn.execute(sqlalchemy.text("attach database :path as season"), {"path": path})
+    try:
+        yield main.BONES_TABLE.to_metadata(sqlalchemy.MetaData(), schema="season")
+    finally:
+        conn.execute(sqlalchemy.text("detach database season"))
+        if unpacked is not None:
+            os.unlink(unpacked)
+
+
+def archive_season(conn, season):
+    """ Copies a season's runs to its own file and drops them from the live db
+
+    Returns how many runs were removed from the live database.
+    """
+    path = season_path(season)
+    if os.path.exists(f"{path}.xz"):
+        # new runs for a compressed season; add them to a fresh copy
+        with lzma.open(f"{path}.xz") as compressed, open(path, "wb") as f:
+            shutil.copyfileobj(compressed, f)
+        os.unlink(f"{path}.xz")
+    conn.execute(sqlalchemy.text("attach database :path as season"), {"path": path})
+    try:
+        with conn.begin():
+            table = main.BONES_TABLE.to_metadata(sqlalchemy.MetaData(), schema="season")
+            table.create(conn, checkfirst=True)
+            conn.execute(COPY_SEASON, {"season": season})
+            conn.execute(SEASON_RANK_INDEX)
+            conn.execute(UNINDEX_SEASON, {"season": season})
+            return conn.execute(DELETE_SEASON, {"season": season}).rowcount
+    finally:
+        conn.execute(sqlalchemy.text("detach database season"))
+
+
+def compress(path):
+    with open(path, "rb") as f, lzma.open(f"{path}.xz.tmp", "wb") as compressed:
+        shutil.copyfileobj(f, compressed)
+    os.replace(f"{path}.xz.tmp", f"{path}.xz")
+    os.unlink(path)
+
+
+def archive(keep_uncompressed, vacuum=False):
+    """ Archives every finished season and compresses all but the newest few """
+    current = main.season_of(datetime.now())
+    engine = main.database_engine()
+    os.makedirs(SEASONS_DIR, exist_ok=True)
+    # runs on an expired leaderboard period need not stay behind
+    main.prune_leaderboards()
+    with engine.connect() as conn:
+        for (season, runs) in conn.execute(SEASONS).fetchall():
+            # undated runs were saved before any season now archived
+            if season >= current and season != "undated":
+                continue
+            if not conn.execute(COUNT_MOVABLE, {"season": season}).scalar():
+                # only runs still on a leaderboard, archived last time
+                continue
+            removed = archive_season(conn, season)
+            logging.info(f"Archived {runs} runs of {season}, {removed} removed")
+    seasons = archived_seasons()
+    finished = sorted(season for season in seasons if season != "undated")
+    cold = finished[:-keep_uncompressed] if keep_uncompressed else finished
+    if "undated" in seasons:
+        cold.append("undated")
+    for season in cold:
+        if os.path.exists(season_path(season)):
+            compress(season_path(season))
+            logging.info(f"Compressed {season}")
+    with engine.connect() as conn:
+        # query plans depend on how many runs are left
+        conn.execute(sqlalchemy.text("analyze"))
+        if vacuum:
+            logging.info("Rebuilding data/bones.sqlite, which blocks saves")
+            for statement in ("reindex bones", "vacuum"):
+                conn.execute(sqlalchemy.text(statement))
+
+
+def top_runs(n, seasons):
+    """ The best n runs of the given seasons, live or archived, best first """
+    bones = main.BONES_TABLE.c
+    fields = [bones.id, *(bones[field] for field in main.BONES_FIELDS)]
+    runs = {}
+    with main.database_engine().connect() as conn:
+        live = (
+            sqlalchemy.select(*fields)
+            .where(BONES_SEASON.in_(seasons))
+            .order_by(bones.PTS.desc(), bones.id)
+            .limit(n)
+        )
+        runs.update((row.id, row) for row in conn.execute(live))
+        archived = archived_seasons()
+        for season in seasons:
+            if season not in archived:
+                continue
+            with attached_season(conn, season) as table:
+                query = (
+                    sqlalchemy.select(*(table.c[column.name] for column in fields))
+                    .order_by(table.c.PTS.desc(), table.c.id)
+                    .limit(n)
+                )
+                runs.update((row.id, row) for row in conn.execute(query))
+    best = sorted(runs.values(), key=lambda row: (-(row.PTS or 0), row.id))
+    return [main.Bones._make(row[1:]) for row in best[:n]]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--keep-uncompressed",
+        type=int,
+        default=2,
+        help="newest archived seasons left uncompressed (default: 2)",
+    )
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="then rebuild the live database, blocking saves while it runs",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="list seasons and their runs"
+    )
+    parser.add_argument(
+        "--top", type=int, metavar="N", help="print the best N runs of --season"
+    )
+    parser.add_argument(
+        "--season",
+        nargs="+",
+        default=[main.season_of(datetime.now())],
+        help="seasons for --top (default: the current one)",
+    )
+    args = parser.parse_args()
+    main.log_to_stderr()
+    if args.list:
+        with main.database_engine().connect() as conn:
+            for (season, runs) in conn.execute(SEASONS):
+                print(f"{season}  {runs} runs in data/bones.sqlite")
+        for (season, path) in archived_seasons().items():
+            print(f"{season}  {path}")
+    elif args.top:
+        for bones in top_runs(args.top, args.season):
+            print(f"{bones.PTS:>6}  {bones.name}  {bones.saved_at}")
+    else:
+        archive(args.keep_uncompressed, args.vacuum)
+
+
+if __name__ == "__main__":
+    main_cli()
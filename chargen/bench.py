@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the code run on every keypress and every life.
+
+Results are written as JSON and compared against a stored baseline, so a
+slowdown in main.py shows up before it is deployed:
+
+    python chargen/bench.py --save-baseline bench_baseline.json
+    ... change main.py ...
+    python chargen/bench.py --baseline bench_baseline.json
+
+The exit status is 1 if any benchmark is slower than the baseline by more
+than --tolerance. The benchmarks run inside a scratch directory, so the saves
+and the log never touch the real data/bones.sqlite.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+
+def mid_game_player(main):
+    """ A CharInfo resembling a player a dozen turns in """
+    STATS, SKILLS = main.STATS, main.SKILLS
+    player = main.CharInfo()
+    player.char_class = main.CHAR_CLASSES.MAGIC_USER
+    player.stats.update(
+        {
+            STATS.AGE: 24,
+            STATS.PTS: 9,
+            STATS.STR: 12,
+            STATS.DEX: 14,
+            STATS.CON: 11,
+            STATS.INT: 18,
+            STATS.WIS: 13,
+            STATS.CHA: 16,
+            STATS.LUC: 12,
+            STATS.MON: 7,
+            STATS.REP: 2,
+        }
+    )
+    player.skills = {
+        SKILLS.READ,
+        SKILLS.WRITE,
+        SKILLS.RHETORIC,
+        SKILLS.COMMUNICATION_1,
+        SKILLS.NUMEROLOGY_1,
+        SKILLS.IDENTIFY,
+        SKILLS.EMPATHY,
+        SKILLS.MIDDLE_SCHOOL_DIPLOMA,
+    }
+    return player
+
+
+def random_bones(main, name):
+    return main.Bones(
+        name,
+        *(random.randint(-5, 30) for stat in main.STATS),
+        *(random.random() < 0.3 for skill in main.SKILLS),
+    )
+
+
+def populate(main, rows):
+    """ Bulk-loads rows random bones so get_highscores has something to sort """
+    main.save_bones([random_bones(main, f"bench{i}") for i in range(rows)])
+
+
+def orm_benchmarks(main, player):
+    """ The classic mapper and Session persistence main.py used to have
+
+    Kept so the Core path in save_bones() and get_highscores() can be
+    compared against it in the same run.
+    """
+    import sqlalchemy.orm
+
+    class OrmBones:
+        def __init__(self, name, char_info):
+            self.name = name
+            for stat in main.STATS:
+                setattr(self, stat.name, char_info.stats[stat])
+            for skill in main.SKILLS:
+                setattr(self, skill.name, skill in char_info.skills)
+
+    if hasattr(sqlalchemy.orm, "registry"):
+        sqlalchemy.orm.registry().map_imperatively(OrmBones, main.BONES_TABLE)
+    else:
+        sqlalchemy.orm.mapper(OrmBones, main.BONES_TABLE)
+    session = sqlalchemy.orm.Session(bind=main.database_engine())
+
+    def orm_save():
+        session.add(OrmBones("bench", player))
+        session.commit()
+
+    def orm_save_many():
+        session.add_all(OrmBones(f"bench{i}", player) for i in range(100))
+        session.commit()
+
+    def orm_highscores():
+        return list(session.query(OrmBones).order_by(OrmBones.PTS.desc()).limit(10))
+
+    reads = {"orm get_highscores": orm_highscores}
+    writes = {"orm save": orm_save, "orm save[100]": orm_save_many}
+    return (reads, writes)
+
+
+def benchmarks(main, rows):
+    """ {name: zero-argument callable} for everything worth timing """
+    from headless import HeadlessGame
+
+    game = main.Game()
+    game.player = mid_game_player(main)
+    headless = HeadlessGame()
+    headless.player = mid_game_player(main)
+    display = main.PlayerDisplay()
+    point_buy = main.PointBuy(callback=lambda stats: None, bonuses={})
+    exam = main.EVENTS["exam_1"]
+    job = main.EVENTS["job"]
+    populate(main, rows)
+
+    def is_prime_d20():
+        for n in range(1, 21):
+            main.is_prime(n)
+
+    def resolve_exam():
+        # from the same player every time, or its stats drift and the log grows
+        headless.player = mid_game_player(main)
+        headless.choice_log.clear()
+        for choice in exam.choices:
+            headless.resolve_choice("exam_1", choice)
+
+    def event_menu():
+        # as Game.play_event builds it
+        mask = main.skill_mask(headless.player.skills)
+        enabled = set(
+            choice
+            for choice in job.choices
+            if choice.requires.allows(headless.player.stats, mask)
+        )
+        main.SplitMenu(
+            job.desc,
+            job.choices,
+            display_fn=lambda choice: choice.name,
+            is_enabled_fn=lambda choice: choice in enabled,
+        )
+
+    (orm_reads, orm_writes) = orm_benchmarks(main, game.player)
+    one = [main.Bones.from_char_info("bench", game.player)]
+    many = [main.Bones.from_char_info(f"bench{i}", game.player) for i in range(100)]
+    return {
+        "is_prime[1..20]": is_prime_d20,
+        "is_prime(97)": lambda: main.is_prime(97),
+        "Game.dice(1, 20)": lambda: headless.dice(1, 20),
+        "Game.dice(2, 4)": lambda: headless.dice(2, 4),
+        "Game.dice(1, 100)": lambda: headless.dice(1, 100),
+        "choose_skill": lambda: list(game.choose_skill()),
+        "resolve_choice(exam_1)": resolve_exam,
+        "SplitMenu(job)": event_menu,
+        "PlayerDisplay.update": lambda: display.update(game.player),
+        "PointBuy.get_points_remaining": point_buy.get_points_remaining,
+        # reads first, so they see the preloaded rows and not what saves add
+        f"get_highscores[{rows} rows]": main.get_highscores,
+        **orm_reads,
+        # what save() writes, without the standing it looks up afterwards
+        "save_bones[1]": lambda: main.save_bones(one),
+        "save_bones[100]": lambda: main.save_bones(many),
+        **orm_writes,
+    }
+
+
+def measure(fn, repeat, min_time):
+    """ Median and best seconds per call, timeit-style """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed * 10 > min_time else 10
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number)
+    return {
+        "median_us": statistics.median(runs) * 1e6,
+        "best_us": min(runs) * 1e6,
+        "loops": number,
+        "repeat": repeat,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """ Prints a comparison table and returns the names that regressed
+
+    Best-of-repeat times are compared, as they are the least noisy.
+    """
+    regressions = []
+    for (name, result) in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:>34} {result['best_us']:12.2f}us  (new)")
+            continue
+        ratio = result["best_us"] / before["best_us"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:>34} {result['best_us']:12.2f}us"
+            f" {before['best_us']:12.2f}us {ratio:6.2f}x{flag}"
+        )
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="bones to preload")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--only", nargs="+", help="run benchmarks with these prefixes")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", help="write results as the new baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown before failing, as a fraction (default: 0.2)",
+    )
+    args = parser.parse_args()
+    paths = [
+        os.path.abspath(p) if p else None
+        for p in (args.output, args.baseline, args.save_baseline)
+    ]
+    (output, baseline_path, save_baseline) = paths
+
+    random.seed(0)
+    os.chdir(tempfile.mkdtemp(prefix="chargen-bench-"))
+    import main
+
+    results = {}
+    for (name, fn) in benchmarks(main, args.rows).items():
+        if args.only and not any(name.startswith(p) for p in args.only):
+            continue
+        results[name] = measure(fn, args.repeat, args.min_time)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+    for path in (output, save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed")
+            sys.exit(1)
+    elif not output:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Fold the choice telemetry log into SQLite summary tables.
+
+Every game appends one JSON line per resolved event choice to
+data/telemetry.jsonl (see main.ChoiceLog). This adds the lines written since
+its last run to per-choice, per-check and per-stat totals in
+data/telemetry.sqlite, ready for designers to query:
+
+    python chargen/compact_telemetry.py
+    sqlite3 data/telemetry.sqlite 'select * from choice_success'
+
+Lines are read --batch-size at a time. Each batch is committed together with
+the log offset it reached, so an interrupted run never counts a line twice,
+and a line still being written is left for the next run. Malformed lines
+are skipped with a warning and reported apart from the lines added.
+"""
+import argparse
+from collections import Counter
+import json
+import logging
+import os
+
+import sqlalchemy
+
+
+METADATA = sqlalchemy.MetaData()
+CHOICE_TOTALS_TABLE = sqlalchemy.Table(
+    "choice_totals",
+    METADATA,
+    sqlalchemy.Column("event", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("choice", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("picks", sqlalchemy.Integer()),
+    sqlalchemy.Column("successes", sqlalchemy.Integer()),
+    sqlalchemy.Column("last_seen", sqlalchemy.Float()),
+)
+# keyed by the whole check, so rebalancing a dc starts a fresh row
+CHECK_TOTALS_TABLE = sqlalchemy.Table(
+    "check_totals",
+    METADATA,
+    sqlalchemy.Column("event", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("choice", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("position", sqlalchemy.Integer(), primary_key=True),
+    sqlalchemy.Column("stat", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("num_dice", sqlalchemy.Integer(), primary_key=True),
+    sqlalchemy.Column("sides", sqlalchemy.Integer(), primary_key=True),
+    sqlalchemy.Column("dc", sqlalchemy.Integer(), primary_key=True),
+    sqlalchemy.Column("rolls", sqlalchemy.Integer()),
+    sqlalchemy.Column("passes", sqlalchemy.Integer()),
+    sqlalchemy.Column("total_rolled", sqlalchemy.Integer()),
+)
+STAT_MOD_TOTALS_TABLE = sqlalchemy.Table(
+    "stat_mod_totals",
+    METADATA,
+    sqlalchemy.Column("event", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("choice", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("stat", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("applied", sqlalchemy.Integer()),
+    sqlalchemy.Column("total", sqlalchemy.Integer()),
+)
+# how far into each log has been counted; a new inode means a new log
+LOG_OFFSETS_TABLE = sqlalchemy.Table(
+    "log_offsets",
+    METADATA,
+    sqlalchemy.Column("path", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("inode", sqlalchemy.Integer()),
+    sqlalchemy.Column("offset", sqlalchemy.Integer()),
+)
+
+CHECK_KEY = ("event", "choice", "position", "stat", "num_dice", "sides", "dc")
+
+CHOICE_TOTALS_ADD = sqlalchemy.text(
+    "insert into choice_totals (event, choice, picks, successes, last_seen) "
+    "values (:event, :choice, :picks, :successes, :last_seen) "
+    "on conflict (event, choice) do update set "
+    "picks = picks + excluded.picks, "
+    "successes = successes + excluded.successes, "
+    "last_seen = max(last_seen, excluded.last_seen)"
+)
+CHECK_TOTALS_ADD = sqlalchemy.text(
+    "insert into check_totals "
+    "(event, choice, position, stat, num_dice, sides, dc, "
+    "rolls, passes, total_rolled) "
+    "values (:event, :choice, :position, :stat, :num_dice, :sides, :dc, "
+    ":rolls, :passes, :total_rolled) "
+    "on conflict (event, choice, position, stat, num_dice, sides, dc) "
+    "do update set rolls = rolls + excluded.rolls, "
+    "passes = passes + excluded.passes, "
+    "total_rolled = total_rolled + excluded.total_rolled"
+)
+STAT_MOD_TOTALS_ADD = sqlalchemy.text(
+    "insert into stat_mod_totals (event, choice, stat, applied, total) "
+    "values (:event, :choice, :stat, :applied, :total) "
+    "on conflict (event, choice, stat) do update set "
+    "applied = applied + excluded.applied, total = total + excluded.total"
+)
+LOG_OFFSET_SET = sqlalchemy.text(
+    "insert into log_offsets (path, inode, offset) values (:path, :inode, :offset) "
+    "on conflict (path) do update set inode = excluded.inode, offset = excluded.offset"
+)
+CHOICE_SUCCESS_VIEW = sqlalchemy.text(
+    "create view if not exists choice_success as "
+    "select event, choice, picks, successes, "
+    "round(1.0 * successes / picks, 4) as success_rate "
+    "from choice_totals order by event, choice"
+)
+
+
+def number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"expected a number, not {value!r}")
+    return value
+
+
+class Totals:
+    """ Sums of one batch of log lines, keyed like the summary tables """
+
+    def __init__(self):
+        self.choices = Counter()
+        self.successes = Counter()
+        self.last_seen = {}
+        # {CHECK_KEY values: [rolls, passes, total rolled]}
+        self.checks = {}
+        self.stat_mods = {}
+
+    def add(self, line):
+        """ Adds one log line, or raises without adding any of it """
+        record = json.loads(line)
+        key = (record["event"], record["choice"])
+        last_seen = max(self.last_seen.get(key, 0), number(record["t"]))
+        checks = [
+            ((*key, position, stat, num_dice, sides, dc), number(total), number(dc))
+            for (position, (stat, num_dice, sides, total, dc)) in enumerate(
+                record["checks"]
+            )
+        ]
+        stat_mods = [
+            ((*key, stat), number(mod)) for (stat, mod) in record["stat_mods"].items()
+        ]
+        # a key that cannot be hashed fails here, not halfway through adding
+        hash((key, *checks, *stat_mods))
+        self.choices[key] += 1
+        self.successes[key] += bool(record["success"])
+        self.last_seen[key] = last_seen
+        for (check_key, total, dc) in checks:
+            sums = self.checks.setdefault(check_key, [0, 0, 0])
+            sums[0] += 1
+            sums[1] += total >= dc
+            sums[2] += total
+        for (stat_key, mod) in stat_mods:
+            sums = self.stat_mods.setdefault(stat_key, [0, 0])
+            sums[0] += 1
+            sums[1] += mod
+
+    def write(self, conn):
+        if self.choices:
+            conn.execute(
+                CHOICE_TOTALS_ADD,
+                [
+                    {
+                        "event": event,
+                        "choice": choice,
+                        "picks": picks,
+                        "successes": self.successes[(event, choice)],
+                        "last_seen": self.last_seen[(event, choice)],
+                    }
+                    for ((event, choice), picks) in self.choices.items()
+                ],
+            )
+        if self.checks:
+            conn.execute(
+                CHECK_TOTALS_ADD,
+                [
+                    dict(
+                        zip(CHECK_KEY, key),
+                        rolls=rolls,
+                        passes=passes,
+                        total_rolled=total,
+                    )
+                    for (key, (rolls, passes, total)) in self.checks.items()
+                ],
+            )
+        if self.stat_mods:
+            conn.execute(
+                STAT_MOD_TOTALS_ADD,
+                [
+                    {
+                        "event": event,
+                        "choice": choice,
+                        "stat": stat,
+                        "applied": applied,
+                        "total": total,
+                    }
+                    for ((event, choice, stat), (applied, total)) in (
+                        self.stat_mods.items()
+                    )
+                ],
+            )
+
+
+def init_database(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    METADATA.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(CHOICE_SUCCESS_VIEW)
+    return engine
+
+
+def start_offset(conn, log_path, inode):
+    offsets = LOG_OFFSETS_TABLE.c
+    row = conn.execute(
+        sqlalchemy.select(offsets.inode, offsets.offset).where(
+            offsets.path == log_path
+        )
+    ).first()
+    if row is None or row.inode != inode:
+        return 0
+    return row.offset
+
+
+def compact(engine, log_path, batch_size):
+    """ Adds every complete line past the saved offset
+
+    Returns (lines added, malformed lines skipped). Skipped lines are passed
+    over for good, like the ones added.
+    """
+    try:
+        f = open(log_path, "rb")
+    except FileNotFoundError:
+        return (0, 0)
+    (added, skipped) = (0, 0)
+    with f:
+        inode = os.fstat(f.fileno()).st_ino
+        with engine.connect() as conn:
+            offset = start_offset(conn, log_path, inode)
+        if offset > os.fstat(f.fileno()).st_size:
+            logging.warning(f"{log_path} shrank; counting it again from the start")
+            offset = 0
+        f.seek(offset)
+        done = False
+        while not done:
+            totals = Totals()
+            (lines, accepted) = (0, 0)
+            while lines < batch_size:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    # the end of the log, or a flush still in progress
+                    done = True
+                    break
+                offset += len(line)
+                lines += 1
+                try:
+                    totals.add(line)
+                except (ValueError, KeyError, TypeError):
+                    logging.warning(f"Skipping malformed telemetry line {line!r}")
+                else:
+                    accepted += 1
+            if not lines:
+                break
+            with engine.begin() as conn:
+                totals.write(conn)
+                conn.execute(
+                    LOG_OFFSET_SET, {"path": log_path, "inode": inode, "offset": offset}
+                )
+            added += accepted
+            skipped += lines - accepted
+            logging.info(
+                f"Added {accepted} lines from {log_path}, skipped"
+                f" {lines - accepted} malformed, up to byte {offset}"
+            )
+    return (added, skipped)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--log", default="data/telemetry.jsonl")
+    parser.add_argument("--database", default="data/telemetry.sqlite")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100000,
+        help="lines summed and committed together (default: 100000)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    engine = init_database(args.database)
+    (added, skipped) = compact(engine, os.path.abspath(args.log), args.batch_size)
+    print(f"Added {added} new lines from {args.log}, skipped {skipped} malformed")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,137 @@
+"""
+Play the game without a terminal.
+
+HeadlessGame runs the same play_linear() flow as Game, but every screen is
+replaced with a Decision record that a script can answer directly.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+import main
+from main import POINT_BUY_STATS, SKILLS
+
+
+Decision = namedtuple(
+    "Decision",
+    [
+        "kind",
+        "title",
+        "choices",
+        "is_enabled_fn",
+        "callback",
+        "display_fn",
+        "description_fn",
+    ],
+    defaults=(str, lambda c: ""),
+)
+
+
+class HeadlessGame(main.Game):
+    def __init__(self):
+        self.decision = None
+        self.choice_log = []
+        super().__init__()
+
+    def create_layout(self):
+        return None
+
+    def set_main_widget(self, widget):
+        self.decision = widget
+
+    def next_screen(self):
+        self.set_main_widget(next(self.widgets_iter))
+
+    def split_menu(
+        self,
+        title,
+        choices,
+        display_fn=str,
+        description_fn=lambda c: "",
+        is_enabled_fn=lambda c: True,
+        callback=lambda c: None,
+    ):
+        return Decision(
+            "menu",
+            title,
+            list(choices),
+            is_enabled_fn,
+            callback,
+            display_fn,
+            description_fn,
+        )
+
+    def point_buy(self):
+        bonuses = main.CHAR_CLASS_STAT_BONUSES[self.player.char_class]
+
+        def on_done(values):
+            assert main.PointBuy.points_remaining(values) == 0, values
+            self.on_point_buy_done(
+                {stat: val + bonuses.get(stat, 0) for (stat, val) in values.items()}
+            )
+
+        return Decision(
+            "point_buy", "CHOOSE YOUR STATS", POINT_BUY_STATS, None, on_done
+        )
+
+    def popup_message(self, text, callback):
+        return Decision("popup", text, [], None, lambda _: callback())
+
+    def game_over(self):
+        return Decision("game_over", "RIP", [], None, None)
+
+    def resolve_choice(self, event_name, choice):
+        result, msg = super().resolve_choice(event_name, choice)
+        self.choice_log.append((event_name, choice.name, result is choice.success))
+        return result, msg
+
+    def enabled_choices(self):
+        decision = self.decision
+        if decision.is_enabled_fn is None:
+            return list(decision.choices)
+        return [c for c in decision.choices if decision.is_enabled_fn(c)]
+
+
+def play(game, policy):
+    """ Answers every decision with policy(game, decision) until the game ends """
+    while game.decision.kind != "game_over":
+        decision = game.decision
+        if decision.kind == "popup":
+            decision.callback(None)
+        else:
+            decision.callback(policy(game, decision))
+    return game
+
+
+@lru_cache(maxsize=None)
+def roll_distribution(num_dice, sides):
+    """ {total: probability} for Game.dice(num_dice, sides) """
+    faces = [face for face in range(1, sides + 1) if not main.is_prime(face)]
+    weight = 1 / len(faces)
+    dist = {0: 1.0}
+    for _ in range(num_dice):
+        next_dist = {}
+        for (total, p) in dist.items():
+            for face in faces:
+                next_dist[total + face] = next_dist.get(total + face, 0) + p * weight
+        dist = next_dist
+    return dist
+
+
+def check_chance(stats, skills, check):
+    """ Probability that a single StatCheck passes """
+    stat, num_dice, sides, dc = check
+    if SKILLS.CLOVER in skills and sides == 4:
+        sides = 8
+    need = dc - stats[stat]
+    return sum(
+        p for (total, p) in roll_distribution(num_dice, sides).items() if total >= need
+    )
+
+
+def success_chance(stats, skills, choice):
+    """ Probability that every check of an EventChoice passes """
+    chance = 1.0
+    for check in choice.checks:
+        chance *= check_chance(stats, skills, check)
+    return chance
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Keep highscores for every game process behind one Unix socket.
+
+The daemon is the only process that opens data/bones.sqlite. Game processes
+started with CHARGEN_HIGHSCORE_SOCKET set send it their saves and highscore
+queries instead of opening the database themselves:
+
+    python chargen/highscored.py --socket data/highscores.sock &
+    CHARGEN_HIGHSCORE_SOCKET=data/highscores.sock python chargen/main.py
+
+Leaderboards are kept in memory, so queries rarely touch the disk. Saves are
+acknowledged as soon as they are queued and are written in batches every
+--flush-interval seconds, or sooner once --batch-size saves are waiting.
+
+With CHARGEN_GLOBAL_BONES set, ranks and leaderboards come from the merged
+database, and are reloaded whenever merge_bones.py has added runs to it.
+Runs this daemon has written since it started are counted until the merge
+has them too.
+
+Each request is one line of tab-separated fields, the command first. The
+reply is a status line ("OK" or "ERR <reason>"), zero or more rows, then a
+blank line:
+
+    S <bones>           save a run, encoded as by main.encode_bones; the
+                        reply is its standing, as by main.encode_standing
+    T <n> [<board>]     the best n runs of the current day, week, season
+                        or all time ("day", "week", "season" or the
+                        default "all")
+    N <n> <text>        the best n runs with a name matching text, as by
+                        main.search_bones; saves still queued are left out
+"""
+import argparse
+import bisect
+from collections import Counter
+from datetime import datetime
+import logging
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+import sqlalchemy
+
+import main
+from unix_socket import claim_socket
+
+
+# runs written here since the given id, with the run_id a merge would keep
+LOCAL_SINCE = (
+    sqlalchemy.select(
+        main.BONES_TABLE.c.id,
+        main.BONES_TABLE.c.run_id,
+        *(main.BONES_TABLE.c[field] for field in main.BONES_FIELDS),
+    )
+    .where(main.BONES_TABLE.c.id > sqlalchemy.bindparam("last_id"))
+    .order_by(main.BONES_TABLE.c.id)
+)
+MERGED_RUN_IDS = sqlalchemy.select(main.BONES_TABLE.c.run_id).where(
+    main.BONES_TABLE.c.run_id.in_(sqlalchemy.bindparam("run_ids", expanding=True))
+)
+
+
+def last_bones_id(engine):
+    """ The id of the last run saved to a bones database, or 0 """
+    with engine.connect() as conn:
+        return conn.execute(main.LAST_BONES_ID).scalar() or 0
+
+
+class Leaderboard:
+    """ The best runs by score, as encoded rows; ties keep save order """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = []
+        self.saved = 0
+
+    def add(self, score, row):
+        self.saved += 1
+        bisect.insort(self.entries, (-score, self.saved, row))
+        if len(self.entries) > self.size:
+            self.entries.pop()
+
+    def top(self, n):
+        return [row for (_, _, row) in self.entries[:n]]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            (command, _, arg) = line.decode("utf-8").rstrip("\n").partition("\t")
+            try:
+                if command == "S":
+                    rows = main.encode_standing(self.server.save(arg))
+                elif command == "T":
+                    (n, _, board) = arg.partition("\t")
+                    rows = self.server.leaderboard_top(int(n), board or "all")
+                elif command == "N":
+                    (n, _, text) = arg.partition("\t")
+                    n = min(int(n), self.server.leaderboard_size)
+                    found = main.search_bones(text, n)
+                    rows = [main.encode_bones(bones) for bones in found]
+                else:
+                    raise ValueError(f"unknown command {command!r}")
+            except ValueError as e:
+                reply = f"ERR {e}\n\n"
+            except Exception as e:
+                logging.exception(f"{command} request failed")
+                reply = f"ERR {type(e).__name__}\n\n"
+            else:
+                reply = "".join(f"{row}\n" for row in ["OK", *rows, ""])
+            self.wfile.write(reply.encode("utf-8"))
+
+
+class HighscoreServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, leaderboard_size, batch_size, flush_interval):
+        self.leaderboard_size = min(leaderboard_size, main.LEADERBOARD_SIZE)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.wake = threading.Event()
+        # when expired leaderboard periods were last dropped
+        self.pruned = None
+        # {(board, period): Leaderboard} for the current period of each board
+        self.leaderboards = {}
+        # includes saves still waiting to be written
+        self.score_counts = Counter(dict(main.score_counts()))
+        # with GLOBAL_BONES: runs written here that are not merged yet, the
+        # local id up to which every run is, and the merged database's last id
+        self.unmerged = []
+        self.merged_up_to = last_bones_id(main.database_engine())
+        self.global_last_id = last_bones_id(main.leaderboard_engine())
+        super().__init__(path, RequestHandler)
+        self.flusher = threading.Thread(target=self.flush_forever, daemon=True)
+        self.flusher.start()
+
+    def save(self, row):
+        """ Queues a run and returns its Standing
+
+        The rank counts every save, but the neighbouring runs are only those
+        already written.
+        """
+        bones = main.decode_bones(row)
+        if bones.saved_at is None:
+            bones = bones._replace(saved_at=datetime.now())
+        row = main.encode_bones(bones)
+        with self.lock:
+            self.pending.append(bones)
+            for key in main.leaderboard_periods(bones.saved_at):
+                if key in self.leaderboards:
+                    self.leaderboards[key].add(bones.PTS, row)
+            if len(self.pending) >= self.batch_size:
+                self.wake.set()
+            self.score_counts[bones.PTS] += 1
+            counts = list(self.score_counts.items())
+        try:
+            return main.standing(bones.PTS, counts=counts)
+        except Exception:
+            # the run is queued, so the save has to be acknowledged: an error
+            # would have the game save it again
+            logging.exception("Could not look up a saved run's neighbours")
+            (ranks, runs, percentile) = main.rank_scores(bones.PTS, counts)
+            return main.Standing(ranks.get(bones.PTS, 1), runs, percentile, [], [])
+
+    def leaderboard_top(self, n, board):
+        if board not in main.HIGHSCORE_BOARDS:
+            raise ValueError(f"unknown leaderboard {board!r}")
+        key = (board, main.current_period(board))
+        with self.lock:
+            if key in self.leaderboards:
+                return self.leaderboards[key].top(n)
+        # a period not seen yet; load it while no batch is half-written
+        with self.flush_lock, self.lock:
+            if key not in self.leaderboards:
+                for old in [k for k in self.leaderboards if k[0] == board]:
+                    del self.leaderboards[old]
+                self.leaderboards[key] = self.load_leaderboard(*key)
+            return self.leaderboards[key].top(n)
+
+    def load_leaderboard(self, board, period):
+        leaderboard = Leaderboard(self.leaderboard_size)
+        saved = main.top_bones(self.leaderboard_size, board, period)
+        unsaved = [
+            bones
+            for bones in self.unmerged + self.pending
+            if (board, period) in main.leaderboard_periods(bones.saved_at)
+        ]
+        for bones in saved + unsaved:
+            leaderboard.add(bones.PTS or 0, main.encode_bones(bones))
+        return leaderboard
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                (batch, self.pending) = (self.pending, [])
+            if not batch:
+                return
+            try:
+                main.save_bones(batch)
+            except Exception:
+                logging.exception(f"Could not save {len(batch)} bones, retrying")
+                with self.lock:
+                    self.pending[:0] = batch
+                return
+            logging.info(f"Saved {len(batch)} bones")
+            if main.GLOBAL_BONES:
+                with self.lock:
+                    self.unmerged.extend(batch)
+            interval = main.LEADERBOARD_PRUNE_INTERVAL.total_seconds()
+            if self.pruned is None or time.monotonic() - self.pruned > interval:
+                main.prune_leaderboards()
+                self.pruned = time.monotonic()
+
+    def refresh_merged(self):
+        """ Reloads ranks and leaderboards once GLOBAL_BONES has new runs """
+        last_id = last_bones_id(main.leaderboard_engine())
+        if last_id == self.global_last_id:
+            return
+        with self.flush_lock:
+            # every run written here is either merged or in this list
+            with main.database_engine().connect() as conn:
+                params = {"last_id": self.merged_up_to}
+                written = conn.execute(LOCAL_SINCE, params).fetchall()
+            run_ids = [row.run_id for row in written]
+            merged = set()
+            with main.leaderboard_engine().connect() as conn:
+                while run_ids:
+                    (chunk, run_ids) = (run_ids[:500], run_ids[500:])
+                    rows = conn.execute(MERGED_RUN_IDS, {"run_ids": chunk})
+                    merged.update(run_id for (run_id,) in rows)
+            unmerged = [row for row in written if row.run_id not in merged]
+            if unmerged:
+                self.merged_up_to = unmerged[0].id - 1
+            elif written:
+                self.merged_up_to = written[-1].id
+            counts = Counter(dict(main.score_counts()))
+            with self.lock:
+                self.unmerged = [main.Bones._make(row[2:]) for row in unmerged]
+                for bones in self.unmerged + self.pending:
+                    counts[bones.PTS] += 1
+                self.score_counts = counts
+                # loaded again on their next request, with the merged runs
+                self.leaderboards = {}
+                self.global_last_id = last_id
+        logging.info(f"Reloaded ranks, {len(unmerged)} runs here not merged yet")
+
+    def flush_forever(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+                if main.GLOBAL_BONES:
+                    self.refresh_merged()
+            except Exception:
+                # the saves keep coming, so the flusher must keep going
+                logging.exception("Flush failed")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default="data/highscores.sock")
+    parser.add_argument(
+        "--leaderboard-size",
+        type=int,
+        default=100,
+        help="runs kept in memory; T requests are capped to this",
+    )
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=1.0,
+        help="maximum seconds a save waits before being written",
+    )
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+    claim_socket(args.socket)
+    server = HighscoreServer(
+        args.socket, args.leaderboard_size, args.batch_size, args.flush_interval
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        server.flush()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Load-test the game the way gotty serves it: one main.py per pseudo-terminal.
+
+Each bot spawns main.py under its own pty, plays a whole life with scripted
+keypresses and human-ish think times, saves its score, and quits. Concurrency
+is ramped through the given levels:
+
+    python chargen/loadtest.py --ramp 1 5 10 20 --workdir /tmp/chargen-load
+
+The games run in a scratch directory unless --workdir names one. Bots save
+their runs, so a --workdir that already has a bones database, such as a
+deployed one, is refused unless --live is also given.
+
+For every level it reports keypress-to-output latency, startup time, save
+latency, CPU seconds and peak RSS per session, and how long a probe has to
+wait for the SQLite write lock while the bots are playing. Linux only, since
+it reads /proc.
+"""
+import argparse
+import fcntl
+import os
+import pty
+import random
+import re
+import select
+import signal
+import sqlite3
+import statistics
+import struct
+import sys
+import tempfile
+import termios
+import threading
+import time
+
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+ANSI = re.compile(rb"\x1b(\[[0-9;?]*[ -/]*[@-~]|[()][0-9A-Za-z]|[=>78])")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+KEYS = {"enter": b"\r", "up": b"\x1b[A", "down": b"\x1b[B", "right": b"\x1b[C"}
+
+
+class Session:
+    """ One main.py under a pty, driven by a scripted bot """
+
+    def __init__(self, workdir, name, think, game_args=(), columns=100, rows=40):
+        self.name = name
+        self.think = think
+        self.latencies = []
+        self.bytes_read = 0
+        self.startup = None
+        self.save_latency = None
+        self.cpu = None
+        self.rss_kb = None
+        self.finished = False
+        self.screen = ""
+        started = time.perf_counter()
+        (self.pid, self.fd) = pty.fork()
+        if self.pid == 0:
+            os.chdir(workdir)
+            os.environ["TERM"] = "xterm"
+            os.execv(sys.executable, [sys.executable, MAIN, *game_args])
+        winsize = struct.pack("HHHH", rows, columns, 0, 0)
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, winsize)
+        first = self.read_output(timeout=30)
+        if first is not None:
+            self.startup = first - started
+
+    def read_output(self, timeout, quiet=0.02):
+        """ Reads until the screen has been quiet for a moment
+
+        Returns when the first byte arrived, or None if nothing did.
+        """
+        first = None
+        deadline = time.perf_counter() + timeout
+        while True:
+            wait = quiet if first is not None else deadline - time.perf_counter()
+            if wait <= 0 or not select.select([self.fd], [], [], wait)[0]:
+                return first
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                return first
+            if not data:
+                return first
+            if first is None:
+                first = time.perf_counter()
+            self.bytes_read += len(data)
+            text = ANSI.sub(b"", data).decode("utf-8", "replace")
+            self.screen = (self.screen + text)[-8192:]
+
+    def press(self, key, pause=None, timeout=5):
+        """ Sends a key and returns whether the screen changed in response """
+        time.sleep(pause if pause is not None else self.pause())
+        self.screen = ""
+        sent = time.perf_counter()
+        os.write(self.fd, KEYS.get(key, key.encode()))
+        first = self.read_output(timeout)
+        if first is not None:
+            self.latencies.append(first - sent)
+        return first is not None
+
+    def pause(self, scale=1.0):
+        return random.lognormvariate(0, 0.5) * self.think * scale
+
+    def play(self, max_keys=3000):
+        self.press("enter")
+        # spend all of PointBuy.TOTAL_POINTS, holding the arrow key like a person
+        for _ in range(4):
+            for _ in range(6):
+                self.press("right", self.pause(0.1))
+            self.press("down", self.pause(0.3))
+        self.press("enter")
+        for _ in range(max_keys):
+            if "Enter to save highscore" in self.screen:
+                break
+            for _ in range(random.choice((0, 0, 0, 1, 2))):
+                self.press("j", self.pause(0.2))
+            if not self.press("enter", timeout=0.5):
+                # landed on a disabled choice
+                self.press("k", self.pause(0.2))
+        else:
+            return
+        for ch in self.name:
+            self.press(ch, self.pause(0.2))
+        sent = time.perf_counter()
+        self.press("enter", 0, timeout=30)
+        while "SAVED" not in self.screen:
+            if self.read_output(timeout=30) is None:
+                return
+        self.save_latency = time.perf_counter() - sent
+        self.finished = True
+
+    def close(self):
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime and stime are fields 14 and 15, counted from 1
+            self.cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        self.rss_kb = int(line.split()[1])
+        except (OSError, IndexError):
+            pass
+        try:
+            # like ctrl-c, so the game gets to log its session summary
+            os.kill(self.pid, signal.SIGINT)
+            deadline = time.perf_counter() + 5
+            while os.waitpid(self.pid, os.WNOHANG) == (0, 0):
+                if time.perf_counter() > deadline:
+                    os.kill(self.pid, signal.SIGKILL)
+                    os.waitpid(self.pid, 0)
+                    break
+                self.read_output(timeout=0.05)
+        except OSError:
+            pass
+        os.close(self.fd)
+
+
+class LockProbe(threading.Thread):
+    """ Repeatedly times how long it takes to take the bones write lock """
+
+    def __init__(self, path, interval=0.05):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.waits = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not os.path.exists(self.path) and not self.stopped.is_set():
+            time.sleep(self.interval)
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        while not self.stopped.wait(self.interval):
+            start = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError:
+                continue
+            self.waits.append(time.perf_counter() - start)
+            conn.execute("ROLLBACK")
+        conn.close()
+
+
+def run_level(workdir, concurrency, think, game_args=()):
+    sessions = []
+    lock = threading.Lock()
+
+    def bot(i):
+        session = Session(workdir, f"bot{concurrency}x{i}", think, game_args)
+        with lock:
+            sessions.append(session)
+        try:
+            session.play()
+        finally:
+            session.close()
+
+    probe = LockProbe(os.path.join(workdir, "data", "bones.sqlite"))
+    probe.start()
+    threads = [threading.Thread(target=bot, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        # stagger arrivals instead of a thundering herd
+        time.sleep(random.uniform(0, think))
+        thread.start()
+    for thread in threads:
+        thread.join()
+    probe.stopped.set()
+    probe.join()
+    return sessions, probe.waits
+
+
+def percentiles(values, scale=1000.0):
+    if not values:
+        return "n/a"
+    values = sorted(values)
+
+    def at(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * scale
+
+    return f"p50 {at(0.5):8.2f}  p95 {at(0.95):8.2f}  p99 {at(0.99):8.2f}"
+
+
+def report(concurrency, sessions, lock_waits):
+    finished = [s for s in sessions if s.finished]
+    latencies = [lat for s in sessions for lat in s.latencies]
+    print(f"== {concurrency} concurrent sessions, {len(finished)} finished")
+    print(f"  keypress latency ms  {percentiles(latencies)}")
+    sent = sum(s.bytes_read for s in sessions)
+    print(
+        f"  terminal output      {sent / len(sessions) / 1024:.1f} KiB per session,"
+        f" {sent / max(len(latencies), 1):.0f} bytes per key"
+    )
+    startups = [s.startup for s in sessions if s.startup is not None]
+    print(f"  startup ms           {percentiles(startups)}")
+    print(f"  save ms              {percentiles([s.save_latency for s in finished])}")
+    print(f"  lock wait ms         {percentiles(lock_waits)}")
+    cpu = [s.cpu for s in sessions if s.cpu is not None]
+    rss = [s.rss_kb for s in sessions if s.rss_kb is not None]
+    if cpu and rss:
+        print(
+            f"  per session          cpu {statistics.mean(cpu):.2f}s"
+            f"  peak rss {statistics.mean(rss) / 1024:.1f} MiB"
+            f" (max {max(rss) / 1024:.1f})"
+        )
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ramp", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument(
+        "--think",
+        type=float,
+        default=0.8,
+        help="mean seconds a bot takes to decide (default: 0.8)",
+    )
+    parser.add_argument(
+        "--workdir",
+        help="directory the games run in, sharing its data/bones.sqlite"
+        " (default: a scratch directory)",
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="allow a --workdir whose bones database already exists",
+    )
+    parser.add_argument(
+        "--game-args",
+        default="",
+        help="extra arguments for main.py, e.g. '--low-bandwidth'",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    if args.workdir is None:
+        workdir = tempfile.mkdtemp(prefix="chargen-load-")
+        print(f"Running in {workdir}")
+    else:
+        workdir = os.path.abspath(args.workdir)
+        bones = os.path.join(workdir, "data", "bones.sqlite")
+        if os.path.exists(bones) and not args.live:
+            parser.error(f"{bones} exists; pass --live to add bot runs to it")
+        os.makedirs(workdir, exist_ok=True)
+    for concurrency in args.ramp:
+        (sessions, lock_waits) = run_level(
+            workdir, concurrency, args.think, args.game_args.split()
+        )
+        report(concurrency, sessions, lock_waits)
+
+
+if __name__ == "__main__":
+    main_cli()
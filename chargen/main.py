@@ -1,19 +1,51 @@
 #!/usr/bin/env python3
-from collections import namedtuple
-from datetime import date
+import argparse
+import asyncio
+import cProfile
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from enum import Enum
+import functools
+import gc
+import gzip
+import hashlib
+import inspect
+import io
+import json
 import logging
+import math
 import os
 import random
+import re
+import pstats
+import resource
+import signal
+import socket
+import sys
+import time
+import tracemalloc
+import uuid
 
 import urwid
 import sqlalchemy
-from sqlalchemy.ext.declarative import declarative_base
 
 
 logging.basicConfig(filename="log.txt", level=logging.DEBUG)
 
 
+def log_to_stderr(level=logging.INFO):
+    """ Also shows log messages on stderr, for the command-line tools
+
+    Importing this module has already configured logging, so basicConfig()
+    would do nothing for them.
+    """
+    handler = logging.StreamHandler()
+    handler.setLevel(level)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.getLogger().addHandler(handler)
+
+
 PALETTE = [
     ("disabled", "dark gray", ""),
     ("reversed", "standout", ""),
@@ -28,14 +60,315 @@ def is_prime(n):
     return all(n % i for i in range(2, n))
 
 
+# when set, scores are kept by highscored.py and this process never opens the db
+HIGHSCORE_SOCKET = os.environ.get("CHARGEN_HIGHSCORE_SOCKET")
+# when set, highscores and name searches are read from this database, as
+# merged from every node by merge_bones.py, while saves stay local
+GLOBAL_BONES = os.environ.get("CHARGEN_GLOBAL_BONES")
+# when set, a game waits for a slot from sessiond.py before it starts
+SESSION_SOCKET = os.environ.get("CHARGEN_SESSION_SOCKET")
+# saves and highscore queries run here, off the thread that draws the screen
+DATABASE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="database")
+# where games started with --spectate listen for viewers; see spectate.py
+SPECTATE_DIR = "data/spectate"
+# CHARGEN_PROFILE=cprofile or sample profiles the whole session, and SIGUSR1
+# starts or stops a profile at any time; each one is written here on stopping
+PROFILE = os.environ.get("CHARGEN_PROFILE")
+PROFILE_DIR = "data/profiles"
+# when set, functions marked @timed log their call counts and times per session
+TIMINGS_ENABLED = bool(os.environ.get("CHARGEN_TIMINGS"))
+# a Python file of content tables replacing the ones below; see load_content
+CONTENT_FILE = os.environ.get("CHARGEN_CONTENT")
+# where games started with --record-trace save their keypresses; see replay.py
+TRACE_DIR = "data/traces"
+# one JSON line per resolved event choice; see compact_telemetry.py
+TELEMETRY_LOG = "data/telemetry.jsonl"
+
+
+# runs kept per leaderboard period, and how long old periods are kept
+LEADERBOARD_SIZE = 100
+LEADERBOARD_RETENTION = {
+    "day": timedelta(days=8),
+    "week": timedelta(weeks=5),
+    "season": timedelta(days=92),
+}
+# how often highscored.py drops expired periods; archive_seasons.py does too
+LEADERBOARD_PRUNE_INTERVAL = timedelta(hours=1)
+
+
+Standing = namedtuple("Standing", ["rank", "runs", "percentile", "above", "below"])
+
+
 def save(name, char_info):
-    bones = Bones(name, char_info)
-    DATABASE_SESSION.add(bones)
-    DATABASE_SESSION.commit()
+    """ Saves a run and returns its Standing among all runs """
+    bones = Bones.from_char_info(name, char_info)
+    if HIGHSCORE_SOCKET:
+        try:
+            return decode_standing(highscore_request("S", encode_bones(bones)))
+        except HighscoreUnavailable:
+            # only when nothing was sent; once it has been, the server may
+            # have queued the run, and saving it here too would store it twice
+            logging.exception("Highscore server unavailable, saving locally")
+    (bones_id,) = save_bones([bones])
+    if GLOBAL_BONES:
+        # ranked among the merged runs, which do not have this one yet
+        counts = Counter(dict(score_counts()))
+        counts[bones.PTS] += 1
+        return standing(bones.PTS, counts=list(counts.items()))
+    return standing(bones.PTS, bones_id)
+
+
+def get_highscores(board="all"):
+    """ The best 10 runs of the current day, week or all time """
+    if HIGHSCORE_SOCKET:
+        try:
+            rows = highscore_request("T", f"10\t{board}")
+            return [decode_bones(row) for row in rows]
+        except OSError:
+            logging.exception("Highscore server unavailable, reading locally")
+    return top_bones(10, board, current_period(board))
 
 
-def get_highscores():
-    return list(DATABASE_SESSION.query(Bones).order_by(Bones.PTS.desc()).limit(10))
+def search_highscores(text, n=10):
+    """ The best n runs with a name matching text, as by search_bones """
+    if HIGHSCORE_SOCKET:
+        try:
+            rows = highscore_request("N", f"{n}\t{text}")
+            return [decode_bones(row) for row in rows]
+        except OSError:
+            logging.exception("Highscore server unavailable, searching locally")
+    return search_bones(text, n)
+
+
+def leaderboard_period(board, when):
+    """ The key of the day, week, season or all-time period containing when """
+    if board == "day":
+        return when.strftime("%Y-%m-%d")
+    if board == "week":
+        return when.strftime("%G-W%V")
+    if board == "season":
+        return season_of(when)
+    return "all"
+
+
+def current_period(board):
+    return leaderboard_period(board, datetime.now())
+
+
+def leaderboard_periods(saved_at, boards=None):
+    """ Every (board, period) a run saved at saved_at counts towards """
+    boards = HIGHSCORE_BOARDS if boards is None else boards
+    if saved_at is None:
+        # saved before runs were timestamped
+        return [("all", "all")] if "all" in boards else []
+    return [(b, leaderboard_period(b, saved_at)) for b in boards]
+
+
+def save_bones(runs):
+    """ Inserts Bones in one transaction, as a single executemany
+
+    The leaderboard and score rollups are updated in the same transaction.
+    Returns the ids the runs were saved with.
+    """
+    with database_engine().begin() as conn:
+        saved = insert_bones(conn, [bones._asdict() for bones in runs])
+    return [bones_id for (bones_id, _, _) in saved]
+
+
+def insert_bones(conn, rows):
+    """ Inserts bones table rows along with their leaderboard and score rollups
+
+    Rows whose run_id is already saved are skipped. Returns (id, PTS,
+    saved_at) for the rows inserted.
+    """
+    last_id = conn.execute(LAST_BONES_ID).scalar()
+    conn.execute(BONES_INSERT, rows)
+    saved = conn.execute(BONES_SINCE, {"last_id": last_id or 0}).fetchall()
+    update_leaderboards(conn, saved)
+    count_scores(conn, [pts for (_, pts, _) in saved])
+    conn.execute(NAME_INDEX_SINCE, {"last_id": last_id or 0})
+    return saved
+
+
+def update_leaderboards(conn, saved, boards=None):
+    """ Adds (id, PTS, saved_at) rows to their leaderboards and trims them """
+    entries = []
+    for (bones_id, pts, saved_at) in saved:
+        for (board, period) in leaderboard_periods(saved_at, boards):
+            entries.append(
+                {"board": board, "period": period, "bones_id": bones_id, "PTS": pts}
+            )
+    if not entries:
+        return
+    conn.execute(LEADERBOARD_INSERT, entries)
+    periods = {(e["board"], e["period"]) for e in entries}
+    conn.execute(LEADERBOARD_TRIM, [{"board": b, "period": p} for (b, p) in periods])
+
+
+def prune_leaderboards(engine=None):
+    """ Drops leaderboard periods older than LEADERBOARD_RETENTION """
+    with (engine or database_engine()).begin() as conn:
+        for (board, keep) in LEADERBOARD_RETENTION.items():
+            oldest = leaderboard_period(board, datetime.now() - keep)
+            conn.execute(LEADERBOARD_PRUNE, {"board": board, "oldest": oldest})
+
+
+def count_scores(conn, scores):
+    """ Adds runs to the score histogram that ranks are computed from """
+    counts = Counter(pts for pts in scores if pts is not None)
+    if counts:
+        conn.execute(
+            SCORE_COUNT_ADD, [{"pts": pts, "runs": n} for (pts, n) in counts.items()]
+        )
+
+
+def score_counts():
+    """ [(PTS, runs)] for every score saved, best first """
+    with leaderboard_engine().connect() as conn:
+        return conn.execute(SCORE_COUNTS).fetchall()
+
+
+def standing(pts, bones_id=None, counts=None, n=5):
+    """ Where a run scoring pts places among all runs, and the n either side
+
+    Ranks are shared by equal scores, and ties are listed oldest first. A
+    bones_id of None places the run after every saved run with its score.
+    Ranks count runs in archived seasons too, but neighbours are only drawn
+    from data/bones.sqlite, or GLOBAL_BONES if set; see archive_seasons.py.
+    counts is the score histogram, as from score_counts(); by default it is
+    read from the database. above and below are (rank, Bones) pairs, nearest
+    first.
+    """
+    if counts is None:
+        counts = score_counts()
+    (ranks, runs, percentile) = rank_scores(pts, counts)
+    if bones_id is None:
+        bones_id = sys.maxsize
+    params = {"pts": pts, "bones_id": bones_id, "n": n}
+    sides = []
+    with leaderboard_engine().connect() as conn:
+        for (tied, beyond) in (
+            (TIED_ABOVE, SCORES_ABOVE),
+            (TIED_BELOW, SCORES_BELOW),
+        ):
+            rows = conn.execute(tied, params).fetchall()
+            if len(rows) < n:
+                rows += conn.execute(beyond, dict(params, n=n - len(rows)))
+            sides.append([(ranks.get(row.PTS), Bones._make(row)) for row in rows])
+    (above, below) = sides
+    return Standing(ranks.get(pts, 1), runs, percentile, above, below)
+
+
+def rank_scores(pts, counts):
+    """ ({score: rank}, runs, percentile of pts) from a score histogram """
+    ranks = {}
+    runs = lower = 0
+    for (score, score_runs) in sorted(counts, reverse=True):
+        ranks[score] = runs + 1
+        runs += score_runs
+        if score < pts:
+            lower += score_runs
+    percentile = 100 * lower / runs if runs else 100
+    return (ranks, runs, percentile)
+
+
+def top_bones(n, board="all", period="all"):
+    """ The best n runs of a leaderboard period, at most LEADERBOARD_SIZE """
+    with leaderboard_engine().connect() as conn:
+        rows = conn.execute(TOP_BONES, {"board": board, "period": period, "n": n})
+        return [Bones._make(row) for row in rows]
+
+
+def search_bones(text, n=10):
+    """ The best n runs whose names have a word starting with each word of text
+
+    Matching ignores case and accents, so "jo sm" finds "John Smith" and
+    "jose" finds "José".
+    """
+    words = NAME_WORDS.findall(text)
+    if not words:
+        return []
+    query = " ".join(f'"{word}"*' for word in words)
+    with leaderboard_engine().connect() as conn:
+        rows = conn.execute(NAME_SEARCH, {"query": query, "n": n})
+        return [Bones._make(row) for row in rows]
+
+
+def season_of(when):
+    """ The season, a calendar quarter such as "2026-Q4", containing when """
+    return f"{when.year}-Q{(when.month - 1) // 3 + 1}"
+
+
+def encode_bones(bones):
+    """ One line of the highscore protocol
+
+    The name, stats, a skill bitmask and the unix time the run was saved.
+    """
+    name = " ".join(bones.name.split())
+    # rows saved before a stat was added have NULL for it
+    stats = ",".join(str(getattr(bones, stat.name) or 0) for stat in STATS)
+    skills = sum(
+        1 << i for (i, skill) in enumerate(SKILLS) if getattr(bones, skill.name)
+    )
+    saved_at = int(bones.saved_at.timestamp()) if bones.saved_at else ""
+    return f"{name}\t{stats}\t{skills:x}\t{saved_at}"
+
+
+def decode_bones(line):
+    (name, stats, skills, saved_at) = line.split("\t")
+    skills = int(skills, 16)
+    return Bones(
+        name,
+        *map(int, stats.split(",")),
+        *(bool(skills >> i & 1) for i in range(len(SKILLS))),
+        datetime.fromtimestamp(int(saved_at)) if saved_at else None,
+    )
+
+
+def encode_standing(standing):
+    """ Protocol rows for a Standing: the rank line, then each neighbour """
+    rows = [f"{standing.rank}\t{standing.runs}\t{standing.percentile}"]
+    for (side, neighbours) in (("above", standing.above), ("below", standing.below)):
+        for (rank, bones) in neighbours:
+            rows.append(f"{side}\t{rank}\t{encode_bones(bones)}")
+    return rows
+
+
+def decode_standing(rows):
+    (rank, runs, percentile) = rows[0].split("\t")
+    sides = {"above": [], "below": []}
+    for row in rows[1:]:
+        (side, neighbour_rank, bones) = row.split("\t", 2)
+        sides[side].append((int(neighbour_rank), decode_bones(bones)))
+    return Standing(
+        int(rank), int(runs), float(percentile), sides["above"], sides["below"]
+    )
+
+
+class HighscoreUnavailable(OSError):
+    """ highscored.py could not be reached, so the request was never sent """
+
+
+def highscore_request(command, arg):
+    """ Sends one request to highscored.py and returns its reply rows """
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.settimeout(5)
+        try:
+            sock.connect(HIGHSCORE_SOCKET)
+        except OSError as e:
+            raise HighscoreUnavailable(f"highscore server: {e}") from e
+        with sock.makefile("rw", encoding="utf-8", newline="\n") as f:
+            f.write(f"{command}\t{arg}\n")
+            f.flush()
+            status = f.readline().rstrip("\n")
+            rows = []
+            for row in f:
+                if row == "\n":
+                    break
+                rows.append(row.rstrip("\n"))
+    if status != "OK":
+        raise OSError(f"highscore server: {status}")
+    return rows
 
 
 class CharInfo:
@@ -307,14 +640,16 @@ SKILL_STAT_PREREQS = {
 }
 
 
-def get_skill_desc(skill):
+def get_skill_desc(skill, content=None):
+    content = content or CONTENT
     desc = SKILL_DESCS.get(skill, "")
-    if skill in SKILL_PREREQS:
-        desc += f'\n\nPrereqs: {", ".join(s.value for s in SKILL_PREREQS[skill])}'
-    if skill in SKILL_STAT_PREREQS:
+    if skill in content.skill_prereqs:
+        prereqs = ", ".join(s.value for s in content.skill_prereqs[skill])
+        desc += f"\n\nPrereqs: {prereqs}"
+    if skill in content.skill_stat_prereqs:
         desc += "\n\nRequired stats:"
-        for stat in SKILL_STAT_PREREQS[skill]:
-            desc += f"\n    {SKILL_STAT_PREREQS[skill][stat]} {stat.value}"
+        for (stat, req) in content.skill_stat_prereqs[skill].items():
+            desc += f"\n    {req} {stat.value}"
 
     return desc
 
@@ -395,12 +730,69 @@ AGES = [
 StatCheck = namedtuple("StatCheck", ["stat", "num_dice", "sides", "dc"])
 
 
+SKILL_BITS = {skill: 1 << i for (i, skill) in enumerate(SKILLS)}
+
+
+def skill_mask(skills):
+    """ skills as an int with the SKILL_BITS of each one set """
+    mask = 0
+    for skill in skills:
+        mask |= SKILL_BITS[skill]
+    return mask
+
+
+class Requirement:
+    """ Skills and stat bounds a player must have, compiled for fast checks
+
+    The skills become one bitmask and the stats a tuple of (stat, lowest,
+    highest) bounds, both inclusive. allows() takes the player's skills as a
+    mask, so a whole menu, or many players, can be checked against one
+    skill_mask. Calling a Requirement with a player checks just that player.
+    """
+
+    def __init__(self, skills=(), at_least=None, at_most=None, never=False):
+        self.skills = frozenset(skills)
+        self.at_least = dict(at_least or {})
+        self.at_most = dict(at_most or {})
+        self.never = never
+        self.mask = skill_mask(self.skills)
+        self.bounds = tuple(
+            (stat, self.at_least.get(stat, -math.inf), self.at_most.get(stat, math.inf))
+            for stat in STATS
+            if stat in self.at_least or stat in self.at_most
+        )
+
+    def allows(self, stats, mask):
+        if self.never or mask & self.mask != self.mask:
+            return False
+        for (stat, lowest, highest) in self.bounds:
+            if not lowest <= stats[stat] <= highest:
+                return False
+        return True
+
+    def __call__(self, player):
+        return self.allows(player.stats, skill_mask(player.skills))
+
+
+ANYONE = Requirement()
+# for events that only happen when another event triggers them
+TRIGGERED_ONLY = Requirement(never=True)
+
+
+def eligibility(requirements, players):
+    """ For each player, whether each requirement allows them """
+    return [
+        [r.allows(player.stats, mask) for r in requirements]
+        for (player, mask) in ((p, skill_mask(p.skills)) for p in players)
+    ]
+
+
 class Event:
-    def __init__(self, desc, choices, age_req=None, prereq_fn=lambda player: True):
+    def __init__(self, desc, choices, age_req=None, requires=ANYONE):
         self.desc = desc
         self.age_req = age_req
         self.choices = choices
-        self.prereq_fn = prereq_fn
+        self.requires = requires
 
 
 class EventChoice:
@@ -411,6 +803,11 @@ class EventChoice:
         self.success = success
         self.stat_reqs = stat_reqs if stat_reqs is not None else {}
         self.skill_reqs = skill_reqs if skill_reqs is not None else []
+        # stat_reqs are exclusive, and stats are whole numbers
+        self.requires = Requirement(
+            self.skill_reqs,
+            at_least={stat: req + 1 for (stat, req) in self.stat_reqs.items()},
+        )
         self.checks = checks = checks if checks is not None else []
         self.failure = failure
         if self.failure is None:
@@ -490,7 +887,7 @@ EVENTS = {
         ],
     ),
     "leaves": Event(
-        prereq_fn=lambda player: player.stats[STATS.AGE] <= 15,
+        requires=Requirement(at_most={STATS.AGE: 15}),
         desc="Leaves for dinner.",
         choices=[
             EventChoice(
@@ -524,7 +921,7 @@ EVENTS = {
         ],
     ),
     "mountain": Event(
-        prereq_fn=lambda player: player.stats[STATS.AGE] > 5,
+        requires=Requirement(at_least={STATS.AGE: 6}),
         desc="You encounter a tall mountain. What do you do?",
         choices=[
             EventChoice(
@@ -570,7 +967,7 @@ EVENTS = {
         ],
     ),
     "scrawlings": Event(
-        prereq_fn=lambda player: False,
+        requires=TRIGGERED_ONLY,
         desc="The scrawlings contain a map to a legendary amulet located"
         " under the mountain.",
         choices=[
@@ -594,7 +991,7 @@ EVENTS = {
         ],
     ),
     "nethack": Event(
-        prereq_fn=lambda player: False,
+        requires=TRIGGERED_ONLY,
         desc="You find yourself in the middle of an huge yet familiar dungeon.",
         choices=[
             EventChoice(
@@ -959,7 +1356,7 @@ EVENTS = {
         ],
     ),
     "job": Event(
-        prereq_fn=lambda player: player.stats[STATS.AGE] > 18,
+        requires=Requirement(at_least={STATS.AGE: 19}),
         desc="It is time to choose a profession. Every child of the village"
         " is given a role once they come of age. To what shall you dedicate the"
         " rest of your existence?",
@@ -1106,7 +1503,7 @@ EVENTS = {
         ],
     ),
     "pet": Event(
-        prereq_fn=lambda player: SKILLS.ANIMALS in player.skills,
+        requires=Requirement({SKILLS.ANIMALS}),
         desc="You hear a familiar call. Your long-lost pet runs towards you joyfully!"
         " Your pet is...",
         choices=[
@@ -1129,7 +1526,7 @@ EVENTS = {
         ],
     ),
     "faire": Event(
-        prereq_fn=lambda player: player.stats[STATS.AGE] > 15,
+        requires=Requirement(at_least={STATS.AGE: 16}),
         desc="Lights and sounds are all around you at the sun festival!",
         choices=[
             EventChoice(
@@ -1170,7 +1567,7 @@ EVENTS = {
     ),
     "president": Event(
         desc="The presidential election is coming up.",
-        prereq_fn=lambda player: player.stats[STATS.AGE] >= 35,
+        requires=Requirement(at_least={STATS.AGE: 35}),
         choices=[
             EventChoice(
                 name="Run for President",
@@ -1212,58 +1609,396 @@ EVENTS = {
 }
 
 
+Content = namedtuple(
+    "Content",
+    [
+        "version",
+        "events",
+        "ages",
+        "skill_prereqs",
+        "skill_stat_prereqs",
+        # compiled from the two above: {skill: Requirement}, and {skill:
+        # [the skills it is a prerequisite of]}
+        "skill_requires",
+        "skill_unlocks",
+    ],
+)
+
+
+def make_content(version, events, ages, skill_prereqs, skill_stat_prereqs):
+    skill_requires = {
+        skill: Requirement(
+            skill_prereqs.get(skill, ()), at_least=skill_stat_prereqs.get(skill)
+        )
+        for skill in SKILLS
+    }
+    skill_unlocks = {skill: [] for skill in SKILLS}
+    for (skill, prereqs) in skill_prereqs.items():
+        for prereq in prereqs:
+            skill_unlocks[prereq].append(skill)
+    return Content(
+        version,
+        events,
+        ages,
+        skill_prereqs,
+        skill_stat_prereqs,
+        skill_requires,
+        skill_unlocks,
+    )
+
+
+def load_content(path):
+    """ Reads the content tables from a Python file
+
+    The file is run with this module's names, such as Event, STATS and
+    SKILLS, already defined. It may set any of EVENTS, AGES, SKILL_PREREQS and
+    SKILL_STAT_PREREQS, or change them in place; they start as copies of the
+    built-in ones. The Event objects are shared, so replace an event rather
+    than change it. Raises ValueError if the tables are inconsistent.
+    """
+    with open(path, "rb") as f:
+        source = f.read()
+    builtin = BUILTIN_CONTENT
+    # copies, so a file editing them leaves the tables every pinned game
+    # plays with alone, even if the reload is then rejected
+    namespace = dict(
+        globals(),
+        EVENTS=dict(builtin.events),
+        AGES=list(builtin.ages),
+        SKILL_PREREQS={
+            skill: list(prereqs) for (skill, prereqs) in builtin.skill_prereqs.items()
+        },
+        SKILL_STAT_PREREQS={
+            skill: dict(stats) for (skill, stats) in builtin.skill_stat_prereqs.items()
+        },
+    )
+    exec(compile(source, path, "exec"), namespace)
+    version = f"{os.path.basename(path)}@{hashlib.sha1(source).hexdigest()[:8]}"
+    content = make_content(
+        version,
+        namespace["EVENTS"],
+        namespace["AGES"],
+        namespace["SKILL_PREREQS"],
+        namespace["SKILL_STAT_PREREQS"],
+    )
+    validate_content(content)
+    return content
+
+
+def validate_content(content):
+    """ Raises ValueError for tables a game could not be played with """
+    ages = content.ages
+    if not ages or any(a >= b for (a, b) in zip(ages, ages[1:])):
+        raise ValueError("AGES must be a non-empty increasing list")
+    for (name, event) in content.events.items():
+        if not isinstance(event, Event) or not event.choices:
+            raise ValueError(f"event {name!r} has no choices")
+        if not isinstance(event.requires, Requirement):
+            raise ValueError(f"event {name!r} requires must be a Requirement")
+        if event.age_req is not None and event.age_req < 2:
+            raise ValueError(f"event {name!r} happens before age 2")
+        for choice in event.choices:
+            for check in choice.checks:
+                if not isinstance(getattr(check, "stat", None), STATS):
+                    raise ValueError(f"{name!r} choice {choice.name!r}: bad check")
+            for result in (choice.success, choice.failure):
+                if result is None:
+                    continue
+                for trigger in result.trigger_events:
+                    if trigger not in content.events:
+                        raise ValueError(
+                            f"{name!r} choice {choice.name!r} triggers unknown"
+                            f" event {trigger!r}"
+                        )
+    for (skill, prereqs) in content.skill_prereqs.items():
+        if not all(isinstance(s, SKILLS) for s in (skill, *prereqs)):
+            raise ValueError(f"SKILL_PREREQS of {skill!r} are not all skills")
+    for (skill, prereqs) in content.skill_stat_prereqs.items():
+        if not isinstance(skill, SKILLS) or not all(
+            isinstance(stat, STATS) for stat in prereqs
+        ):
+            raise ValueError(f"SKILL_STAT_PREREQS of {skill!r} are not all stats")
+
+
+def reload_content(path=None):
+    """ Loads and validates new content tables, then makes them current
+
+    Games keep the Content they started with; only new ones see the change.
+    If loading fails, the current tables are kept and the error is raised.
+    """
+    global CONTENT
+    start = time.perf_counter()
+    content = load_content(path or CONTENT_FILE)
+    CONTENT = content
+    elapsed = (time.perf_counter() - start) * 1000
+    logging.info(f"Loaded content {content.version} in {elapsed:.1f} ms")
+    return content
+
+
+BUILTIN_CONTENT = make_content(
+    "builtin", EVENTS, AGES, SKILL_PREREQS, SKILL_STAT_PREREQS
+)
+CONTENT = BUILTIN_CONTENT
+if CONTENT_FILE:
+    # offline tools such as simulate.py read the tables directly
+    (EVENTS, AGES, SKILL_PREREQS, SKILL_STAT_PREREQS) = reload_content()[1:5]
+
+
 def fragment_desc_getter(fragments, n):
     return lambda x: " ".join(random.sample(fragments[x], n))
 
 
-Base = declarative_base()
+BONES_FIELDS = [
+    "name",
+    *(stat.name for stat in STATS),
+    *(skill.name for skill in SKILLS),
+    "saved_at",
+]
+
 
+class Bones(namedtuple("Bones", BONES_FIELDS, defaults=(None,))):
+    """ One saved run, laid out like a row of the bones table """
 
-class Bones(object):
-    def __init__(self, name, char_info):
-        self.name = name
-        for stat in STATS:
-            setattr(self, stat.name, char_info.stats[stat])
-        for skill in SKILLS:
-            setattr(self, skill.name, skill in char_info.skills)
-
-
-def init_database():
-    os.makedirs("data", exist_ok=True)
-    engine = sqlalchemy.create_engine("sqlite:///data/bones.sqlite")
-    metadata = sqlalchemy.MetaData(bind=engine)
-    table = sqlalchemy.Table(
-        "bones",
-        metadata,
-        sqlalchemy.Column("id", sqlalchemy.Integer(), primary_key=True),
-        sqlalchemy.Column("name", sqlalchemy.String()),
-        *(sqlalchemy.Column(stat.name, sqlalchemy.Integer()) for stat in STATS),
-        *(sqlalchemy.Column(skill.name, sqlalchemy.Boolean()) for skill in SKILLS),
+    __slots__ = ()
+
+    @classmethod
+    def from_char_info(cls, name, char_info):
+        return cls(
+            name,
+            *(char_info.stats[stat] for stat in STATS),
+            *(skill in char_info.skills for skill in SKILLS),
+            datetime.now(),
+        )
+
+
+BONES_TABLE = sqlalchemy.Table(
+    "bones",
+    sqlalchemy.MetaData(),
+    sqlalchemy.Column("id", sqlalchemy.Integer(), primary_key=True),
+    sqlalchemy.Column("name", sqlalchemy.String()),
+    *(sqlalchemy.Column(stat.name, sqlalchemy.Integer()) for stat in STATS),
+    *(sqlalchemy.Column(skill.name, sqlalchemy.Boolean()) for skill in SKILLS),
+    sqlalchemy.Column("saved_at", sqlalchemy.DateTime()),
+    # identifies a run across every node's database; see merge_bones.py
+    sqlalchemy.Column("run_id", sqlalchemy.String(), default=lambda: uuid.uuid4().hex),
+)
+# the best LEADERBOARD_SIZE runs of each day, week, season and all time, kept
+# up to date by save_bones so a leaderboard never has to sort the whole bones
+# table
+LEADERBOARD_TABLE = sqlalchemy.Table(
+    "leaderboard",
+    BONES_TABLE.metadata,
+    sqlalchemy.Column("board", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("period", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("bones_id", sqlalchemy.Integer(), primary_key=True),
+    sqlalchemy.Column("PTS", sqlalchemy.Integer()),
+    sqlalchemy.Index("leaderboard_rank", "board", "period", "PTS"),
+)
+
+# built once, so every save and query reuses the same compiled statements
+BONES_INSERT = BONES_TABLE.insert().prefix_with("OR IGNORE")
+LAST_BONES_ID = sqlalchemy.select(sqlalchemy.func.max(BONES_TABLE.c.id))
+BONES_SINCE = sqlalchemy.select(
+    BONES_TABLE.c.id, BONES_TABLE.c.PTS, BONES_TABLE.c.saved_at
+).where(BONES_TABLE.c.id > sqlalchemy.bindparam("last_id"))
+LEADERBOARD_INSERT = LEADERBOARD_TABLE.insert()
+# how many runs have each score, so a rank is a sum over a few hundred rows
+# rather than a count over every run
+SCORE_COUNTS_TABLE = sqlalchemy.Table(
+    "score_counts",
+    BONES_TABLE.metadata,
+    sqlalchemy.Column("PTS", sqlalchemy.Integer(), primary_key=True),
+    sqlalchemy.Column("runs", sqlalchemy.Integer()),
+)
+SCORE_COUNTS = sqlalchemy.select(
+    SCORE_COUNTS_TABLE.c.PTS, SCORE_COUNTS_TABLE.c.runs
+).order_by(SCORE_COUNTS_TABLE.c.PTS.desc())
+SCORE_COUNT_ADD = sqlalchemy.text(
+    "insert into score_counts (PTS, runs) values (:pts, :runs) "
+    "on conflict (PTS) do update set runs = runs + excluded.runs"
+)
+SCORE_COUNTS_BACKFILL = sqlalchemy.text(
+    "insert into score_counts (PTS, runs) "
+    "select PTS, count(*) from bones where PTS is not null group by PTS"
+)
+# an FTS5 index of bones.name by bones.id, kept up to date by save_bones, so a
+# name search never scans the whole bones table; prefix= indexes the first two
+# and three letters of each word too, as search_bones only makes prefix queries
+NAME_INDEX_CREATE = sqlalchemy.text(
+    "create virtual table bones_names using fts5(name, detail=none, prefix='2 3')"
+)
+NAME_INDEX_SINCE = sqlalchemy.text(
+    "insert into bones_names (rowid, name) select id, name from bones "
+    "where id > :last_id"
+)
+NAME_SEARCH = sqlalchemy.text(
+    "select "
+    + ", ".join(f"bones.{field}" for field in BONES_FIELDS)
+    + " from bones_names join bones on bones.id = bones_names.rowid "
+    "where bones_names match :query order by bones.PTS desc, bones.id limit :n"
+).columns(*(BONES_TABLE.c[field] for field in BONES_FIELDS))
+# words as the FTS5 unicode61 tokenizer splits them
+NAME_WORDS = re.compile(r"[^\W_]+")
+RUN_ID_BACKFILL = sqlalchemy.text(
+    "update bones set run_id = lower(hex(randomblob(16))) where run_id is null"
+)
+RUN_ID_INDEX = sqlalchemy.text(
+    "create unique index if not exists bones_run_id on bones (run_id)"
+)
+# runs in rank order are (PTS, id DESC) backwards, so every neighbour query
+# below is a seek along this index
+BONES_RANK_INDEX = sqlalchemy.text(
+    "create index if not exists bones_rank on bones (PTS, id desc)"
+)
+
+
+def _leaderboard_statements():
+    leaderboard = LEADERBOARD_TABLE.c
+    in_period = sqlalchemy.and_(
+        leaderboard.board == sqlalchemy.bindparam("board"),
+        leaderboard.period == sqlalchemy.bindparam("period"),
     )
-    metadata.create_all()
-    sqlalchemy.orm.mapper(Bones, table)
-    session = sqlalchemy.orm.create_session(
-        bind=engine, autocommit=False, autoflush=True
+    ranked = (leaderboard.PTS.desc(), leaderboard.bones_id)
+    keep = (
+        sqlalchemy.select(leaderboard.bones_id)
+        .where(in_period)
+        .order_by(*ranked)
+        .limit(LEADERBOARD_SIZE)
     )
-    for skill in SKILLS:
-        try:
-            engine.execute(f"alter table bones add column {skill.name} Boolean")
-        except sqlalchemy.exc.OperationalError:
-            pass
-    for stat in STATS:
-        try:
-            engine.execute(f"alter table bones add column {stat.name} Integer")
-        except sqlalchemy.exc.OperationalError:
-            pass
-    return session
+    trim = (
+        LEADERBOARD_TABLE.delete()
+        .where(in_period)
+        .where(leaderboard.bones_id.notin_(keep))
+    )
+    prune = (
+        LEADERBOARD_TABLE.delete()
+        .where(leaderboard.board == sqlalchemy.bindparam("board"))
+        .where(leaderboard.period < sqlalchemy.bindparam("oldest"))
+    )
+    top = (
+        sqlalchemy.select(*(BONES_TABLE.c[field] for field in BONES_FIELDS))
+        .select_from(
+            LEADERBOARD_TABLE.join(
+                BONES_TABLE, BONES_TABLE.c.id == leaderboard.bones_id
+            )
+        )
+        .where(in_period)
+        .order_by(*ranked)
+        .limit(sqlalchemy.bindparam("n"))
+    )
+    return (trim, prune, top)
 
 
-DATABASE_SESSION = init_database()
+(LEADERBOARD_TRIM, LEADERBOARD_PRUNE, TOP_BONES) = _leaderboard_statements()
+SEASON_BOARD_EXISTS = (
+    sqlalchemy.select(LEADERBOARD_TABLE.c.board)
+    .where(LEADERBOARD_TABLE.c.board == "season")
+    .limit(1)
+)
+
+
+def _neighbour_statements():
+    bones = BONES_TABLE.c
+    pts = sqlalchemy.bindparam("pts")
+    bones_id = sqlalchemy.bindparam("bones_id")
+
+    def neighbours(*where, order_by):
+        return (
+            sqlalchemy.select(*(bones[field] for field in BONES_FIELDS))
+            .where(sqlalchemy.and_(*where))
+            .order_by(*order_by)
+            .limit(sqlalchemy.bindparam("n"))
+        )
+
+    return (
+        neighbours(bones.PTS == pts, bones.id < bones_id, order_by=[bones.id.desc()]),
+        neighbours(bones.PTS > pts, order_by=[bones.PTS, bones.id.desc()]),
+        neighbours(bones.PTS == pts, bones.id > bones_id, order_by=[bones.id]),
+        neighbours(bones.PTS < pts, order_by=[bones.PTS.desc(), bones.id]),
+    )
+
+
+(TIED_ABOVE, SCORES_ABOVE, TIED_BELOW, SCORES_BELOW) = _neighbour_statements()
+
+
+def init_database(path="data/bones.sqlite"):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # keep connections open between saves and queries; each one is only ever
+    # used by one thread at a time, which is all sqlite3 needs
+    engine = sqlalchemy.create_engine(
+        f"sqlite:///{path}",
+        poolclass=sqlalchemy.pool.QueuePool,
+        connect_args={"check_same_thread": False},
+    )
+    engine = engine.execution_options(compiled_cache={})
+    inspector = sqlalchemy.inspect(engine)
+    tables = inspector.get_table_names()
+    BONES_TABLE.metadata.create_all(engine)
+    existing = {c["name"] for c in inspector.get_columns("bones")}
+    with engine.begin() as conn:
+        for column in BONES_TABLE.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(engine.dialect)
+                conn.execute(
+                    sqlalchemy.text(
+                        f"alter table bones add column {column.name} {column_type}"
+                    )
+                )
+        if "leaderboard" not in tables:
+            update_leaderboards(conn, conn.execute(BONES_SINCE, {"last_id": 0}))
+        elif not conn.execute(SEASON_BOARD_EXISTS).first():
+            # the season board is newer than this database
+            saved = conn.execute(BONES_SINCE, {"last_id": 0})
+            update_leaderboards(conn, saved, boards=["season"])
+        if "score_counts" not in tables:
+            conn.execute(SCORE_COUNTS_BACKFILL)
+        if "bones_names" not in tables:
+            conn.execute(NAME_INDEX_CREATE)
+            conn.execute(NAME_INDEX_SINCE, {"last_id": 0})
+        if "run_id" not in existing:
+            conn.execute(RUN_ID_BACKFILL)
+        conn.execute(RUN_ID_INDEX)
+        conn.execute(BONES_RANK_INDEX)
+    return engine
+
+
+DATABASE_ENGINE = None
+
+
+def database_engine():
+    """ The bones database, opened on first use """
+    global DATABASE_ENGINE
+    if DATABASE_ENGINE is None:
+        DATABASE_ENGINE = init_database()
+    return DATABASE_ENGINE
+
+
+GLOBAL_ENGINE = None
+
+
+def leaderboard_engine():
+    """ The database highscores are read from, GLOBAL_BONES if set """
+    global GLOBAL_ENGINE
+    if not GLOBAL_BONES:
+        return database_engine()
+    if GLOBAL_ENGINE is None:
+        # read-only, so a node can never write to the merged database
+        GLOBAL_ENGINE = sqlalchemy.create_engine(
+            f"sqlite:///file:{GLOBAL_BONES}?mode=ro&uri=true",
+            poolclass=sqlalchemy.pool.QueuePool,
+            connect_args={"check_same_thread": False},
+        )
+    return GLOBAL_ENGINE
 
 
 class BetterButton(urwid.Button):
-    button_left = urwid.Text("-")
-    button_right = urwid.Text("")
+    def __init__(self, label):
+        # urwid shares one pair of these among all buttons, and its canvas
+        # cache would then keep every button ever drawn alive as their
+        # dependants
+        self.button_left = urwid.Text("-")
+        self.button_right = urwid.Text("")
+        super().__init__(label)
 
 
 class SplitMenu(urwid.WidgetWrap):
@@ -1308,15 +2043,21 @@ class SplitMenu(urwid.WidgetWrap):
 class PointBuy(urwid.WidgetWrap):
     TOTAL_POINTS = 24
 
-    def get_points_remaining(self):
+    @staticmethod
+    def points_remaining(values):
+        """ Points left after buying the given {stat: value} allocation """
         points_remaining = PointBuy.TOTAL_POINTS
-        for stat in POINT_BUY_STATS:
-            val = self.stat_editors[stat].value()
+        for val in values.values():
             points_remaining -= min(val, 16) - 10
             if val > 16:
                 points_remaining -= (val - 16) * 2
         return points_remaining
 
+    def get_points_remaining(self):
+        return PointBuy.points_remaining(
+            {stat: self.stat_editors[stat].value() for stat in POINT_BUY_STATS}
+        )
+
     def __init__(self, callback, bonuses):
         self.stat_editors = {}
         points_left_text = urwid.Text(f"Points left: {PointBuy.TOTAL_POINTS}")
@@ -1373,6 +2114,23 @@ class PointBuy(urwid.WidgetWrap):
         return key
 
 
+def visible_stats(char_info, revealed_stats):
+    """ The {stat: value} shown to the player, adding to revealed_stats
+
+    A stat stays shown once it has been nonzero. Age is only shown to players
+    with the TIME skill.
+    """
+    for (stat, val) in char_info.stats.items():
+        if stat == STATS.AGE:
+            if SKILLS.TIME in char_info.skills:
+                revealed_stats.add(stat)
+        elif val != 0:
+            revealed_stats.add(stat)
+    return {
+        stat: val for (stat, val) in char_info.stats.items() if stat in revealed_stats
+    }
+
+
 class PlayerDisplay(urwid.WidgetWrap):
     def __init__(self):
         self.class_info = urwid.Text("??")
@@ -1389,16 +2147,8 @@ class PlayerDisplay(urwid.WidgetWrap):
         logging.debug(f"Player: {char_info}")
         if char_info.char_class is not None:
             self.class_info.set_text(char_info.char_class.value)
-        for (stat, val) in char_info.stats.items():
-            if stat == STATS.AGE:
-                if SKILLS.TIME in char_info.skills:
-                    self.revealed_stats.add(stat)
-                    # val += random.randint(0, 1)
-            elif val != 0:
-                self.revealed_stats.add(stat)
-
-            if stat in self.revealed_stats:
-                self.stat_infos[stat].set_text(f"{stat.value}: {val}")
+        for (stat, val) in visible_stats(char_info, self.revealed_stats).items():
+            self.stat_infos[stat].set_text(f"{stat.value}: {val}")
         self.skill_pile.contents.clear()
         for skill in sorted(char_info.skills, key=lambda s: s.value):
             self.skill_pile.contents.append(
@@ -1406,9 +2156,18 @@ class PlayerDisplay(urwid.WidgetWrap):
             )
 
 
+HIGHSCORE_BOARDS = {
+    "day": "Today's Highscores",
+    "week": "This Week's Highscores",
+    "season": "This Season's Highscores",
+    "all": "Highscores",
+}
+
+
 class GameOver(urwid.WidgetWrap):
-    def __init__(self, player):
+    def __init__(self, player, run_in_background):
         self.player = player
+        self.run_in_background = run_in_background
         body = []
         body.append(urwid.Divider("-"))
         body.append(urwid.Text("RIP"))
@@ -1424,69 +2183,769 @@ class GameOver(urwid.WidgetWrap):
         body.append(urwid.Text(f'{date.today().strftime("%B %d, %Y")}'))
         self.saved_text = urwid.Text("Enter to save highscore...")
         body.append(self.saved_text)
+        self.standing = urwid.Pile([])
+        body.append(self.standing)
         body.append(urwid.Divider("-"))
-        highscores_button = BetterButton("View Highscores")
 
-        def on_highscores_button(*args):
-            self.show_highscores()
+        def on_highscores_button(button, board):
+            self.show_highscores(board)
 
-        urwid.connect_signal(highscores_button, "click", on_highscores_button)
-        self.highscores = urwid.Pile(
-            [urwid.AttrMap(highscores_button, None, focus_map="reversed")]
-        )
+        for (board, title) in HIGHSCORE_BOARDS.items():
+            highscores_button = BetterButton(f"View {title}")
+            urwid.connect_signal(
+                highscores_button, "click", on_highscores_button, board
+            )
+            body.append(urwid.AttrMap(highscores_button, None, focus_map="reversed"))
+        self.search_edit = urwid.Edit("Search names: ")
+        self.search_field = urwid.AttrMap(self.search_edit, None, focus_map="reversed")
+        body.append(self.search_field)
+        self.highscores = urwid.Pile([])
         body.append(self.highscores)
+        # the board or search last asked for, whose results are to be shown
+        self.highscores_shown = None
         self.pile = urwid.Pile(body)
         self.saved = False
         super().__init__(urwid.Filler(self.pile, "top"))
 
     def keypress(self, key, raw):
         key = super().keypress(key, raw)
+        if key == "enter" and self.pile.focus is self.search_field:
+            self.search_highscores(self.search_edit.get_edit_text())
+            return True
         if key == "enter":
             if not self.saved:
                 name = self.name_edit.get_edit_text()
                 if not name:
                     return True
-                save(name, self.player)
                 self.saved = True
-                self.saved_text.set_text([("green", "SAVED"), f" as {name}"])
+                self.saved_text.set_text("Saving\N{HORIZONTAL ELLIPSIS}")
+
+                def on_saved(standing):
+                    self.saved_text.set_text([("green", "SAVED"), f" as {name}"])
+                    if not self.search_edit.get_edit_text():
+                        self.search_edit.set_edit_text(name)
+                    if standing:
+                        self.show_standing(name, standing)
+
+                def on_error():
+                    self.saved = False
+                    self.saved_text.set_text("Could not save, Enter to try again")
+
+                self.run_in_background(
+                    save, name, self.player, callback=on_saved, on_error=on_error
+                )
             return True
 
-    def show_highscores(self):
-        self.highscores.contents.clear()
-        self.highscores.contents.append(
-            (urwid.Text("HIGHSCORES:"), self.highscores.options())
+    def show_standing(self, name, standing):
+        rows = [
+            urwid.Text(
+                f"Rank {standing.rank} of {standing.runs}, better than"
+                f" {standing.percentile:.1f}% of runs"
+            )
+        ]
+        for (rank, bones) in reversed(standing.above):
+            rows.append(urwid.Text(f" {rank}. {bones.name}: score {bones.PTS}"))
+        score = self.player.stats[STATS.PTS]
+        rows.append(urwid.Text(("green", f" {standing.rank}. {name}: score {score}")))
+        for (rank, bones) in standing.below:
+            rows.append(urwid.Text(f" {rank}. {bones.name}: score {bones.PTS}"))
+        self.standing.contents[:] = [(row, self.standing.options()) for row in rows]
+
+    def show_highscores(self, board="all"):
+        self.load_highscores(board, HIGHSCORE_BOARDS[board], get_highscores, board)
+
+    def search_highscores(self, text):
+        if not NAME_WORDS.search(text):
+            return
+        title = f"Highscores matching {text.strip()!r}"
+        self.load_highscores(("search", text), title, search_highscores, text)
+
+    def load_highscores(self, shown, title, fn, *args):
+        self.highscores_shown = shown
+        self.set_highscores(title, [urwid.Text(" loading\N{HORIZONTAL ELLIPSIS}")])
+
+        def on_loaded(highscores):
+            # a board or search chosen since takes precedence
+            if shown == self.highscores_shown:
+                rows = [
+                    urwid.Text(f" {info.name}: age {info.AGE}, score {info.PTS}")
+                    for info in highscores
+                ]
+                self.set_highscores(title, rows or [urwid.Text(" no runs")])
+
+        def on_error():
+            if shown == self.highscores_shown:
+                self.set_highscores(title, [urwid.Text(" unavailable")])
+
+        self.run_in_background(fn, *args, callback=on_loaded, on_error=on_error)
+
+    def set_highscores(self, title, rows):
+        rows = [urwid.Divider(), urwid.Text(f"{title.upper()}:"), *rows]
+        self.highscores.contents[:] = [(row, self.highscores.options()) for row in rows]
+
+
+class MeteredScreen(urwid.raw_display.Screen):
+    """ A terminal screen that counts the frames and bytes it sends
+
+    Each flush, normally one per frame, is also passed to mirror as bytes.
+    """
+
+    def __init__(self, mirror=None):
+        super().__init__()
+        self.bytes_written = 0
+        self.frames = 0
+        self.mirror = mirror
+        self.unflushed = []
+        # (size, canvas) last drawn, and (canvas, bytes) of its full repaint
+        self.last_drawn = None
+        self.repaint = (None, b"")
+
+    def write(self, data):
+        self.unflushed.append(data)
+        super().write(data)
+
+    def flush(self):
+        super().flush()
+        data = "".join(self.unflushed).encode(self._term_output_file.encoding)
+        self.unflushed = []
+        self.bytes_written += len(data)
+        if self.mirror is not None and data:
+            self.mirror(data)
+
+    def draw_screen(self, maxres, r):
+        self.frames += 1
+        super().draw_screen(maxres, r)
+        self.last_drawn = (maxres, r)
+
+    def full_frame(self):
+        """ Bytes painting the whole screen as last drawn, from a blank one
+
+        The canvas is encoded again, not rendered, and only once per frame
+        however many ask for it.
+        """
+        if self.last_drawn is None:
+            return b""
+        (size, canvas) = self.last_drawn
+        if self.repaint[0] is not canvas:
+            encoder = FrameEncoder(self)
+            encoder.draw_screen(size, canvas)
+            data = "".join(encoder.chunks).encode(self._term_output_file.encoding)
+            self.repaint = (canvas, data)
+        return self.repaint[1]
+
+
+class FrameEncoder(urwid.raw_display.Screen):
+    """ Writes a full repaint of a canvas to chunks, with a screen's palette """
+
+    def __init__(self, screen):
+        super().__init__(input=io.StringIO(), output=io.StringIO())
+        self._pal_escape = screen._pal_escape
+        self._pal_attrspec = screen._pal_attrspec
+        self.colors = screen.colors
+        self.back_color_erase = screen.back_color_erase
+        # drawing into the alternate buffer, as a started screen would
+        self._started = True
+        self._rows_used = None
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def flush(self):
+        pass
+
+
+class SpectatorServer:
+    """ Mirrors this session's terminal output to read-only viewers
+
+    A client connecting to the Unix socket gets one JSON line describing the
+    session. One that then sends "watch" becomes a viewer: it gets the last
+    frame as a full repaint, from full_frame(), then the same bytes as the
+    player's terminal. Frames are rendered once however many are watching;
+    each viewer only costs a copy into its socket buffer, and viewers more
+    than max_buffer bytes behind are dropped.
+    """
+
+    def __init__(self, path, describe, full_frame, max_buffer=1 << 20):
+        self.path = path
+        self.describe = describe
+        self.full_frame = full_frame
+        self.max_buffer = max_buffer
+        self.viewers = set()
+        self.server = None
+
+    async def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.server = await asyncio.start_unix_server(self.on_connect, self.path)
+
+    async def on_connect(self, reader, writer):
+        writer.write(json.dumps(self.describe()).encode("utf-8") + b"\n")
+        try:
+            # a listing only wanted the description, and hangs up instead
+            if (await reader.readline()).strip() != b"watch":
+                writer.close()
+                return
+            writer.write(self.full_frame())
+            self.viewers.add(writer)
+            logging.info(f"Spectator joined, {len(self.viewers)} watching")
+            # viewers send nothing more, so this returns when they leave
+            await reader.read()
+        except ConnectionError:
+            # an error escaping here would stop the game's event loop
+            pass
+        finally:
+            self.drop(writer)
+
+    def drop(self, writer):
+        if writer in self.viewers:
+            self.viewers.remove(writer)
+            writer.close()
+            logging.info(f"Spectator left, {len(self.viewers)} watching")
+
+    def broadcast(self, data):
+        for writer in list(self.viewers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.drop(writer)
+            else:
+                writer.write(data)
+
+    def close(self):
+        for writer in list(self.viewers):
+            self.drop(writer)
+        if self.server is not None:
+            self.server.close()
+            os.unlink(self.path)
+
+
+class IdleAsyncioEventLoop(urwid.AsyncioEventLoop):
+    """ urwid's asyncio event loop, entering idle only after something ran
+
+    urwid's own version polls its idle callbacks 30 times a second instead,
+    which delays every redraw by up to 33ms and keeps idle sessions busy.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.idle_callbacks = {}
+        self.idle_handles = 0
+        self.idle_scheduled = False
+
+    def after_idle(self, callback):
+        """ Wraps callback to enter idle once it has run """
+
+        def wrapper(*args):
+            try:
+                callback(*args)
+            finally:
+                self.schedule_idle()
+
+        return wrapper
+
+    def alarm(self, seconds, callback):
+        return super().alarm(seconds, self.after_idle(callback))
+
+    def watch_file(self, fd, callback):
+        return super().watch_file(fd, self.after_idle(callback))
+
+    def enter_idle(self, callback):
+        self.idle_handles += 1
+        self.idle_callbacks[self.idle_handles] = callback
+        self.schedule_idle()
+        return self.idle_handles
+
+    def remove_enter_idle(self, handle):
+        return self.idle_callbacks.pop(handle, None) is not None
+
+    def schedule_idle(self):
+        if not self.idle_scheduled:
+            self.idle_scheduled = True
+            self._loop.call_soon(self.run_idle)
+
+    def run_idle(self):
+        self.idle_scheduled = False
+        for callback in list(self.idle_callbacks.values()):
+            callback()
+
+    def run_in_executor(self, executor, callback, fn, *args):
+        """ Calls fn(*args) in executor, then callback(future) on this loop """
+        future = self._loop.run_in_executor(executor, fn, *args)
+        future.add_done_callback(self.after_idle(callback))
+
+
+class CoalescingMainLoop(urwid.MainLoop):
+    """ A MainLoop that redraws at most once per frame_interval seconds
+
+    Input arriving faster than that, such as a held arrow key, is still
+    handled immediately, but only the latest state is drawn.
+    """
+
+    def __init__(self, *args, frame_interval=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_interval = frame_interval
+        self.last_draw = 0
+        self.draw_pending = False
+
+    def entering_idle(self):
+        wait = self.last_draw + self.frame_interval - time.monotonic()
+        if wait <= 0:
+            self.last_draw = time.monotonic()
+            super().entering_idle()
+        elif not self.draw_pending:
+            # the loop calls entering_idle again once the alarm has fired
+            self.draw_pending = True
+            self.set_alarm_in(wait, self.on_frame_due)
+
+    def on_frame_due(self, loop, user_data):
+        self.draw_pending = False
+
+
+class WaitingRoom:
+    """ Shows a player their place in line until sessiond.py admits them """
+
+    def __init__(self, sock, received):
+        self.sock = sock
+        self.received = received
+        self.admitted = False
+        self.text = urwid.Text("")
+        footer = urwid.Text("Press q to leave the line", align="center")
+        body = urwid.Filler(urwid.Padding(self.text, "center", ("relative", 80)))
+        self.loop = urwid.MainLoop(
+            urwid.Frame(body, footer=footer),
+            palette=PALETTE,
+            unhandled_input=self.on_input,
+        )
+        self.loop.watch_file(sock.fileno(), self.on_readable)
+
+    def wait(self):
+        """ True once admitted, False if the player left the line """
+        self.on_replies()
+        if not self.admitted:
+            self.loop.run()
+        return self.admitted
+
+    def on_input(self, key):
+        if key in ("q", "Q"):
+            raise urwid.ExitMainLoop()
+
+    def on_readable(self):
+        data = self.sock.recv(4096)
+        if not data:
+            raise OSError("session server closed the connection")
+        self.received += data
+        self.on_replies()
+
+    def on_replies(self):
+        while b"\n" in self.received:
+            (line, self.received) = self.received.split(b"\n", 1)
+            (reply, _, position) = line.decode("utf-8").partition("\t")
+            if reply == "A":
+                self.admitted = True
+                raise urwid.ExitMainLoop()
+            self.text.set_text(
+                "Every game is taken right now.\n\n"
+                f"You are number {position} in line, and your game will start"
+                " as soon as one frees up."
+            )
+
+
+def join_session(path):
+    """ Waits for a slot from sessiond.py, in a waiting room if need be
+
+    Returns the connection holding the slot, to be kept open for the whole
+    game, or None if the line is full or the player left it. Raises OSError
+    if the daemon cannot be reached.
+    """
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.settimeout(5)
+        sock.connect(path)
+        sock.sendall(f"J\t{os.getpid()}\n".encode("utf-8"))
+        # the first reply comes at once, so an admitted game starts unseen
+        received = b""
+        while b"\n" not in received:
+            data = sock.recv(4096)
+            if not data:
+                raise OSError("session server closed the connection")
+            received += data
+        sock.settimeout(None)
+        if received.startswith(b"A\n"):
+            return sock
+        if received.startswith(b"F\n") or not WaitingRoom(sock, received).wait():
+            sock.close()
+            return None
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+class ChoiceLog:
+    """ An append-only log of resolved event choices, written in batches
+
+    Each flush is a single O_APPEND write, so many game processes can share
+    one log without interleaving their lines.
+    """
+
+    def __init__(self, path, buffer_size=64):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.lines = []
+
+    def record(self, event_name, choice, checks, success, stat_mods):
+        """ Buffers one choice; checks are (StatCheck, total rolled) pairs """
+        line = {
+            "t": round(time.time(), 3),
+            "event": event_name,
+            "choice": choice.name,
+            "checks": [
+                [check.stat.name, check.num_dice, check.sides, total, check.dc]
+                for (check, total) in checks
+            ],
+            "success": success,
+            "stat_mods": {stat.name: mod for (stat, mod) in stat_mods.items()},
+        }
+        self.lines.append(json.dumps(line, separators=(",", ":")) + "\n")
+        if len(self.lines) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.lines:
+            return
+        data = "".join(self.lines).encode("utf-8")
+        self.lines = []
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError:
+            logging.exception(f"Could not write telemetry to {self.path}")
+
+
+class KeyTrace:
+    """ A session's keypresses, recorded so replay.py can play them again
+
+    The trace is gzipped JSON lines: a header with the seed the game's random
+    numbers came from and the screen size, then [seconds since the start,
+    keys] for each batch of input, with the new size after a "window resize",
+    and last the player's final stats, to tell whether a replay matched. The
+    trace is closed at game over, and keys after that are not recorded.
+    """
+
+    def __init__(self, path, seed):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.seed = seed
+        self.file = gzip.open(path, "wt")
+        self.started = None
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def start(self, size):
+        self.started = time.monotonic()
+        self.write(
+            {
+                "seed": self.seed,
+                "size": size,
+                "content": CONTENT.version,
+                "started": round(time.time(), 3),
+            }
         )
-        for info in get_highscores():
-            self.highscores.contents.append(
-                (
-                    urwid.Text(f" {info.name}: age {info.AGE}, score {info.PTS}"),
-                    self.highscores.options(),
+
+    def record(self, keys, size=None):
+        if self.file is None:
+            return
+        entry = [round(time.monotonic() - self.started, 3), keys]
+        if size is not None:
+            entry.append(size)
+        self.write(entry)
+
+    def close(self, player):
+        if self.file is None:
+            return
+        self.write({"stats": {stat.name: val for (stat, val) in player.stats.items()}})
+        self.file.close()
+        self.file = None
+        logging.info(f"Recorded keypresses to {self.path}")
+
+
+# where --memory-report files allocations, by the first match in their path
+MEMORY_GROUPS = [
+    (f"{os.sep}urwid{os.sep}", "urwid"),
+    (f"{os.sep}sqlalchemy{os.sep}", "sqlalchemy"),
+    (f"{os.sep}logging{os.sep}", "logging"),
+    (os.path.dirname(os.path.abspath(__file__)), "chargen"),
+]
+CONTENT_TABLES = {
+    "EVENTS": EVENTS,
+    "AGES": AGES,
+    "SKILL_DESCS": SKILL_DESCS,
+    "HOBBY_DESC_FRAGMENTS": HOBBY_DESC_FRAGMENTS,
+    "CHAR_CLASS_DESC_FRAGMENTS": CHAR_CLASS_DESC_FRAGMENTS,
+}
+
+
+def deep_getsizeof(obj, seen):
+    """ Bytes held by obj and everything it contains not already in seen """
+    if id(obj) in seen or isinstance(obj, (Enum, type)) or callable(obj):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for (key, value) in obj.items():
+            size += deep_getsizeof(key, seen) + deep_getsizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_getsizeof(item, seen)
+    elif hasattr(obj, "__dict__"):
+        size += deep_getsizeof(vars(obj), seen)
+    return size
+
+
+class MemoryReport:
+    """ Logs where a session's memory has gone at milestones of a life
+
+    Allocations are traced from when the report is created, so run with
+    python -X tracemalloc to also count what importing urwid and SQLAlchemy
+    allocated.
+    """
+
+    def __init__(self, top=10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.top = top
+        self.first = None
+        self.previous = {}
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    def checkpoint(self, label):
+        snapshot = self.snapshot()
+        sizes = Counter()
+        for stat in snapshot.statistics("filename"):
+            filename = stat.traceback[0].filename
+            group = next(
+                (group for (part, group) in MEMORY_GROUPS if part in filename), "other"
+            )
+            sizes[group] += stat.size
+        # ru_maxrss is in KiB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        changes = ", ".join(
+            f"{group} {size // 1024} KiB"
+            f" ({(size - self.previous.get(group, 0)) // 1024:+})"
+            for (group, size) in sizes.most_common()
+        )
+        logging.info(f"Memory at {label}: peak RSS {rss} KiB, traced {changes}")
+        if self.first is None:
+            self.first = snapshot
+            seen = set()
+            logging.info(
+                "Memory held by content tables: "
+                + ", ".join(
+                    f"{name} {deep_getsizeof(table, seen) // 1024} KiB"
+                    for (name, table) in CONTENT_TABLES.items()
                 )
             )
+        self.previous = sizes
 
+    def finish(self):
+        """ Logs the lines that allocated the most since the first checkpoint """
+        if self.first is None:
+            return
+        growth = self.snapshot().compare_to(self.first, "lineno")
+        for stat in growth[: self.top]:
+            logging.info(f"Memory grown since start: {stat}")
+
+
+class Timings:
+    """ Call counts and times of the functions marked @timed """
 
-class Game:
     def __init__(self):
+        # {name: [calls, total seconds, longest seconds]}
+        self.totals = {}
+
+    def add(self, name, elapsed):
+        totals = self.totals.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] = max(totals[2], elapsed)
+
+    def log(self):
+        ranked = sorted(self.totals.items(), key=lambda item: -item[1][1])
+        for (name, (calls, total, longest)) in ranked:
+            logging.info(
+                f"Timing {name}: {calls} calls, {total * 1000:.1f} ms total,"
+                f" {total / calls * 1e6:.0f} us mean, {longest * 1e6:.0f} us max"
+            )
+
+
+TIMINGS = Timings()
+
+
+def timed(fn):
+    """ Adds fn's calls to TIMINGS when CHARGEN_TIMINGS is set
+
+    For a generator, only the time spent running it counts, not the time it
+    waits between screens for the player. Unset, fn is returned as it is, so
+    marking a function costs nothing.
+    """
+    if not TIMINGS_ENABLED:
+        return fn
+    name = fn.__qualname__
+    if inspect.isgeneratorfunction(fn):
+
+        @functools.wraps(fn)
+        def timed_generator(*args, **kwargs):
+            gen = fn(*args, **kwargs)
+            elapsed = 0.0
+            sent = None
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = gen.send(sent)
+                    finally:
+                        elapsed += time.perf_counter() - start
+                    sent = yield item
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                gen.close()
+                TIMINGS.add(name, elapsed)
+
+        return timed_generator
+
+    @functools.wraps(fn)
+    def timed_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            TIMINGS.add(name, time.perf_counter() - start)
+
+    return timed_function
+
+
+class Profiler:
+    """ Profiles a session with cProfile or by sampling its stack
+
+    "cprofile" writes a pstats file, for python -m pstats or snakeviz.
+    "sample" looks at the stack every interval seconds of CPU time, which
+    costs far less on a live session, and writes one line per distinct stack
+    with how often it was seen, the collapsed format flamegraph.pl and
+    speedscope read.
+    """
+
+    def __init__(self, kind="sample", interval=0.005):
+        if kind not in ("cprofile", "sample"):
+            raise ValueError(f"unknown profiler {kind!r}")
+        self.kind = kind
+        self.interval = interval
+        self.profile = None
+        self.samples = None
+        self.dumps = 0
+
+    @property
+    def running(self):
+        return self.profile is not None or self.samples is not None
+
+    def start(self):
+        if self.running:
+            return
+        logging.info(f"Starting {self.kind} profile")
+        if self.kind == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.samples = Counter()
+            signal.signal(signal.SIGPROF, self.on_sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def on_sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        self.samples[tuple(stack)] += 1
+
+    def stop(self):
+        """ Stops profiling and writes the profile; returns its path """
+        if not self.running:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.dumps += 1
+        path = os.path.join(PROFILE_DIR, f"{os.getpid()}-{self.dumps}")
+        if self.profile is not None:
+            self.profile.disable()
+            path += ".pstats"
+            pstats.Stats(self.profile).dump_stats(path)
+            self.profile = None
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+            path += ".stacks"
+            with open(path, "w") as f:
+                for (stack, count) in self.samples.most_common():
+                    frames = ";".join(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                        f":{code.co_firstlineno})"
+                        for code in reversed(stack)
+                    )
+                    f.write(f"{frames} {count}\n")
+            self.samples = None
+        logging.info(f"Wrote {self.kind} profile to {path}")
+        return path
+
+    def toggle(self, signum=None, frame=None):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+
+class Game:
+    def __init__(
+        self,
+        background="\N{MEDIUM SHADE}",
+        telemetry=None,
+        memory_report=None,
+        trace=None,
+    ):
+        self.background = background
+        self.telemetry = telemetry
+        self.memory_report = memory_report
+        self.trace = trace
+        # a reload of the content tables mid-game must not change this one
+        self.content = CONTENT
+        self.top = self.create_layout()
+        self.player = CharInfo()
+        self.mandatory_events = {}
+        self.seen_events = set()
+        self.widgets_iter = self.play_linear()
+        self.next_screen()
+        self.loop = None
+
+    def create_layout(self):
         self.main_widget_container = urwid.Padding(urwid.Edit(), left=1, right=1)
         self.player_display = PlayerDisplay()
         columns = urwid.Columns([self.main_widget_container, self.player_display])
         padded = urwid.Padding(columns, left=2, right=2)
-        overlay = urwid.Overlay(
+        return urwid.Overlay(
             padded,
-            urwid.SolidFill("\N{MEDIUM SHADE}"),
+            urwid.SolidFill(self.background),
             align="center",
             width=("relative", 80),
             valign="middle",
             height=("relative", 80),
         )
-        self.top = overlay
-        self.player = CharInfo()
-        self.mandatory_events = {}
-        self.seen_events = set()
-        self.widgets_iter = self.play_linear()
-        self.next_screen()
-        self.loop = None
 
+    @timed
     def dice(self, n, s):
         """ Rolls NdS """
         if SKILLS.CLOVER in self.player.skills and s == 4:
@@ -1519,8 +2978,13 @@ class Game:
         self.player.skills.add(skill)
         self.next_screen()
 
+    @timed
+    def split_menu(self, title, choices, **kwargs):
+        return SplitMenu(title, choices, **kwargs)
+
+    @timed
     def choose_class_menu(self):
-        return SplitMenu(
+        return self.split_menu(
             "CHOOSE YOUR CLASS",
             list(CHAR_CLASSES),
             display_fn=lambda c: c.value,
@@ -1528,6 +2992,7 @@ class Game:
             callback=self.on_class_chosen,
         )
 
+    @timed
     def point_buy(self):
         return PointBuy(
             callback=self.on_point_buy_done,
@@ -1535,38 +3000,23 @@ class Game:
         )
 
     def player_can_choose_skill(self, skill):
-        skill_prereqs = SKILL_PREREQS.get(skill, {})
-        if not self.player.skills.issuperset(skill_prereqs):
-            return False
-        stat_prereqs = SKILL_STAT_PREREQS.get(skill, {})
-        if any(self.player.stats[stat] < req for (stat, req) in stat_prereqs.items()):
-            return False
-        return True
+        return self.content.skill_requires[skill](self.player)
 
+    @timed
     def choose_skill(self):
         skills = set(SKILLS).difference(self.player.skills)
         skills = skills.difference(HIDDEN_SKILLS)
-        skill_graph = {skill: [] for skill in set(SKILLS)}
-        for a1, a0s in SKILL_PREREQS.items():
-            for a0 in a0s:
-                skill_graph[a0].append(a1)
-
+        skill_requires = self.content.skill_requires
+        mask = skill_mask(self.player.skills)
         no_prereqs = set(
             skill
             for skill in skills
-            if (
-                skill not in SKILL_PREREQS
-                or all(
-                    req_skill in self.player.skills
-                    for req_skill in SKILL_PREREQS[skill]
-                )
-            )
-            and skill not in self.player.skills
+            if mask & skill_requires[skill].mask == skill_requires[skill].mask
         )
         agenda = list(self.player.skills | no_prereqs)
         one_off = set()
         for item in agenda:
-            for next_skill in skill_graph[item]:
+            for next_skill in self.content.skill_unlocks[item]:
                 if (
                     next_skill not in no_prereqs
                     and next_skill not in self.player.skills
@@ -1574,16 +3024,22 @@ class Game:
                     one_off.add(next_skill)
 
         displayed_skills = one_off | no_prereqs
-        if not any(self.player_can_choose_skill(skill) for skill in displayed_skills):
+        enabled = set(
+            skill
+            for skill in displayed_skills
+            if skill_requires[skill].allows(self.player.stats, mask)
+        )
+        if not enabled:
             logging.warning("No skills available for player to choose!")
             return
 
-        yield SplitMenu(
+        yield self.split_menu(
             "CHOOSE A SKILL",
-            list(displayed_skills),
+            # in a fixed order, so the same keys pick the same skill every run
+            [skill for skill in SKILLS if skill in displayed_skills],
             display_fn=lambda c: c.value,
-            description_fn=get_skill_desc,
-            is_enabled_fn=self.player_can_choose_skill,
+            description_fn=lambda skill: get_skill_desc(skill, self.content),
+            is_enabled_fn=lambda skill: skill in enabled,
             callback=self.on_skill_chosen,
         )
 
@@ -1591,8 +3047,9 @@ class Game:
         self.player.hobby = hobby
         self.next_screen()
 
+    @timed
     def choose_hobby(self):
-        return SplitMenu(
+        return self.split_menu(
             "CHOOSE AN ACTIVITY",
             list(HOBBY),
             description_fn=fragment_desc_getter(HOBBY_DESC_FRAGMENTS, 3),
@@ -1610,6 +3067,7 @@ class Game:
             valign="middle",
         )
 
+    @timed
     def popup_message(self, text, callback):
         text = urwid.Padding(
             urwid.Filler(urwid.Text(text, align="center"), valign="top"),
@@ -1634,11 +3092,12 @@ class Game:
         return self.player.stats[stat] + self.dice(num_dice, sides)
 
     def play_random_event(self):
+        mask = skill_mask(self.player.skills)
         events = list(
             (name, event)
-            for (name, event) in EVENTS.items()
+            for (name, event) in self.content.events.items()
             if name not in self.seen_events
-            and event.prereq_fn(self.player)
+            and event.requires.allows(self.player.stats, mask)
             and event.age_req is None
         )
         if not events:
@@ -1652,7 +3111,7 @@ class Game:
         required_events = [
             name
             for name in self.mandatory_events[age]
-            if EVENTS[name].prereq_fn(self.player)
+            if self.content.events[name].requires(self.player)
         ]
 
         if len(required_events) > 0:
@@ -1661,16 +3120,17 @@ class Game:
             self.mandatory_events[age].remove(event_name)
 
     def create_mandatory_event_table(self):
-        for name, event in EVENTS.items():
+        for name, event in self.content.events.items():
             if event.age_req is not None:
                 assert event.age_req >= 2
                 logging.debug(f"mandatory {name}")
                 self.mandatory_events.setdefault(event.age_req, []).append(name)
 
+    @timed
     def play_event(self, event_name):
         logging.info(f"Triggered {event_name} event")
         self.seen_events.add(event_name)
-        event = EVENTS[event_name]
+        event = self.content.events[event_name]
         choice = None
 
         def on_choice(selected):
@@ -1678,11 +3138,12 @@ class Game:
             choice = selected
             self.next_screen()
 
-        def player_has_prereqs(choice):
-            return self.player.skills.issuperset(choice.skill_reqs) and all(
-                self.player.stats[stat] > req
-                for (stat, req) in choice.stat_reqs.items()
-            )
+        mask = skill_mask(self.player.skills)
+        enabled = set(
+            choice
+            for choice in event.choices
+            if choice.requires.allows(self.player.stats, mask)
+        )
 
         def description_fn(choice):
             desc = ""
@@ -1696,28 +3157,42 @@ class Game:
                 desc += f" {val} {stat.value}"
             return desc
 
-        yield SplitMenu(
+        yield self.split_menu(
             event.desc,
             event.choices,
             description_fn=description_fn,
             display_fn=lambda choice: choice.name,
-            is_enabled_fn=player_has_prereqs,
+            is_enabled_fn=lambda choice: choice in enabled,
             callback=on_choice,
         )
-        logging.info(f"Player chose {choice.name}")
         assert choice is not None
+        result, msg = self.resolve_choice(event_name, choice)
+        yield self.popup_message(msg, self.next_screen)
+
+        for event_name in result.trigger_events:
+            yield from self.play_event(event_name)
+
+    def resolve_choice(self, event_name, choice):
+        """ Rolls the checks for a chosen option and applies its result """
+        logging.info(f"Player chose {choice.name}")
         overall_success = True
         msg = ""
+        rolls = []
         if choice.checks:
             for stat_check in choice.checks:
                 (stat, num_dice, sides, dc) = stat_check
                 total = self.roll_stat_check(stat, num_dice, sides)
+                rolls.append((stat_check, total))
                 check_success = total >= dc
                 if not check_success:
                     overall_success = False
                 msg += f'{"SUCCESS" if check_success else "FAILURE"}'
                 msg += f" {num_dice}d{sides} + {stat.value} = {total} vs {dc}\n\n"
         result = choice.success if overall_success else choice.failure
+        if self.telemetry is not None:
+            self.telemetry.record(
+                event_name, choice, rolls, overall_success, result.stat_mods
+            )
         msg += result.desc
         for (stat, mod) in result.stat_mods.items():
             msg += f"\n {mod:+} {stat.value}"
@@ -1725,10 +3200,7 @@ class Game:
         for skill in result.skills_gained:
             msg += f"\n gained {skill.value}"
             self.player.skills.add(skill)
-        yield self.popup_message(msg, self.next_screen)
-
-        for event_name in result.trigger_events:
-            yield from self.play_event(event_name)
+        return result, msg
 
     def play_hobby(self):
         yield self.choose_hobby()
@@ -1747,12 +3219,15 @@ class Game:
             yield self.popup_message(f"+1d4={bonus} {stat.value}!", self.next_screen)
 
     def play_linear(self):
+        self.memory_checkpoint("start")
         yield self.choose_class_menu()
         self.create_mandatory_event_table()
         yield self.point_buy()
+        self.memory_checkpoint("point buy")
         self.player.stats[STATS.AGE] += 2
         yield from self.choose_skill()
         yield from self.play_hobby()
+        self.memory_checkpoint("hobby")
         turns = 0
         while True:
             if self.mandatory_events.get(self.player.stats[STATS.AGE]):
@@ -1761,19 +3236,26 @@ class Game:
             else:
                 yield from self.play_random_event()
             yield from self.choose_skill()
-            if turns >= len(AGES):
+            if turns >= len(self.content.ages):
                 yield self.popup_message(
                     "You die peacefully of old age", self.next_screen
                 )
                 break
-            self.player.stats[STATS.AGE] = AGES[turns]
+            self.player.stats[STATS.AGE] = self.content.ages[turns]
             turns += 1
+            if turns % 5 == 0:
+                self.memory_checkpoint(f"age {self.player.stats[STATS.AGE]}")
             if self.player.stats[STATS.AGE] > 55:
                 yield self.aging_check()
             if self.player.stats[STATS.CON] <= 0:
                 yield self.popup_message("YOU DIE", self.next_screen)
                 break
-        yield GameOver(self.player)
+        self.memory_checkpoint("game over")
+        yield self.game_over()
+
+    def memory_checkpoint(self, label):
+        if self.memory_report is not None:
+            self.memory_report.checkpoint(label)
 
     def aging_check(self):
         msg = "TIME TAKES ITS TOLL"
@@ -1782,17 +3264,217 @@ class Game:
         msg += f"\n\n-2d4=-{con_debuff} CON"
         return self.popup_message(msg, self.next_screen)
 
+    @timed
     def game_over(self):
-        pass
+        if self.telemetry is not None:
+            self.telemetry.flush()
+        if self.trace is not None:
+            # most sessions end with the terminal closing rather than here
+            self.trace.close(self.player)
+        return GameOver(self.player, self.run_in_background)
+
+    def run_in_background(self, fn, *args, callback, on_error):
+        """ Runs fn(*args) on DATABASE_POOL and hands its result to callback
+
+        The callbacks run on the event loop, which then redraws the screen.
+        Without a running loop, as when a script drives the widgets, this
+        waits for fn instead.
+        """
+
+        def on_done(future):
+            try:
+                result = future.result()
+            except Exception:
+                logging.exception(f"{fn.__name__} failed")
+                on_error()
+            else:
+                callback(result)
 
-    def run(self):
-        self.loop = urwid.MainLoop(self.top, palette=PALETTE)
-        self.loop.run()
+        if self.loop is None:
+            future = DATABASE_POOL.submit(fn, *args)
+            future.exception()
+            on_done(future)
+        else:
+            self.loop.event_loop.run_in_executor(DATABASE_POOL, on_done, fn, *args)
+
+    def describe(self):
+        """ What a spectator sees before choosing to watch """
+        (columns, rows) = self.loop.screen.get_cols_rows()
+        return {
+            "pid": os.getpid(),
+            "columns": columns,
+            "rows": rows,
+            "class": self.player.char_class and self.player.char_class.value,
+            "age": self.player.stats[STATS.AGE],
+            "score": self.player.stats[STATS.PTS],
+        }
+
+    def note_input(self, keys, raw):
+        self.last_input = time.monotonic()
+        if self.trace is not None:
+            resized = "window resize" in keys
+            size = self.loop.screen.get_cols_rows() if resized else None
+            self.trace.record(keys, size)
+        return keys
+
+    def check_idle(self, loop, idle_timeout):
+        """ Ends the session once nothing has been typed for idle_timeout """
+        idle = time.monotonic() - self.last_input
+        if idle < idle_timeout:
+            loop.set_alarm_in(idle_timeout - idle, self.check_idle, idle_timeout)
+            return
+        logging.info(f"Ending session after {idle:.0f} seconds idle")
+        self.timed_out = True
+        raise urwid.ExitMainLoop()
+
+    def end_session(self, signum, frame):
+        """ Leaves the loop on a signal, so the session still cleans up """
+        logging.info(f"Ending session on {signal.Signals(signum).name}")
+        self.ended_by = signum
+        raise urwid.ExitMainLoop()
+
+    def run(self, frame_interval=0, spectate=None, idle_timeout=None):
+        asyncio_loop = asyncio.new_event_loop()
+        screen = MeteredScreen()
+        spectators = None
+        if spectate is not None:
+            spectators = SpectatorServer(spectate, self.describe, screen.full_frame)
+            screen.mirror = spectators.broadcast
+        self.loop = CoalescingMainLoop(
+            self.top,
+            palette=PALETTE,
+            screen=screen,
+            event_loop=IdleAsyncioEventLoop(loop=asyncio_loop),
+            frame_interval=frame_interval,
+            input_filter=self.note_input,
+        )
+        if spectators is not None:
+            asyncio_loop.run_until_complete(spectators.start())
+        self.last_input = time.monotonic()
+        self.timed_out = False
+        self.ended_by = None
+        if idle_timeout:
+            # one alarm per timeout rather than one per keypress
+            self.loop.set_alarm_in(idle_timeout, self.check_idle, idle_timeout)
+        if self.trace is not None:
+            self.trace.start(screen.get_cols_rows())
+        try:
+            self.loop.run()
+            if self.timed_out:
+                print(f"Game closed after {idle_timeout:g} seconds without input.")
+        except OSError:
+            # a terminal that hung up cannot be restored
+            if self.ended_by != signal.SIGHUP:
+                raise
+        finally:
+            if spectators is not None:
+                spectators.close()
+            if self.telemetry is not None:
+                self.telemetry.flush()
+            if self.memory_report is not None:
+                self.memory_report.finish()
+            if self.trace is not None:
+                self.trace.close(self.player)
+            cache = urwid.CanvasCache
+            logging.info(
+                f"Session drew {screen.frames} frames, {screen.bytes_written} bytes,"
+                f" reusing {cache.hits} of {cache.fetches} cached canvases"
+            )
 
 
 def main():
-    game = Game()
-    game.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--low-bandwidth",
+        action="store_true",
+        help="plain background and at most 20 redraws per second",
+    )
+    parser.add_argument(
+        "--frame-interval",
+        type=float,
+        default=None,
+        help="minimum seconds between redraws (default: 0, or 0.05 with "
+        "--low-bandwidth)",
+    )
+    parser.add_argument(
+        "--no-telemetry",
+        action="store_true",
+        help=f"do not log event choices to {TELEMETRY_LOG}",
+    )
+    parser.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="log memory use by module through the game (slow)",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=900,
+        help="end the game after this many seconds without input (default: 900,"
+        " 0 to never)",
+    )
+    parser.add_argument(
+        "--spectate",
+        action="store_true",
+        help=f"let spectate.py viewers watch, through a socket in {SPECTATE_DIR}",
+    )
+    parser.add_argument(
+        "--record-trace",
+        action="store_true",
+        help=f"save this game's keypresses to {TRACE_DIR} for replay.py",
+    )
+    args = parser.parse_args()
+    frame_interval = args.frame_interval
+    if frame_interval is None:
+        frame_interval = 0.05 if args.low_bandwidth else 0
+    memory_report = MemoryReport() if args.memory_report else None
+    profiler = Profiler(PROFILE or "sample")
+    signal.signal(signal.SIGUSR1, profiler.toggle)
+    session = None
+    if SESSION_SOCKET:
+        try:
+            session = join_session(SESSION_SOCKET)
+        except OSError:
+            logging.exception("Session server unavailable, starting anyway")
+        else:
+            if session is None:
+                print("No game was started; please try again in a little while.")
+                return
+    # modules, content tables and prebuilt statements last the whole session;
+    # frozen, they are never traversed by the garbage collector again
+    gc.collect()
+    gc.freeze()
+    # the profile and the session's slot are given up however the game ends,
+    # even if it never gets to start
+    try:
+        if PROFILE:
+            profiler.start()
+        trace = None
+        if args.record_trace:
+            # a replay needs the same random numbers, so they come from one seed
+            seed = random.randrange(2 ** 32)
+            random.seed(seed)
+            path = os.path.join(TRACE_DIR, f"{int(time.time())}-{os.getpid()}.jsonl.gz")
+            trace = KeyTrace(path, seed)
+        game = Game(
+            background=" " if args.low_bandwidth else "\N{MEDIUM SHADE}",
+            telemetry=None if args.no_telemetry else ChoiceLog(TELEMETRY_LOG),
+            memory_report=memory_report,
+            trace=trace,
+        )
+        spectate = None
+        if args.spectate:
+            spectate = os.path.join(SPECTATE_DIR, f"{os.getpid()}.sock")
+        # closing the terminal hangs up, and a server shutting down terminates
+        signal.signal(signal.SIGHUP, game.end_session)
+        signal.signal(signal.SIGTERM, game.end_session)
+        game.run(frame_interval, spectate, args.idle_timeout)
+    finally:
+        profiler.stop()
+        TIMINGS.log()
+        if session is not None:
+            # frees this game's slot for the next player in line
+            session.close()
 
 
 if __name__ == "__main__":
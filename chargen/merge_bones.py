@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Merge the runs saved on several nodes into one global bones database.
+
+Each node keeps its own data/bones.sqlite. This copies the runs saved on each
+node since the last merge into a central database, which games then read
+their highscores and ranks from by setting CHARGEN_GLOBAL_BONES:
+
+    python chargen/merge_bones.py --database data/global-bones.sqlite \\
+        /nodes/*/data/bones.sqlite
+    CHARGEN_GLOBAL_BONES=data/global-bones.sqlite python chargen/main.py
+
+Only rows past each source's high-water mark, the largest id already merged
+from it, are read, so merging every minute costs about as much as the runs
+saved that minute. Runs are identified by their run_id, so a run merged
+twice, say from a copied or restored node database, is only kept once. Each
+batch is committed together with its high-water mark.
+"""
+import argparse
+import hashlib
+import logging
+import os
+
+import sqlalchemy
+
+import main
+
+
+MERGE_SOURCES_TABLE = sqlalchemy.Table(
+    "merge_sources",
+    sqlalchemy.MetaData(),
+    sqlalchemy.Column("source", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("last_id", sqlalchemy.Integer()),
+)
+HIGH_WATER_MARK_SET = sqlalchemy.text(
+    "insert into merge_sources (source, last_id) values (:source, :last_id) "
+    "on conflict (source) do update set last_id = excluded.last_id"
+)
+
+
+def high_water_mark(conn, source):
+    sources = MERGE_SOURCES_TABLE.c
+    query = sqlalchemy.select(sources.last_id).where(sources.source == source)
+    return conn.execute(query).scalar() or 0
+
+
+def run_id(row):
+    """ A run_id for a row saved before runs had one, the same every merge """
+    fields = "\t".join(str(row.get(field)) for field in main.BONES_FIELDS)
+    return hashlib.sha1(fields.encode("utf-8")).hexdigest()[:32]
+
+
+def merge(central, path, batch_size):
+    """ Copies the runs saved at path since the last merge; returns how many """
+    source = os.path.abspath(path)
+    if not os.path.exists(source):
+        logging.warning(f"{source} does not exist")
+        return 0
+    engine = sqlalchemy.create_engine(f"sqlite:///file:{source}?mode=ro&uri=true")
+    # node databases may predate some columns
+    present = {c["name"] for c in sqlalchemy.inspect(engine).get_columns("bones")}
+    bones = main.BONES_TABLE.c
+    columns = [column for column in bones if column.name in present]
+    with central.connect() as conn:
+        last_id = high_water_mark(conn, source)
+    merged = 0
+    with engine.connect() as conn:
+        if last_id > (conn.execute(main.LAST_BONES_ID).scalar() or 0):
+            logging.warning(f"{source} was replaced; merging it from the start")
+            last_id = 0
+        while True:
+            query = (
+                sqlalchemy.select(*columns)
+                .where(bones.id > last_id)
+                .order_by(bones.id)
+                .limit(batch_size)
+            )
+            rows = [row._asdict() for row in conn.execute(query)]
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            for row in rows:
+                del row["id"]
+                if row.get("run_id") is None:
+                    row["run_id"] = run_id(row)
+            with central.begin() as central_conn:
+                saved = main.insert_bones(central_conn, rows)
+                central_conn.execute(
+                    HIGH_WATER_MARK_SET, {"source": source, "last_id": last_id}
+                )
+            merged += len(saved)
+            logging.info(
+                f"Merged {len(saved)} of {len(rows)} runs from {source},"
+                f" up to id {last_id}"
+            )
+    engine.dispose()
+    return merged
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sources", nargs="+", help="node bones databases")
+    parser.add_argument("--database", default="data/global-bones.sqlite")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="runs read and committed together (default: 10000)",
+    )
+    args = parser.parse_args()
+    main.log_to_stderr()
+    central = main.init_database(args.database)
+    MERGE_SOURCES_TABLE.create(central, checkfirst=True)
+    merged = sum(merge(central, path, args.batch_size) for path in args.sources)
+    main.prune_leaderboards(central)
+    print(f"Merged {merged} new runs into {args.database}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Replay recorded sessions through the real widgets and time every keystroke.
+
+Games started with --record-trace save their keypresses and random seed to
+data/traces. Replaying a trace seeds the game the same way and feeds it the
+same keys at full speed, rendering a frame after each batch of input as the
+terminal would, so the workload is how real players move through menus and
+popups rather than a script's shortest path:
+
+    python chargen/replay.py data/traces/*.jsonl.gz --save-baseline replay.json
+    ... change main.py ...
+    python chargen/replay.py data/traces/*.jsonl.gz --baseline replay.json
+
+CPU time per keystroke is reported by kind of key and by screen, and with
+--allocations, the memory each keystroke allocated, from a separate pass
+under tracemalloc. Like bench.py it runs in a scratch directory and exits
+with status 1 when a result is slower than the baseline by more than
+--tolerance. A trace recorded against other content, or whose replay ends
+with other stats than the session did, is reported as diverged.
+"""
+import argparse
+from collections import defaultdict
+import gzip
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench import compare
+
+
+KEY_KINDS = {
+    "enter": "enter",
+    " ": "enter",
+    "j": "j/k",
+    "k": "j/k",
+    "up": "arrows",
+    "down": "arrows",
+    "left": "arrows",
+    "right": "arrows",
+}
+
+
+def key_kind(key):
+    if isinstance(key, list):
+        return "mouse"
+    return KEY_KINDS.get(key, "other")
+
+
+def load_trace(path):
+    """ (header, [(seconds, keys, size)], final stats or None)
+
+    A trace cut short, by a game killed before it could close it, loads as far
+    as it goes, without final stats. ValueError if not even its header was
+    written.
+    """
+    lines = []
+    with gzip.open(path, "rt") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    lines.append(json.loads(line))
+        except (EOFError, OSError, ValueError):
+            # the gzip stream or its last line ends early
+            pass
+    if not lines or not isinstance(lines[0], dict) or "seed" not in lines[0]:
+        raise ValueError("no header; the game did not get to write one")
+    header = lines[0]
+    batches = []
+    final = None
+    for entry in lines[1:]:
+        if isinstance(entry, dict):
+            final = entry["stats"]
+        else:
+            batches.append((entry[0], entry[1], entry[2] if len(entry) > 2 else None))
+    return (header, batches, final)
+
+
+def replay(main, trace, on_key=None):
+    """ Plays a trace and returns [(kind, screen, cpu seconds)] per key
+
+    on_key(kind, screen, run) is instead called with a zero-argument function
+    running each key, for measuring it some other way.
+    """
+    (header, batches, _) = trace
+    random.seed(header["seed"])
+    game = main.Game(background=" ")
+    size = tuple(header["size"])
+    timings = []
+
+    def run_key(key):
+        if isinstance(key, list):
+            game.top.mouse_event(size, *key, focus=True)
+        else:
+            game.top.keypress(size, key)
+
+    def render():
+        list(game.top.render(size, focus=True).content())
+
+    # the loop draws the first screen before any input arrives
+    render()
+    for (_, keys, new_size) in batches:
+        if new_size is not None:
+            size = tuple(new_size)
+            render()
+        for (i, key) in enumerate(keys):
+            if key == "window resize":
+                continue
+            screen = type(game.main_widget_container.original_widget).__name__
+            last = i == len(keys) - 1
+
+            def run():
+                run_key(key)
+                # the loop draws once per batch of input, after its last key
+                if last:
+                    render()
+
+            if on_key is not None:
+                on_key(key_kind(key), screen, run)
+                continue
+            started = time.process_time()
+            run()
+            timings.append((key_kind(key), screen, time.process_time() - started))
+    return (game, timings)
+
+
+def allocations(main, trace):
+    """ [(kind, screen, peak bytes, net bytes)] per key of one replay """
+    measured = []
+
+    def on_key(kind, screen, run):
+        tracemalloc.reset_peak()
+        (before, _) = tracemalloc.get_traced_memory()
+        run()
+        (after, peak) = tracemalloc.get_traced_memory()
+        measured.append((kind, screen, peak - before, after - before))
+
+    tracemalloc.start()
+    try:
+        replay(main, trace, on_key)
+    finally:
+        tracemalloc.stop()
+    return measured
+
+
+def diverged(main, trace, game):
+    """ Why a replay cannot be trusted to match its session, or None """
+    (header, _, final) = trace
+    if header.get("content") != main.CONTENT.version:
+        return f"recorded with content {header.get('content')}"
+    if final is not None:
+        stats = {stat.name: val for (stat, val) in game.player.stats.items()}
+        if stats != final:
+            return "ended with other stats than the session"
+    return None
+
+
+def summarize(runs):
+    """ bench.py-style results from [[(kind, screen, seconds)]] per repeat
+
+    Each result is the mean CPU time per key of a group, over each repeat.
+    """
+    per_repeat = defaultdict(list)
+    for timings in runs:
+        groups = defaultdict(list)
+        for (kind, screen, seconds) in timings:
+            groups["all keys"].append(seconds)
+            groups[f"key {kind}"].append(seconds)
+            groups[f"screen {screen}"].append(seconds)
+        for (name, times) in groups.items():
+            per_repeat[name].append((statistics.mean(times), len(times)))
+    results = {}
+    for (name, repeats) in sorted(per_repeat.items()):
+        means = [mean for (mean, _) in repeats]
+        results[name] = {
+            "median_us": statistics.median(means) * 1e6,
+            "best_us": min(means) * 1e6,
+            "keys": repeats[0][1],
+            "repeat": len(repeats),
+        }
+    # the slow keystrokes are what players notice, so the tail gets its own line
+    every = sorted(seconds for timings in runs for (_, _, seconds) in timings)
+    if every:
+        results["all keys"]["p99_us"] = every[int(len(every) * 0.99)] * 1e6
+    return results
+
+
+def summarize_allocations(measured):
+    groups = defaultdict(list)
+    for (kind, screen, peak, net) in measured:
+        for name in ("all keys", f"key {kind}", f"screen {screen}"):
+            groups[name].append((peak, net))
+    return {
+        name: {
+            "mean_peak_bytes": statistics.mean(peak for (peak, _) in values),
+            "max_peak_bytes": max(peak for (peak, _) in values),
+            "mean_net_bytes": statistics.mean(net for (_, net) in values),
+        }
+        for (name, values) in sorted(groups.items())
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("traces", nargs="+", help="files written by --record-trace")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--allocations",
+        action="store_true",
+        help="also measure each keystroke's allocations with tracemalloc",
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", help="write results as the new baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown before failing, as a fraction (default: 0.2)",
+    )
+    args = parser.parse_args()
+    paths = [
+        os.path.abspath(p) if p else None
+        for p in (args.output, args.baseline, args.save_baseline)
+    ]
+    (output, baseline_path, save_baseline) = paths
+    traces = {}
+    for path in args.traces:
+        try:
+            traces[path] = load_trace(path)
+        except ValueError as e:
+            print(f"{path} skipped: {e}", file=sys.stderr)
+            continue
+        if traces[path][2] is None:
+            print(f"{path} is truncated; replaying what it has", file=sys.stderr)
+    if not traces:
+        parser.error("none of the traces could be read")
+
+    os.chdir(tempfile.mkdtemp(prefix="chargen-replay-"))
+    import main
+
+    logging.disable(logging.WARNING)
+    runs = []
+    for repeat in range(args.repeat):
+        timings = []
+        for (path, trace) in traces.items():
+            (game, trace_timings) = replay(main, trace)
+            timings.extend(trace_timings)
+            if repeat == 0:
+                reason = diverged(main, trace, game)
+                if reason is not None:
+                    print(f"{path} diverged: {reason}", file=sys.stderr)
+        runs.append(timings)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "traces": len(traces),
+        "results": summarize(runs),
+    }
+    if args.allocations:
+        measured = []
+        for trace in traces.values():
+            measured.extend(allocations(main, trace))
+        report["allocations"] = summarize_allocations(measured)
+
+    for path in (output, save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(report["results"], baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} result(s) regressed")
+            sys.exit(1)
+    elif not output:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main_cli()
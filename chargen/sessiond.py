@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Cap how many games run at once, queueing the players over the cap.
+
+Game processes started with CHARGEN_SESSION_SOCKET set ask the daemon for a
+slot before building the game, and show a waiting room with their place in
+line until they get one:
+
+    python chargen/sessiond.py --socket data/sessions.sock --max-sessions 32 &
+    CHARGEN_SESSION_SOCKET=data/sessions.sock python chargen/main.py
+
+A game holds its slot for as long as its connection is open, so a slot is
+freed however the process ends. Once --max-waiting players are queued, new
+ones are turned away at once rather than left holding memory in line.
+
+A game sends one line, "J <pid>", and the daemon answers with lines of its
+own: "Q <n>" each time its place in line changes, "A" once it has a slot, or
+"F" if the queue is full.
+"""
+import argparse
+import logging
+import os
+import select
+import signal
+import socketserver
+import sys
+import threading
+
+from unix_socket import claim_socket
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode("utf-8").rstrip("\n")
+        (command, _, pid) = line.partition("\t")
+        if command != "J":
+            return
+        server = self.server
+        if not server.wait_for_slot(self.connection, pid):
+            return
+        try:
+            # the game never sends anything more; EOF means it has ended
+            self.rfile.read()
+        except OSError:
+            pass
+        finally:
+            server.release(pid)
+
+
+class SessionServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, max_sessions, max_waiting):
+        self.max_sessions = max_sessions
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.queue = []
+        self.changed = threading.Condition()
+        super().__init__(path, RequestHandler)
+
+    def wait_for_slot(self, connection, pid):
+        """ Blocks until the game at connection may start; False if it left """
+        ticket = object()
+        with self.changed:
+            if not self.queue and self.running < self.max_sessions:
+                self.running += 1
+                logging.info(f"Admitted {pid}, {self.running} running")
+                connection.sendall(b"A\n")
+                return True
+            if len(self.queue) >= self.max_waiting:
+                logging.info(f"Turned away {pid}, {len(self.queue)} waiting")
+                connection.sendall(b"F\n")
+                return False
+            self.queue.append(ticket)
+            logging.info(f"Queued {pid}, {len(self.queue)} waiting")
+            try:
+                position = None
+                while True:
+                    place = self.queue.index(ticket)
+                    if place == 0 and self.running < self.max_sessions:
+                        self.queue.pop(0)
+                        self.running += 1
+                        logging.info(f"Admitted {pid}, {self.running} running")
+                        connection.sendall(b"A\n")
+                        # the next in line may fit too
+                        self.changed.notify_all()
+                        return True
+                    if place + 1 != position:
+                        position = place + 1
+                        connection.sendall(f"Q\t{position}\n".encode("utf-8"))
+                    self.changed.wait(1)
+                    if select.select([connection], [], [], 0)[0]:
+                        # the player gave up, so their game closed the socket
+                        logging.info(f"{pid} left the queue")
+                        self.queue.remove(ticket)
+                        self.changed.notify_all()
+                        return False
+            except OSError:
+                if ticket in self.queue:
+                    self.queue.remove(ticket)
+                    self.changed.notify_all()
+                return False
+
+    def release(self, pid):
+        with self.changed:
+            self.running -= 1
+            logging.info(f"{pid} ended, {self.running} running")
+            self.changed.notify_all()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default="data/sessions.sock")
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=32,
+        help="games allowed to run at once (default: 32)",
+    )
+    parser.add_argument(
+        "--max-waiting",
+        type=int,
+        default=64,
+        help="players allowed to queue for a slot (default: 64)",
+    )
+    args = parser.parse_args()
+    # this daemon does not import main, whose import sets up log.txt
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+    claim_socket(args.socket)
+    server = SessionServer(args.socket, args.max_sessions, args.max_waiting)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main_cli()
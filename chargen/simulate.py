@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Play many automated lives under a choice policy and summarize the results.
+
+Use this to check balance changes to EVENTS, AGES or PointBuy.TOTAL_POINTS
+before shipping them:
+
+    python chargen/simulate.py --lives 1000000 --policy greedy random cleric
+
+Lives are split into fixed-size chunks, each seeded from (seed, chunk index),
+so results depend only on --seed and --chunk-size, not on the worker count.
+Nor do they depend on PYTHONHASHSEED, as long as every menu lists its choices
+in a fixed order rather than a set's; the skill menu lists them in SKILLS
+order for that reason.
+"""
+
+import argparse
+from collections import Counter
+import json
+import logging
+import multiprocessing
+import random
+
+import main
+from main import CHAR_CLASSES, EVENTS, HOBBY, POINT_BUY_STATS, SKILLS, STATS
+from headless import HeadlessGame, play, success_chance
+
+
+def pts_gain(result):
+    return result.stat_mods.get(STATS.PTS, 0) if result is not None else 0
+
+
+def expected_pts(game, choice):
+    chance = success_chance(game.player.stats, game.player.skills, choice)
+    return chance * pts_gain(choice.success) + (1 - chance) * pts_gain(choice.failure)
+
+
+def skill_values():
+    """ Total PTS on offer from event choices that require each skill """
+    values = Counter()
+    for event in EVENTS.values():
+        for choice in event.choices:
+            for skill in choice.skill_reqs:
+                values[skill] += max(pts_gain(choice.success), 0)
+    return values
+
+
+def stat_values():
+    """ Total PTS riding on checks of each point-buy stat """
+    values = Counter({stat: 1 for stat in POINT_BUY_STATS})
+    for event in EVENTS.values():
+        for choice in event.choices:
+            for check in choice.checks:
+                if check.stat in values:
+                    values[check.stat] += max(pts_gain(choice.success), 0)
+    return values
+
+
+SKILL_VALUES = skill_values()
+STAT_VALUES = stat_values()
+
+
+def buy_points(pick_stat):
+    """ Spends every point one at a time on pick_stat(values, affordable) """
+    values = {stat: 10 for stat in POINT_BUY_STATS}
+    while main.PointBuy.points_remaining(values) > 0:
+        remaining = main.PointBuy.points_remaining(values)
+        affordable = [
+            stat
+            for stat in POINT_BUY_STATS
+            if (2 if values[stat] >= 16 else 1) <= remaining
+        ]
+        values[pick_stat(values, affordable)] += 1
+    return values
+
+
+def random_policy(game, decision):
+    if decision.kind == "point_buy":
+        return buy_points(lambda values, affordable: random.choice(affordable))
+    return random.choice(game.enabled_choices())
+
+
+def greedy_policy(game, decision):
+    """ Maximizes the PTS expected from the current decision alone """
+    if decision.kind == "point_buy":
+        return buy_points(
+            lambda values, affordable: max(
+                affordable, key=lambda s: STAT_VALUES[s] / (values[s] - 8)
+            )
+        )
+    choices = game.enabled_choices()
+    first = choices[0]
+    if isinstance(first, main.EventChoice):
+        return max(choices, key=lambda c: (expected_pts(game, c), random.random()))
+    if isinstance(first, SKILLS):
+        return max(choices, key=lambda c: (SKILL_VALUES[c], random.random()))
+    return random.choice(choices)
+
+
+CLASS_PLANS = {
+    CHAR_CLASSES.FIGHTING_MAN: (
+        [STATS.STR, STATS.DEX, STATS.CON, STATS.LUC],
+        [
+            SKILLS.JUMP,
+            SKILLS.UNARMED_COMBAT,
+            SKILLS.ONE_HANDED_COMBAT,
+            SKILLS.CLIMB,
+            SKILLS.TWO_HANDED_COMBAT,
+            SKILLS.MOUNTED_COMBAT,
+            SKILLS.THREE_HANDED_COMBAT,
+        ],
+        HOBBY.RUN,
+    ),
+    CHAR_CLASSES.MAGIC_USER: (
+        [STATS.INT, STATS.CHA, STATS.LUC, STATS.CON],
+        [
+            SKILLS.READ,
+            SKILLS.RHETORIC,
+            SKILLS.NUMEROLOGY_1,
+            SKILLS.COMMUNICATION_1,
+            SKILLS.WRITE,
+            SKILLS.IDENTIFY,
+            SKILLS.DETECTIVE,
+            SKILLS.NUMEROLOGY_2,
+            SKILLS.NUMEROLOGY_3,
+            SKILLS.COMMUNICATION_2,
+            SKILLS.COMMUNICATION_3,
+            SKILLS.STATECRAFT,
+        ],
+        HOBBY.READ,
+    ),
+    CHAR_CLASSES.CLERIC: (
+        [STATS.WIS, STATS.CON, STATS.LUC, STATS.CHA],
+        [
+            SKILLS.EMPATHY,
+            SKILLS.ANIMALS,
+            SKILLS.HERBOLOGY,
+            SKILLS.CLOVER,
+            SKILLS.TIME,
+            SKILLS.COSMOLOGY,
+            SKILLS.PRIMED,
+        ],
+        HOBBY.BIRDWATCHING,
+    ),
+}
+
+
+def class_policy(char_class):
+    """ Plays char_class with a fixed stat and skill build order """
+    stat_order, skill_order, hobby = CLASS_PLANS[char_class]
+
+    def pick_stat(values, affordable):
+        for stat in stat_order:
+            if stat in affordable and values[stat] < 16:
+                return stat
+        return random.choice(affordable)
+
+    def policy(game, decision):
+        if decision.kind == "point_buy":
+            return buy_points(pick_stat)
+        choices = game.enabled_choices()
+        first = choices[0]
+        if isinstance(first, CHAR_CLASSES):
+            return char_class
+        if isinstance(first, HOBBY):
+            return hobby
+        if isinstance(first, SKILLS):
+            for skill in skill_order:
+                if skill in choices:
+                    return skill
+        return greedy_policy(game, decision)
+
+    return policy
+
+
+POLICIES = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+    **{c.name.lower(): class_policy(c) for c in CHAR_CLASSES},
+}
+
+
+class SimulationStats:
+    def __init__(self):
+        self.lives = 0
+        self.scores = Counter()
+        self.ages = Counter()
+        self.choices = Counter()
+        self.successes = Counter()
+
+    def add(self, game):
+        self.lives += 1
+        self.scores[game.player.stats[STATS.PTS]] += 1
+        self.ages[game.player.stats[STATS.AGE]] += 1
+        for (event_name, choice_name, success) in game.choice_log:
+            self.choices[event_name, choice_name] += 1
+            self.successes[event_name, choice_name] += success
+
+    def merge(self, other):
+        self.lives += other.lives
+        self.scores.update(other.scores)
+        self.ages.update(other.ages)
+        self.choices.update(other.choices)
+        self.successes.update(other.successes)
+
+    def report(self):
+        def summarize(hist):
+            n = sum(hist.values())
+            mean = sum(k * v for (k, v) in hist.items()) / n
+            variance = sum(v * (k - mean) ** 2 for (k, v) in hist.items()) / n
+            keys = sorted(hist)
+            seen = 0
+            for median in keys:
+                seen += hist[median]
+                if seen * 2 > n:
+                    break
+            return {
+                "mean": mean,
+                "stdev": variance ** 0.5,
+                "min": keys[0],
+                "median": median,
+                "max": keys[-1],
+                "histogram": {str(k): hist[k] for k in keys},
+            }
+
+        return {
+            "lives": self.lives,
+            "score": summarize(self.scores),
+            "age_at_death": summarize(self.ages),
+            "choices": [
+                {
+                    "event": event_name,
+                    "choice": choice_name,
+                    "chosen": n,
+                    "success_rate": self.successes[event_name, choice_name] / n,
+                }
+                for ((event_name, choice_name), n) in sorted(self.choices.items())
+            ],
+        }
+
+
+def init_worker(total_points):
+    logging.disable(logging.WARNING)
+    if total_points is not None:
+        main.PointBuy.TOTAL_POINTS = total_points
+
+
+def run_chunk(task):
+    policy_name, seed, index, lives = task
+    random.seed(f"{seed}:{index}")
+    policy = POLICIES[policy_name]
+    stats = SimulationStats()
+    for _ in range(lives):
+        stats.add(play(HeadlessGame(), policy))
+    return stats
+
+
+def simulate(pool, policy_name, lives, seed=0, chunk_size=10000):
+    tasks = [
+        (policy_name, seed, index, min(chunk_size, lives - start))
+        for (index, start) in enumerate(range(0, lives, chunk_size))
+    ]
+    stats = SimulationStats()
+    for chunk in pool.imap_unordered(run_chunk, tasks):
+        stats.merge(chunk)
+    return stats
+
+
+def print_report(policy_name, report):
+    score, age = report["score"], report["age_at_death"]
+    print(f"== {policy_name}: {report['lives']} lives")
+    print(
+        f"score: mean {score['mean']:.2f} sd {score['stdev']:.2f}"
+        f" min {score['min']} median {score['median']} max {score['max']}"
+    )
+    print(
+        f"age at death: mean {age['mean']:.2f}"
+        f" min {age['min']} median {age['median']} max {age['max']}"
+    )
+    for row in report["choices"]:
+        print(
+            f"  {row['event']:>12} {row['chosen']:>9} {row['success_rate']:6.1%}"
+            f"  {row['choice']}"
+        )
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lives", type=int, default=100000)
+    parser.add_argument(
+        "--policy", nargs="+", choices=sorted(POLICIES), default=["random"]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--total-points",
+        type=int,
+        default=None,
+        help="override PointBuy.TOTAL_POINTS for this run",
+    )
+    parser.add_argument("--json", help="also write the merged results to this file")
+    args = parser.parse_args()
+    if args.lives < 1 or args.chunk_size < 1:
+        parser.error("--lives and --chunk-size must be at least 1")
+
+    reports = {}
+    with multiprocessing.Pool(
+        args.processes, initializer=init_worker, initargs=(args.total_points,)
+    ) as pool:
+        for policy_name in args.policy:
+            stats = simulate(pool, policy_name, args.lives, args.seed, args.chunk_size)
+            reports[policy_name] = stats.report()
+            print_report(policy_name, reports[policy_name])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
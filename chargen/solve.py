@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+"""
+Compute the play that maximizes expected PTS.
+
+The solver mirrors play_linear(): class choice, the point-buy split, skill
+picks, the hobby and every event choice are max nodes; the random event pick,
+StatCheck rolls, hobby and aging dice are chance nodes. Values are memoized on
+a canonical state:
+
+  * PTS is left out of the state, since it only ever adds up;
+  * each stat is clamped to the range where it can still change the outcome
+    of some comparison, given how far the unseen events and aging could
+    still move it, so e.g. every STR above the highest reachable DC is the
+    same state;
+  * skills and seen events are bitmasks;
+  * unseen events that can no longer come up count as seen, and skills
+    nothing live asks for are dropped, since picking one is dominated by
+    picking a skill that is still wanted.
+
+Choices whose best case cannot beat the current best are pruned using an
+upper bound on the PTS the unseen events can still give, and builds that
+canonicalize to the same state are only solved once. Builds are spread over
+a process pool.
+
+The full tree is far too large to search on one machine in reasonable time,
+so by default the search stops at --horizon turns and estimates the rest as
+the best expected PTS of each live event at the stats reached so far. Pass
+--exact to search every turn.
+
+Each build takes about a second at --horizon 1 and 40 seconds at --horizon 2
+on one core. The --point-step 4 search covers some 2,900 builds: about an
+hour of CPU at horizon 1 and 30 hours at horizon 2, divided among the cores.
+One point-buy split, for every class, takes two minutes at horizon 2:
+
+    python chargen/solve.py --stats 14 14 14 13 13 13 13 --policy-out policy.jsonl
+    python chargen/solve.py --point-step 4 --horizon 1
+"""
+import argparse
+from collections import namedtuple
+from functools import lru_cache
+import itertools
+import json
+import logging
+import multiprocessing
+
+import main
+from main import (
+    AGES,
+    CHAR_CLASS_STAT_BONUSES,
+    CHAR_CLASSES,
+    EVENTS,
+    HIDDEN_SKILLS,
+    HOBBY,
+    POINT_BUY_STATS,
+    SKILL_PREREQS,
+    SKILL_STAT_PREREQS,
+    SKILLS,
+    STATS,
+)
+from headless import roll_distribution
+
+
+STATE_STATS = [stat for stat in STATS if stat not in (STATS.AGE, STATS.PTS)]
+STAT_INDEX = {stat: i for (i, stat) in enumerate(STATE_STATS)}
+SKILL_BIT = {skill: 1 << i for (i, skill) in enumerate(SKILLS)}
+EVENT_BIT = {name: 1 << i for (i, name) in enumerate(EVENTS)}
+HOBBY_STATS = {
+    HOBBY.RUN: STATS.DEX,
+    HOBBY.READ: STATS.INT,
+    HOBBY.BIRDWATCHING: STATS.WIS,
+}
+# highest possible 2d4 aging roll, counting Four-Leaf Clover
+MAX_AGING = 16
+
+
+def skill_bits(skills):
+    bits = 0
+    for skill in skills:
+        bits |= SKILL_BIT[skill]
+    return bits
+
+
+# (skill, bit, prereq bits, [(stat index, minimum)]) for every pickable skill
+PICKABLE = [
+    (
+        skill,
+        SKILL_BIT[skill],
+        skill_bits(SKILL_PREREQS.get(skill, ())),
+        [
+            (STAT_INDEX[stat], req)
+            for (stat, req) in SKILL_STAT_PREREQS.get(skill, {}).items()
+        ],
+    )
+    for skill in SKILLS
+    if skill not in HIDDEN_SKILLS
+]
+
+
+def age_of(turn):
+    return 2 if turn == 0 else AGES[turn - 1]
+
+
+def sides_for(sides, skills):
+    return 8 if sides == 4 and skills & SKILL_BIT[SKILLS.CLOVER] else sides
+
+
+def roll_range(num_dice, sides):
+    totals = list(roll_distribution(num_dice, sides))
+    return min(totals), max(totals)
+
+
+def result_deltas(result):
+    deltas = [0] * len(STATE_STATS)
+    if result is not None:
+        for (stat, mod) in result.stat_mods.items():
+            if stat in STAT_INDEX:
+                deltas[STAT_INDEX[stat]] += mod
+    return deltas
+
+
+def event_swings():
+    """ How far each event can still push each stat down and up """
+    swings = {}
+    for (name, event) in EVENTS.items():
+        down = [0] * len(STATE_STATS)
+        up = [0] * len(STATE_STATS)
+        for choice in event.choices:
+            for result in (choice.success, choice.failure):
+                for (i, delta) in enumerate(result_deltas(result)):
+                    down[i] = max(down[i], -delta)
+                    up[i] = max(up[i], delta)
+        swings[name] = (down, up)
+    return swings
+
+
+def event_best_gain():
+    return {
+        name: max(
+            max(result.stat_mods.get(STATS.PTS, 0), 0)
+            for choice in event.choices
+            for result in (choice.success, choice.failure)
+            if result is not None
+        )
+        for (name, event) in EVENTS.items()
+    }
+
+
+EVENT_SWINGS = event_swings()
+EVENT_BEST_GAIN = event_best_gain()
+
+
+Outlook = namedtuple("Outlook", ["seen", "wanted", "low", "high", "gain", "live"])
+
+
+class Probe:
+    """ Just enough of CharInfo for Event.requires """
+
+    def __init__(self, turn, stats, skills):
+        self.stats = {stat: stats[i] for (i, stat) in enumerate(STATE_STATS)}
+        self.stats[STATS.AGE] = age_of(turn)
+        self.stats[STATS.PTS] = 0
+        self.skills = {skill for (skill, bit) in SKILL_BIT.items() if skills & bit}
+
+
+ALL_SKILLS = skill_bits(SKILLS)
+NO_STATS = (0,) * len(STATE_STATS)
+
+
+@lru_cache(maxsize=None)
+def can_fire(name, turn):
+    """ Whether the event could still come up on its own at turn or later """
+    event = EVENTS[name]
+    if event.age_req is not None:
+        return any(age_of(t) == event.age_req for t in range(turn, len(AGES) + 1))
+    return any(
+        event.requires(Probe(t, NO_STATS, skills))
+        for t in range(turn, len(AGES) + 1)
+        for skills in (0, ALL_SKILLS)
+    )
+
+
+@lru_cache(maxsize=None)
+def prereq_skills(name, turn):
+    """ Skills that Event.requires reacts to from turn onwards """
+    if turn > len(AGES):
+        return frozenset()
+    event = EVENTS[name]
+    base = event.requires(Probe(turn, NO_STATS, 0))
+    now = {
+        skill
+        for skill in SKILLS
+        if event.requires(Probe(turn, NO_STATS, SKILL_BIT[skill])) != base
+    }
+    return frozenset(now) | prereq_skills(name, turn + 1)
+
+
+class Solver:
+    def __init__(self, horizon=None, record_policy=False, max_cache=5_000_000):
+        self.horizon = horizon
+        self.cache = {}
+        self.outlooks = {}
+        self.policy = {} if record_policy else None
+        self.max_cache = max_cache
+        self.hits = 0
+        self.misses = 0
+
+    def memo(self, key, compute):
+        if key in self.cache:
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+        if len(self.cache) >= self.max_cache:
+            self.cache.clear()
+        value = compute()
+        self.cache[key] = value
+        return value
+
+    def choose(self, key, action):
+        if self.policy is not None:
+            self.policy[key] = action
+
+    def outlook(self, seen, turn):
+        """ What the rest of the game can still do from (seen, turn)
+
+        An unseen event that can neither come up again nor be triggered by a
+        live one is marked seen. wanted masks the skills something live still
+        asks for; a pick of any other skill is dominated by a pick of a wanted
+        one, so the rest are dropped from the state. Below low[i] or above
+        high[i], stat i can no longer change the outcome of any comparison,
+        however far the live events and aging move it. gain bounds the PTS
+        still on offer.
+        """
+        key = (seen, turn)
+        if key in self.outlooks:
+            return self.outlooks[key]
+        live = {
+            name
+            for (name, bit) in EVENT_BIT.items()
+            if not seen & bit and can_fire(name, turn)
+        }
+        agenda = list(live)
+        while agenda:
+            for choice in EVENTS[agenda.pop()].choices:
+                for result in (choice.success, choice.failure):
+                    for name in result.trigger_events if result else ():
+                        if name not in live and not seen & EVENT_BIT[name]:
+                            live.add(name)
+                            agenda.append(name)
+
+        aging = sum(1 for age in AGES[turn:] if age > 55)
+        wanted = {SKILLS.CLOVER} if aging else set()
+        for name in live:
+            wanted |= prereq_skills(name, turn)
+            for choice in EVENTS[name].choices:
+                wanted.update(choice.skill_reqs)
+                if any(check.sides == 4 for check in choice.checks):
+                    wanted.add(SKILLS.CLOVER)
+        agenda = list(wanted)
+        while agenda:
+            for skill in SKILL_PREREQS.get(agenda.pop(), ()):
+                if skill not in wanted:
+                    wanted.add(skill)
+                    agenda.append(skill)
+
+        # CON <= 0 is death
+        thresholds = {STATS.CON: [0, 1]}
+        down = [0] * len(STATE_STATS)
+        up = [0] * len(STATE_STATS)
+        down[STAT_INDEX[STATS.CON]] = aging * MAX_AGING
+        gain = 0
+        for name in live:
+            for choice in EVENTS[name].choices:
+                for (stat, num_dice, sides, dc) in choice.checks:
+                    for s in {sides, 8 if sides == 4 else sides}:
+                        (lo_roll, hi_roll) = roll_range(num_dice, s)
+                        thresholds.setdefault(stat, []).extend(
+                            [dc - hi_roll - 1, dc - lo_roll]
+                        )
+                for (stat, req) in choice.stat_reqs.items():
+                    thresholds.setdefault(stat, []).extend([req, req + 1])
+            (event_down, event_up) = EVENT_SWINGS[name]
+            for i in range(len(STATE_STATS)):
+                down[i] += event_down[i]
+                up[i] += event_up[i]
+            gain += EVENT_BEST_GAIN[name]
+        for skill in wanted:
+            for (stat, req) in SKILL_STAT_PREREQS.get(skill, {}).items():
+                thresholds.setdefault(stat, []).extend([req - 1, req])
+
+        low = [0] * len(STATE_STATS)
+        high = [0] * len(STATE_STATS)
+        for (stat, values) in thresholds.items():
+            if stat in STAT_INDEX:
+                i = STAT_INDEX[stat]
+                low[i] = min(values) - up[i]
+                high[i] = max(values) + down[i]
+        dead = sum(bit for (name, bit) in EVENT_BIT.items() if name not in live)
+        outlook = Outlook(seen | dead, skill_bits(wanted), low, high, gain, live)
+        self.outlooks[key] = outlook
+        return outlook
+
+    @staticmethod
+    def canonical(stats, low, high):
+        return tuple(min(max(val, lo), hi) for (val, lo, hi) in zip(stats, low, high))
+
+    # the game loop, one method per step of play_linear()
+
+    def loop(self, turn, stats, skills, seen):
+        outlook = self.outlook(seen, turn)
+        seen = outlook.seen
+        skills &= outlook.wanted
+        stats = self.canonical(stats, outlook.low, outlook.high)
+        key = ("loop", turn, stats, skills, seen)
+        if self.horizon is not None and turn >= self.horizon:
+            return self.memo(key, lambda: self.estimate(outlook, stats, skills))
+        return self.memo(key, lambda: self._loop(turn, stats, skills, seen))
+
+    def estimate(self, outlook, stats, skills):
+        """ PTS if every live event were played once with the current stats """
+        return sum(
+            max(
+                expected_pts(choice, stats, skills)
+                for choice in EVENTS[name].choices
+                if can_choose(choice, stats, skills)
+            )
+            for name in outlook.live
+        )
+
+    def _loop(self, turn, stats, skills, seen):
+        probe = Probe(turn, stats, skills)
+        age = age_of(turn)
+        mandatory = [
+            name
+            for (name, event) in EVENTS.items()
+            if event.age_req == age
+            and not seen & EVENT_BIT[name]
+            and event.requires(probe)
+        ]
+        if mandatory:
+            cont = ("loop", turn)
+            return sum(
+                self.event(name, (), cont, stats, skills, seen) for name in mandatory
+            ) / len(mandatory)
+        events = [
+            name
+            for (name, event) in EVENTS.items()
+            if not seen & EVENT_BIT[name]
+            and event.requires(probe)
+            and event.age_req is None
+        ]
+        if not events:
+            return self.skill(turn, stats, skills, seen)
+        cont = ("skill", turn)
+        return sum(
+            self.event(name, (), cont, stats, skills, seen) for name in events
+        ) / len(events)
+
+    def skill(self, turn, stats, skills, seen):
+        wanted = self.outlook(seen, turn).wanted
+        choosable = [
+            skill
+            for (skill, bit, prereqs, stat_reqs) in PICKABLE
+            if wanted & bit
+            and not skills & bit
+            and skills & prereqs == prereqs
+            and all(stats[i] >= req for (i, req) in stat_reqs)
+        ]
+        if not choosable:
+            return self.age(turn, stats, skills, seen)
+        best, best_skill = None, None
+        for skill in choosable:
+            value = self.age(turn, stats, skills | SKILL_BIT[skill], seen)
+            if best is None or value > best:
+                best, best_skill = value, skill
+        self.choose(("skill", turn, stats, skills, seen), best_skill.name)
+        return best
+
+    def age(self, turn, stats, skills, seen):
+        if turn >= len(AGES):
+            return 0.0
+        age = AGES[turn]
+        if age <= 55:
+            return self.alive(turn + 1, stats, skills, seen)
+        con = STAT_INDEX[STATS.CON]
+        dist = roll_distribution(2, sides_for(4, skills))
+        return sum(
+            p * self.alive(turn + 1, shift(stats, con, -roll), skills, seen)
+            for (roll, p) in dist.items()
+        )
+
+    def alive(self, turn, stats, skills, seen):
+        if stats[STAT_INDEX[STATS.CON]] <= 0:
+            return 0.0
+        return self.loop(turn, stats, skills, seen)
+
+    def resume(self, pending, cont, stats, skills, seen):
+        if pending:
+            return self.event(pending[0], pending[1:], cont, stats, skills, seen)
+        (step, turn) = cont
+        if step == "loop":
+            return self.loop(turn, stats, skills, seen)
+        return self.skill(turn, stats, skills, seen)
+
+    def event(self, name, pending, cont, stats, skills, seen):
+        seen |= EVENT_BIT[name]
+        key = ("event", name, pending, cont, stats, skills, seen)
+        return self.memo(
+            key, lambda: self._event(key, name, pending, cont, stats, skills, seen)
+        )
+
+    def _event(self, key, name, pending, cont, stats, skills, seen):
+        future_gain = self.outlook(seen, cont[1]).gain
+        options = []
+        for choice in EVENTS[name].choices:
+            if not can_choose(choice, stats, skills):
+                continue
+            chance = success_chance(choice, stats, skills)
+            outcomes = [(chance, choice.success), (1 - chance, choice.failure)]
+            outcomes = [(p, result) for (p, result) in outcomes if p > 0]
+            ceiling = max(
+                result.stat_mods.get(STATS.PTS, 0) for (_, result) in outcomes
+            )
+            options.append((ceiling + future_gain, choice, outcomes))
+
+        best, best_choice = None, None
+        for (ceiling, choice, outcomes) in sorted(options, key=lambda o: -o[0]):
+            if best is not None and ceiling <= best:
+                break
+            value = sum(
+                p * self.outcome(result, pending, cont, stats, skills, seen)
+                for (p, result) in outcomes
+            )
+            if best is None or value > best:
+                best, best_choice = value, choice
+        self.choose(key, best_choice.name)
+        return best
+
+    def outcome(self, result, pending, cont, stats, skills, seen):
+        deltas = result_deltas(result)
+        stats = tuple(val + delta for (val, delta) in zip(stats, deltas))
+        skills |= skill_bits(result.skills_gained)
+        pending = tuple(result.trigger_events) + pending
+        future = self.resume(pending, cont, stats, skills, seen)
+        return result.stat_mods.get(STATS.PTS, 0) + future
+
+    # decisions before the first turn
+
+    def build(self, char_class, values):
+        """ Expected PTS after picking char_class and buying values """
+        bonuses = CHAR_CLASS_STAT_BONUSES[char_class]
+        stats = [0] * len(STATE_STATS)
+        for (stat, val) in values.items():
+            stats[STAT_INDEX[stat]] = val + bonuses.get(stat, 0)
+        stats = tuple(stats)
+        choosable = [
+            skill
+            for skill in SKILLS
+            if skill not in HIDDEN_SKILLS
+            and skill not in SKILL_PREREQS
+            and all(
+                stats[STAT_INDEX[stat]] >= req
+                for (stat, req) in SKILL_STAT_PREREQS.get(skill, {}).items()
+            )
+        ]
+        best, best_skill = None, None
+        for skill in choosable or [None]:
+            skills = SKILL_BIT[skill] if skill is not None else 0
+            value = self.hobby(stats, skills)
+            if best is None or value > best:
+                best, best_skill = value, skill
+        if best_skill is not None:
+            self.choose(("first_skill", char_class.name, stats), best_skill.name)
+        return best
+
+    def hobby(self, stats, skills):
+        best, best_hobby = None, None
+        for hobby in HOBBY:
+            if hobby == HOBBY.READ and not skills & SKILL_BIT[SKILLS.READ]:
+                value = self.loop(0, stats, skills, 0)
+            else:
+                i = STAT_INDEX[HOBBY_STATS[hobby]]
+                value = sum(
+                    p * self.loop(0, shift(stats, i, roll), skills, 0)
+                    for (roll, p) in roll_distribution(1, sides_for(4, skills)).items()
+                )
+            if best is None or value > best:
+                best, best_hobby = value, hobby
+        self.choose(("hobby", stats, skills), best_hobby.name)
+        return best
+
+
+def shift(stats, i, delta):
+    shifted = list(stats)
+    shifted[i] += delta
+    return tuple(shifted)
+
+
+def skills_have(skills, required):
+    return all(skills & SKILL_BIT[skill] for skill in required)
+
+
+def can_choose(choice, stats, skills):
+    return skills_have(skills, choice.skill_reqs) and all(
+        stats[STAT_INDEX[stat]] > req for (stat, req) in choice.stat_reqs.items()
+    )
+
+
+def success_chance(choice, stats, skills):
+    chance = 1.0
+    for (stat, num_dice, sides, dc) in choice.checks:
+        need = dc - stats[STAT_INDEX[stat]]
+        dist = roll_distribution(num_dice, sides_for(sides, skills))
+        chance *= sum(p for (total, p) in dist.items() if total >= need)
+    return chance
+
+
+def expected_pts(choice, stats, skills):
+    chance = success_chance(choice, stats, skills)
+    gain = chance * choice.success.stat_mods.get(STATS.PTS, 0)
+    if choice.failure is not None:
+        gain += (1 - chance) * choice.failure.stat_mods.get(STATS.PTS, 0)
+    return gain
+
+
+def allocations(step, lowest, highest):
+    """ Every point-buy split on a grid of step points that spends exactly """
+    grid = range(10 - (10 - lowest) // step * step, highest + 1, step)
+    for values in itertools.product(grid, repeat=len(POINT_BUY_STATS)):
+        split = dict(zip(POINT_BUY_STATS, values))
+        if main.PointBuy.points_remaining(split) == 0:
+            yield split
+
+
+def candidate_builds(step, lowest, highest):
+    """ (class, split) pairs, skipping splits that canonicalize identically """
+    outlook = Solver().outlook(0, 0)
+    seen = set()
+    for char_class in CHAR_CLASSES:
+        bonuses = CHAR_CLASS_STAT_BONUSES[char_class]
+        for split in allocations(step, lowest, highest):
+            stats = [0] * len(STATE_STATS)
+            for (stat, val) in split.items():
+                stats[STAT_INDEX[stat]] = val + bonuses.get(stat, 0)
+            key = (char_class, Solver.canonical(stats, outlook.low, outlook.high))
+            if key not in seen:
+                seen.add(key)
+                yield (char_class, split)
+
+
+def solve_build(task):
+    (char_class, split, horizon, max_cache) = task
+    solver = Solver(horizon, max_cache=max_cache)
+    return (char_class, split, solver.build(char_class, split))
+
+
+def describe(key):
+    """ A policy table key as JSON-friendly fields """
+    fields = {"decision": key[0]}
+    if key[0] == "event":
+        (_, fields["event"], pending, cont, stats, skills, seen) = key
+        fields["then"] = [*pending, cont[0]]
+        fields["turn"] = cont[1]
+    elif key[0] == "skill":
+        (_, fields["turn"], stats, skills, seen) = key
+    elif key[0] == "hobby":
+        (_, stats, skills), seen = key, 0
+    elif key[0] == "first_skill":
+        (_, fields["class"], stats), skills, seen = key, 0, 0
+    else:
+        return fields
+    fields["stats"] = {stat.value: val for (stat, val) in zip(STATE_STATS, stats)}
+    fields["skills"] = [s.value for (s, bit) in SKILL_BIT.items() if skills & bit]
+    fields["seen"] = [name for (name, bit) in EVENT_BIT.items() if seen & bit]
+    return fields
+
+
+def write_policy(path, policy):
+    with open(path, "w") as f:
+        for (key, action) in policy.items():
+            f.write(json.dumps({**describe(key), "action": action}) + "\n")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--point-step", type=int, default=4)
+    parser.add_argument("--min-stat", type=int, default=6)
+    parser.add_argument("--max-stat", type=int, default=20)
+    parser.add_argument(
+        "--class", dest="char_class", choices=[c.name.lower() for c in CHAR_CLASSES]
+    )
+    parser.add_argument(
+        "--stats",
+        type=int,
+        nargs=len(POINT_BUY_STATS),
+        metavar=tuple(s.name for s in POINT_BUY_STATS),
+        help="solve only this point-buy split",
+    )
+    parser.add_argument(
+        "--horizon",
+        type=int,
+        default=2,
+        help="search this many turns exactly, then estimate (default: 2)",
+    )
+    parser.add_argument("--exact", action="store_true", help="search every turn")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--max-cache", type=int, default=5_000_000)
+    parser.add_argument("--policy-out", help="write the optimal policy table here")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    horizon = None if args.exact else args.horizon
+
+    if args.stats:
+        split = dict(zip(POINT_BUY_STATS, args.stats))
+        if main.PointBuy.points_remaining(split) != 0:
+            parser.error(f"split must spend exactly {main.PointBuy.TOTAL_POINTS}")
+        builds = [(c, split) for c in CHAR_CLASSES]
+    else:
+        builds = candidate_builds(args.point_step, args.min_stat, args.max_stat)
+    if args.char_class:
+        builds = [b for b in builds if b[0].name.lower() == args.char_class]
+    tasks = [(c, split, horizon, args.max_cache) for (c, split) in builds]
+    print(f"solving {len(tasks)} builds")
+
+    best = None
+    with multiprocessing.Pool(args.processes) as pool:
+        for (char_class, split, value) in pool.imap_unordered(solve_build, tasks):
+            if best is None or value > best[2]:
+                best = (char_class, split, value)
+                print(f"{value:8.3f} {char_class.value} {format_split(split)}")
+
+    (char_class, split, value) = best
+    print(f"optimal expected PTS: {value:.3f}")
+    print(f"  class: {char_class.value}")
+    print(f"  stats: {format_split(split)}")
+    if args.policy_out:
+        solver = Solver(horizon, record_policy=True, max_cache=args.max_cache)
+        solver.build(char_class, split)
+        solver.choose(("class",), char_class.name)
+        solver.choose(("point_buy", char_class.name), format_split(split))
+        write_policy(args.policy_out, solver.policy)
+        print(f"wrote {len(solver.policy)} policy entries to {args.policy_out}")
+
+
+def format_split(split):
+    return " ".join(f"{stat.value} {val}" for (stat, val) in split.items())
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Watch a live game without playing it.
+
+Games started with --spectate accept viewers on a Unix socket in
+data/spectate/. The game renders each frame once and copies it to every
+viewer, so watching costs the host almost nothing:
+
+    python chargen/main.py --spectate
+    python chargen/spectate.py          # the live game with the best score
+    python chargen/spectate.py --list
+    python chargen/spectate.py data/spectate/1234.sock
+
+Press q or ctrl-c to stop watching.
+"""
+import argparse
+import glob
+import json
+import os
+import select
+import shutil
+import socket
+import sys
+import termios
+import tty
+
+from urwid import escape
+
+import main
+
+
+def read_header(sock):
+    """ The JSON line a game sends before its screen """
+    header = b""
+    while not header.endswith(b"\n"):
+        data = sock.recv(1)
+        if not data:
+            raise ConnectionError("game closed the connection")
+        header += data
+    return json.loads(header)
+
+
+def live_games(spectate_dir):
+    """ [(socket path, header)] for every game accepting viewers """
+    games = []
+    for path in sorted(glob.glob(os.path.join(spectate_dir, "*.sock"))):
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(2)
+            try:
+                sock.connect(path)
+            except ConnectionRefusedError:
+                # left behind by a game that did not exit cleanly
+                os.unlink(path)
+                continue
+            except OSError:
+                continue
+            try:
+                games.append((path, read_header(sock)))
+            except (OSError, ValueError):
+                continue
+    return games
+
+
+def watch(path):
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        header = read_header(sock)
+        # the game only starts sending its screen once asked to
+        sock.sendall(b"watch\n")
+        (columns, rows) = shutil.get_terminal_size()
+        if columns < header["columns"] or rows < header["rows"]:
+            print(
+                f"This game is {header['columns']}x{header['rows']} but your"
+                f" terminal is {columns}x{rows}; the picture will be garbled",
+                file=sys.stderr,
+            )
+        stdin = sys.stdin.fileno()
+        stdout = sys.stdout.fileno()
+        saved_mode = termios.tcgetattr(stdin)
+        tty.setcbreak(stdin)
+        os.write(stdout, escape.SWITCH_TO_ALTERNATE_BUFFER.encode())
+        try:
+            while True:
+                (readable, _, _) = select.select([sock, stdin], [], [])
+                if stdin in readable and os.read(stdin, 1024)[:1] in (b"q", b"\x03"):
+                    break
+                if sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        break
+                    os.write(stdout, data)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            restore = f"{escape.ESC}[0m{escape.SI}{escape.SHOW_CURSOR}"
+            os.write(stdout, (restore + escape.RESTORE_NORMAL_BUFFER).encode())
+            termios.tcsetattr(stdin, termios.TCSADRAIN, saved_mode)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("socket", nargs="?", help="default: the best live game")
+    parser.add_argument("--list", action="store_true", help="list live games")
+    parser.add_argument("--dir", default=main.SPECTATE_DIR)
+    args = parser.parse_args()
+    if args.socket:
+        watch(args.socket)
+        return
+    games = live_games(args.dir)
+    if args.list:
+        for (path, header) in games:
+            print(
+                f"{path}  {header['class'] or '(choosing)'}, age {header['age']},"
+                f" score {header['score']}  {header['columns']}x{header['rows']}"
+            )
+        return
+    if not games:
+        sys.exit(f"No games to watch in {args.dir}")
+    (path, _) = max(games, key=lambda game: game[1]["score"])
+    watch(path)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Play the game over HTTP, one JSON request per decision.
+
+Instead of a terminal and a process per player, one server keeps every game
+in memory as a HeadlessGame, evicting the least recently played once
+--max-sessions are open:
+
+    python chargen/stepapi.py --port 8080
+
+    POST /sessions              start a game
+    GET /sessions/<id>          the decision it is waiting on
+    POST /sessions/<id>         answer that decision
+    DELETE /sessions/<id>       end the game
+
+With CHARGEN_CONTENT set, SIGHUP reloads the content tables from that file.
+Games already running keep the tables they started with.
+
+Each reply describes the next decision and what the player can see:
+
+    {"session": "9f1c...", "kind": "menu", "title": "CHOOSE YOUR CLASS",
+     "choices": [{"label": "Fighting-Man", "description": "", "enabled": true},
+                 ...],
+     "player": {"class": null, "stats": {}, "skills": []}}
+
+and is answered by POSTing, according to its kind:
+
+    menu        {"choice": <index into choices>}
+    point_buy   {"stats": {"STR": 12, ...}}, spending all the points
+    popup       {}
+    game_over   {"name": <name>}, which saves the run; the reply's "standing"
+                is its rank as shown after saving in the terminal game
+"""
+import argparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import secrets
+import signal
+import threading
+
+from headless import HeadlessGame
+import main
+from main import POINT_BUY_STATS
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class StepGame(HeadlessGame):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revealed_stats = set()
+        self.saved_as = None
+        self.standing = None
+        super().__init__()
+
+    def game_over(self):
+        return super().game_over()._replace(callback=self.on_save)
+
+    def on_save(self, name):
+        self.standing = main.save(name, self.player)
+        self.saved_as = name
+
+    def state(self):
+        """ The current decision and the player, as sent to clients """
+        decision = self.decision
+        state = {"kind": decision.kind, "title": decision.title}
+        if decision.kind == "menu":
+            state["choices"] = [
+                {
+                    "label": decision.display_fn(choice),
+                    "description": decision.description_fn(choice),
+                    "enabled": bool(decision.is_enabled_fn(choice)),
+                }
+                for choice in decision.choices
+            ]
+        elif decision.kind == "point_buy":
+            state["choices"] = [{"label": stat.value} for stat in decision.choices]
+            state["points"] = main.PointBuy.TOTAL_POINTS
+            state["bonuses"] = {
+                stat.value: bonus
+                for (stat, bonus) in main.CHAR_CLASS_STAT_BONUSES[
+                    self.player.char_class
+                ].items()
+            }
+        elif decision.kind == "game_over":
+            state["saved_as"] = self.saved_as
+            if self.standing is not None:
+                state["standing"] = encode_standing(self.standing)
+        state["content"] = self.content.version
+        state["player"] = {
+            "class": self.player.char_class and self.player.char_class.value,
+            "stats": {
+                stat.value: val
+                for (stat, val) in main.visible_stats(
+                    self.player, self.revealed_stats
+                ).items()
+            },
+            "skills": sorted(skill.value for skill in self.player.skills),
+        }
+        return state
+
+    def step(self, answer):
+        """ Answers the current decision with a client's request body """
+        decision = self.decision
+        if decision.kind == "menu":
+            choice = answer.get("choice")
+            # JSON true and false would otherwise pass as 1 and 0
+            if not is_integer(choice) or not 0 <= choice < len(decision.choices):
+                raise RequestError(400, "choice must be the index of a choice")
+            choice = decision.choices[choice]
+            if not decision.is_enabled_fn(choice):
+                raise RequestError(400, "that choice is not available")
+            decision.callback(choice)
+        elif decision.kind == "point_buy":
+            decision.callback(parse_point_buy(answer.get("stats")))
+        elif decision.kind == "popup":
+            decision.callback(None)
+        elif self.saved_as is not None:
+            raise RequestError(400, f"already saved as {self.saved_as!r}")
+        else:
+            name = answer.get("name")
+            if not isinstance(name, str) or not name.strip():
+                raise RequestError(400, "name must be a non-empty string")
+            decision.callback(name)
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_point_buy(stats):
+    if not isinstance(stats, dict):
+        raise RequestError(400, "stats must map each stat to a value")
+    try:
+        values = {stat: stats[stat.value] for stat in POINT_BUY_STATS}
+    except KeyError as e:
+        raise RequestError(400, f"missing stat {e.args[0]}")
+    if not all(is_integer(val) and val > 0 for val in values.values()):
+        raise RequestError(400, "stats must be above zero")
+    if main.PointBuy.points_remaining(values) != 0:
+        raise RequestError(400, "must have zero points remaining")
+    return values
+
+
+def encode_standing(standing):
+    def runs(neighbours):
+        return [
+            {"rank": rank, "name": bones.name, "score": bones.PTS}
+            for (rank, bones) in neighbours
+        ]
+
+    return {
+        "rank": standing.rank,
+        "runs": standing.runs,
+        "percentile": standing.percentile,
+        "above": runs(standing.above),
+        "below": runs(standing.below),
+    }
+
+
+class SessionStore:
+    """ Games by session id, dropping the least recently used past max_size
+
+    Session ids start with prefix, which stephost.py uses to tell which
+    worker holds a game.
+    """
+
+    def __init__(self, max_size, prefix=""):
+        self.max_size = max_size
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.games = OrderedDict()
+
+    def __len__(self):
+        return len(self.games)
+
+    def active(self):
+        """ How many games have not been saved yet """
+        with self.lock:
+            return sum(game.saved_as is None for game in self.games.values())
+
+    def add(self, game):
+        session = f"{self.prefix}{secrets.token_hex(8)}"
+        with self.lock:
+            self.games[session] = game
+            while len(self.games) > self.max_size:
+                (evicted, _) = self.games.popitem(last=False)
+                logging.info(f"Evicted session {evicted}")
+        return session
+
+    def get(self, session):
+        with self.lock:
+            try:
+                self.games.move_to_end(session)
+            except KeyError:
+                raise RequestError(404, f"no session {session!r}")
+            return self.games[session]
+
+    def remove(self, session):
+        with self.lock:
+            if self.games.pop(session, None) is None:
+                raise RequestError(404, f"no session {session!r}")
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, so a client's requests keep reaching the same process
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request(lambda game, body: None)
+
+    def do_POST(self):
+        if self.path == "/sessions":
+            self.handle_request(None)
+        else:
+            self.handle_request(lambda game, body: game.step(body))
+
+    def do_DELETE(self):
+        try:
+            self.read_body()
+            self.server.sessions.remove(self.session_id())
+        except RequestError as e:
+            self.reply(e.status, {"error": str(e)})
+        except Exception:
+            self.internal_error()
+        else:
+            self.reply(200, {})
+
+    def session_id(self):
+        (prefix, _, session) = self.path.partition("/sessions/")
+        if prefix or not session:
+            raise RequestError(404, f"no such path {self.path}")
+        return session
+
+    def handle_request(self, step):
+        """ Runs step(game, body) and replies with the game's state
+
+        A step of None starts a new game instead.
+        """
+        try:
+            body = self.read_body()
+            if step is None:
+                game = StepGame()
+                session = self.server.sessions.add(game)
+            else:
+                session = self.session_id()
+                game = self.server.sessions.get(session)
+            with game.lock:
+                if step is not None:
+                    step(game, body)
+                state = game.state()
+        except RequestError as e:
+            self.reply(e.status, {"error": str(e)})
+        except Exception:
+            self.internal_error()
+        else:
+            self.reply(200, {"session": session, **state})
+
+    def internal_error(self):
+        """ Logs the exception being handled and replies with a 500 """
+        logging.exception(f"{self.command} {self.path} failed")
+        self.reply(500, {"error": "internal error"})
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise RequestError(400, "body must be JSON")
+        if not isinstance(body, dict):
+            raise RequestError(400, "body must be a JSON object")
+        return body
+
+    def reply(self, status, content):
+        payload = json.dumps(content, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        if status == 500:
+            # the request may not have been read in full, so the rest of the
+            # connection cannot be trusted
+            self.send_header("Connection", "close")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class StepServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, sessions, handler=RequestHandler, **kwargs):
+        self.sessions = sessions
+        super().__init__(address, handler, **kwargs)
+
+
+def on_sighup(signum, frame):
+    try:
+        main.reload_content()
+    except Exception:
+        logging.exception("Could not reload content, keeping the old tables")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=10000,
+        help="games kept in memory; the least recently played are dropped",
+    )
+    args = parser.parse_args()
+    if main.CONTENT_FILE:
+        signal.signal(signal.SIGHUP, on_sighup)
+    server = StepServer((args.host, args.port), SessionStore(args.max_sessions))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Serve the step API from one worker process per core.
+
+One stepapi.py process holds every game in memory but only ever uses one
+core. This supervisor opens the listening socket and starts --workers
+processes that all accept connections from it, each holding its own games:
+
+    python chargen/stephost.py --port 8080 --workers 8
+
+A session id starts with the name of the worker holding its game. Clients
+keep their connection open, so their requests normally reach that worker;
+any other worker forwards the request to it over the worker's Unix socket in
+--workers-dir. The supervisor checks each worker's health over the same
+socket every --health-interval, and replaces workers that exit or stop
+answering.
+
+SIGHUP restarts the workers, for instance to load new code or content. New
+workers start first; once they are healthy the old ones drain: they stop
+accepting connections but keep serving the games they hold until all of
+them have been saved or deleted, or --drain-timeout passes. SIGTERM drains
+every worker and then exits.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+from unix_socket import claim_socket
+from stepapi import RequestHandler, SessionStore, StepServer
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def worker_socket(workers_dir, name):
+    return os.path.join(workers_dir, f"{name}.sock")
+
+
+class WorkerHandler(RequestHandler):
+    """ The step API, plus /health and forwarding to the worker with a game """
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.read_body()
+            server = self.server
+            self.reply(
+                200,
+                {
+                    "sessions": len(server.sessions),
+                    "active": server.sessions.active(),
+                    "draining": server.worker.draining.is_set(),
+                },
+            )
+        elif not self.forward():
+            super().do_GET()
+
+    def do_POST(self):
+        if not self.forward():
+            super().do_POST()
+
+    def do_DELETE(self):
+        if not self.forward():
+            super().do_DELETE()
+
+    def forward(self):
+        """ Passes on a request for another worker's game; False if it is ours """
+        (prefix, _, session) = self.path.partition("/sessions/")
+        (owner, sep, _) = session.partition("-")
+        if prefix or not sep or owner == self.server.worker.name:
+            return False
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = worker_socket(self.server.worker.workers_dir, owner)
+        conn = UnixHTTPConnection(path, timeout=30)
+        try:
+            conn.request(
+                self.command,
+                self.path,
+                body,
+                {"Content-Type": "application/json"},
+            )
+            response = conn.getresponse()
+            payload = response.read()
+        except OSError:
+            # the worker holding it has gone, and its games with it
+            self.reply(404, {"error": f"no session {session!r}"})
+            return True
+        finally:
+            conn.close()
+        self.send_response(response.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        return True
+
+    def log_message(self, format, *args):
+        # a line every --health-interval per worker would bury everything else
+        if self.path != "/health":
+            super().log_message(format, *args)
+
+
+class WorkerServer(StepServer):
+    """ A step API server accepting from a socket the supervisor opened """
+
+    def __init__(self, listener, sessions, worker):
+        self.worker = worker
+        super().__init__(
+            listener.getsockname(), sessions, WorkerHandler, bind_and_activate=False
+        )
+        self.socket.close()
+        self.socket = listener
+
+
+class LocalServer(socketserver.ThreadingUnixStreamServer):
+    """ The same requests over the worker's Unix socket """
+
+    daemon_threads = True
+
+    def __init__(self, path, sessions, worker):
+        self.sessions = sessions
+        self.worker = worker
+        super().__init__(path, WorkerHandler)
+
+    def get_request(self):
+        (conn, _) = super().get_request()
+        # a Unix socket client has no address, which the handler's logging needs
+        return (conn, ("local", 0))
+
+
+class Worker:
+    def __init__(self, name, workers_dir):
+        self.name = name
+        self.workers_dir = workers_dir
+        self.draining = threading.Event()
+
+    def serve(self, listener, max_sessions, drain_timeout):
+        sessions = SessionStore(max_sessions, prefix=f"{self.name}-")
+        path = worker_socket(self.workers_dir, self.name)
+        claim_socket(path)
+        local = LocalServer(path, sessions, self)
+        public = WorkerServer(listener, sessions, self)
+        threads = [
+            threading.Thread(target=server.serve_forever, daemon=True)
+            for server in (local, public)
+        ]
+        for thread in threads:
+            thread.start()
+        # the supervisor restarts workers instead of having them reload
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *args: self.draining.set())
+        signal.signal(signal.SIGINT, lambda *args: self.draining.set())
+        try:
+            while not self.draining.wait(1):
+                pass
+            # other workers take new connections; games held here still
+            # get their requests forwarded through the Unix socket
+            public.shutdown()
+            public.server_close()
+            logging.info(f"Worker {self.name} draining {sessions.active()} games")
+            deadline = time.monotonic() + drain_timeout
+            while sessions.active() and time.monotonic() < deadline:
+                time.sleep(1)
+            logging.info(f"Worker {self.name} drained, {sessions.active()} unsaved")
+        finally:
+            local.shutdown()
+            local.server_close()
+            os.unlink(path)
+
+
+class WorkerProcess:
+    """ The supervisor's view of a worker """
+
+    def __init__(self, process, workers_dir):
+        self.process = process
+        self.name = str(process.pid)
+        self.socket = worker_socket(workers_dir, self.name)
+        self.started = time.monotonic()
+        self.healthy = False
+        self.failures = 0
+        # set on restart, until a new worker is up to take over
+        self.replacing = False
+        self.draining_since = None
+
+    def check(self, timeout):
+        """ The worker's /health reply, or None if it did not answer """
+        conn = UnixHTTPConnection(self.socket, timeout=timeout)
+        try:
+            conn.request("GET", "/health")
+            response = conn.getresponse()
+            if response.status != 200:
+                return None
+            return json.loads(response.read())
+        except (OSError, ValueError):
+            return None
+        finally:
+            conn.close()
+
+    def drain(self):
+        if self.draining_since is None:
+            self.draining_since = time.monotonic()
+            self.process.send_signal(signal.SIGTERM)
+
+
+class Supervisor:
+    def __init__(self, listener, args):
+        self.listener = listener
+        self.args = args
+        self.workers = []
+        self.restart_requested = False
+        self.stopping = False
+
+    def start_worker(self):
+        fd = self.listener.fileno()
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--worker-fd",
+                str(fd),
+                "--workers-dir",
+                self.args.workers_dir,
+                "--max-sessions",
+                str(self.args.max_sessions),
+                "--drain-timeout",
+                str(self.args.drain_timeout),
+            ],
+            pass_fds=(fd,),
+        )
+        worker = WorkerProcess(process, self.args.workers_dir)
+        logging.info(f"Started worker {worker.name}")
+        self.workers.append(worker)
+        return worker
+
+    def serving(self):
+        return [worker for worker in self.workers if worker.draining_since is None]
+
+    def tick(self):
+        args = self.args
+        for worker in list(self.workers):
+            status = worker.process.poll()
+            if status is not None:
+                if worker.draining_since is None:
+                    logging.warning(f"Worker {worker.name} exited with {status}")
+                if os.path.exists(worker.socket):
+                    # left behind by a worker that was killed
+                    os.unlink(worker.socket)
+                self.workers.remove(worker)
+                continue
+            if worker.draining_since is not None:
+                # draining workers get a minute past their own deadline
+                if time.monotonic() - worker.draining_since > args.drain_timeout + 60:
+                    logging.warning(f"Worker {worker.name} did not drain, killing it")
+                    worker.process.kill()
+                continue
+            health = worker.check(args.health_timeout)
+            if health is not None:
+                worker.healthy = True
+                worker.failures = 0
+                continue
+            # a worker is given until its first health check to come up
+            starting = time.monotonic() - worker.started < args.health_interval * 3
+            if worker.healthy or not starting:
+                worker.failures += 1
+                logging.warning(f"Worker {worker.name} failed a health check")
+            if worker.failures >= args.max_failures:
+                logging.warning(f"Worker {worker.name} is unhealthy, replacing it")
+                worker.process.kill()
+                worker.draining_since = time.monotonic()
+        if self.stopping:
+            for worker in self.workers:
+                worker.drain()
+            return
+        if self.restart_requested:
+            self.restart_requested = False
+            logging.info("Restarting workers")
+            for worker in self.serving():
+                worker.replacing = True
+        retiring = [worker for worker in self.serving() if worker.replacing]
+        current = [worker for worker in self.serving() if not worker.replacing]
+        while len(current) < args.workers:
+            current.append(self.start_worker())
+        if retiring and all(worker.healthy for worker in current):
+            for worker in retiring:
+                worker.drain()
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.on_restart)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        while not self.stopping or self.workers:
+            self.tick()
+            time.sleep(self.args.health_interval)
+
+    def on_restart(self, signum, frame):
+        self.restart_requested = True
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=10000,
+        help="games kept in memory by each worker",
+    )
+    parser.add_argument("--workers-dir", default="data/workers")
+    parser.add_argument("--health-interval", type=float, default=2)
+    parser.add_argument("--health-timeout", type=float, default=2)
+    parser.add_argument(
+        "--max-failures",
+        type=int,
+        default=3,
+        help="failed health checks in a row before a worker is replaced",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=600,
+        help="seconds a stopping worker waits for its games to be saved",
+    )
+    parser.add_argument("--worker-fd", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.makedirs(args.workers_dir, exist_ok=True)
+    if args.worker_fd is not None:
+        listener = socket.socket(fileno=args.worker_fd)
+        worker = Worker(str(os.getpid()), args.workers_dir)
+        worker.serve(listener, args.max_sessions, args.drain_timeout)
+        return
+    # not socket.create_server, which the Docker image's Python 3.7 lacks
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(1024)
+    try:
+        Supervisor(listener, args).run()
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    main_cli()
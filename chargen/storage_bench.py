@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Fill a bones database with synthetic runs and benchmark highscore storage.
+
+Runs come from automated play: a pool of lives is played under a mix of
+simulate.py's policies, and rows are drawn from that pool with fresh names
+and save times spread over --days. The database is grown to each of --sizes
+in turn, and at each size save throughput, highscore, rank and name search
+latency and the file size are measured, along with the query plans SQLite
+picks for those queries:
+
+    python chargen/storage_bench.py --sizes 10000 1000000 10000000 \\
+        --workdir /tmp/chargen-storage --json storage.json
+
+Playing a life takes a few milliseconds, so by default only --pool lives are
+played and larger datasets reuse them; rows still have the stat and skill
+distributions of real play. A --workdir that already holds a dataset is
+grown from where it left off.
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from bench import measure
+
+
+SYLLABLES = (
+    "ka ri to mo na el an dra gor wyn bel tha sa lo mi ra ve jo han ke".split()
+)
+
+
+def random_name():
+    words = [
+        "".join(random.choice(SYLLABLES) for _ in range(random.randint(1, 3)))
+        for _ in range(random.choice((1, 1, 2)))
+    ]
+    return " ".join(word.title() for word in words)
+
+
+def play_chunk(task):
+    """ (stats, skills) of lives played under policies chosen at random """
+    import main
+    from headless import HeadlessGame, play
+    from simulate import POLICIES
+
+    (policies, seed, index, lives) = task
+    random.seed(f"{seed}:{index}")
+    played = []
+    for _ in range(lives):
+        game = play(HeadlessGame(), POLICIES[random.choice(policies)])
+        player = game.player
+        played.append(
+            (
+                tuple(player.stats[stat] for stat in main.STATS),
+                tuple(skill in player.skills for skill in main.SKILLS),
+            )
+        )
+    return played
+
+
+def play_pool(lives, policies, seed, processes, chunk_size=1000):
+    from simulate import init_worker
+
+    tasks = [
+        (policies, seed, index, min(chunk_size, lives - start))
+        for (index, start) in enumerate(range(0, lives, chunk_size))
+    ]
+    pool = []
+    with multiprocessing.Pool(
+        processes, initializer=init_worker, initargs=(None,)
+    ) as workers:
+        for played in workers.imap_unordered(play_chunk, tasks):
+            pool.extend(played)
+    return pool
+
+
+def saved_runs(main):
+    """ The highest bones id, which is the number of runs in a dataset """
+    with main.database_engine().connect() as conn:
+        return conn.execute(main.LAST_BONES_ID).scalar() or 0
+
+
+def grow(main, pool, start, stop, total, first_saved, span, batch_size):
+    """ Saves runs start..stop of total, returning the rows saved per second
+
+    Run i is saved at first_saved + span * i / total, so a dataset grown in
+    several steps has the same save times as one built in a single step.
+    """
+    began = time.perf_counter()
+    for batch_start in range(start, stop, batch_size):
+        batch = []
+        for i in range(batch_start, min(batch_start + batch_size, stop)):
+            (stats, skills) = random.choice(pool)
+            saved_at = first_saved + span * (i / total)
+            batch.append(main.Bones(random_name(), *stats, *skills, saved_at))
+        main.save_bones(batch)
+    main.prune_leaderboards()
+    return (stop - start) / (time.perf_counter() - began)
+
+
+def query_plan(engine, statement, params):
+    """ The lines of EXPLAIN QUERY PLAN for a statement """
+    compiled = statement.compile(dialect=engine.dialect)
+    values = compiled.construct_params(params)
+    args = [values[name] for name in compiled.positiontup]
+    conn = engine.raw_connection()
+    try:
+        rows = conn.execute(f"explain query plan {compiled}", args).fetchall()
+    finally:
+        conn.close()
+    depth = {0: 0}
+    lines = []
+    for (node, parent, _, detail) in rows:
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append("  " * (depth[node] - 1) + detail)
+    return lines
+
+
+def query_plans(main, pts):
+    period = main.current_period("day")
+    params = {"pts": pts, "bones_id": 2 ** 62, "n": 10}
+    statements = {
+        "top_bones(day)": (main.TOP_BONES, dict(board="day", period=period, n=10)),
+        "score_counts": (main.SCORE_COUNTS, {}),
+        "tied above": (main.TIED_ABOVE, params),
+        "scores above": (main.SCORES_ABOVE, params),
+        "tied below": (main.TIED_BELOW, params),
+        "scores below": (main.SCORES_BELOW, params),
+        "search_bones": (main.NAME_SEARCH, dict(query='"ka"*', n=10)),
+    }
+    engine = main.database_engine()
+    return {
+        name: query_plan(engine, statement, params)
+        for (name, (statement, params)) in statements.items()
+    }
+
+
+def file_size(path):
+    return sum(
+        os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p)
+    )
+
+
+def pool_player(main, pool):
+    """ A CharInfo for a random life from the pool """
+    (stats, skills) = random.choice(pool)
+    player = main.CharInfo()
+    player.stats = dict(zip(main.STATS, stats))
+    player.skills = {skill for (skill, has) in zip(main.SKILLS, skills) if has}
+    return player
+
+
+def benchmark(main, player, repeat, min_time):
+    """ {name: timing} of the highscore operations on the current database """
+    pts = player.stats[main.STATS.PTS]
+    many = [main.Bones.from_char_info(f"bench{i}", player) for i in range(100)]
+    benchmarks = {
+        # reads first, so they see the dataset and not what the saves add
+        "get_highscores(day)": lambda: main.get_highscores("day"),
+        "get_highscores(all)": lambda: main.get_highscores("all"),
+        "standing": lambda: main.standing(pts),
+        "score_counts": main.score_counts,
+        "search_bones": lambda: main.search_bones("ka"),
+        "save": lambda: main.save("bench", player),
+        "save_bones[100]": lambda: main.save_bones(many),
+    }
+    return {
+        name: measure(fn, repeat, min_time) for (name, fn) in benchmarks.items()
+    }
+
+
+def print_size(size, report):
+    print(f"== {size} rows: {report['file_bytes'] / 2 ** 20:.1f} MiB")
+    if report["load_rows_per_s"] is not None:
+        print(f"  bulk load {report['load_rows_per_s']:.0f} rows/s")
+    for (name, result) in report["results"].items():
+        median = result["median_us"]
+        print(f"  {name:>20} {median:12.1f}us  {1e6 / median:10.1f}/s")
+    for (name, plan) in report["query_plans"].items():
+        print(f"  {name}:")
+        for line in plan:
+            print(f"    {line}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 1000000, 10000000]
+    )
+    parser.add_argument(
+        "--pool",
+        type=int,
+        default=20000,
+        help="lives to play; rows beyond this reuse played lives",
+    )
+    parser.add_argument(
+        "--policy",
+        nargs="+",
+        default=["random", "greedy", "cleric", "fighting_man", "magic_user"],
+        help="simulate.py policies the lives are played under, evenly mixed",
+    )
+    parser.add_argument("--days", type=float, default=365, help="span of save times")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument(
+        "--workdir", help="keep the database here (default: a scratch directory)"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chargen-storage-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    import main
+
+    logging.disable(logging.WARNING)
+    random.seed(args.seed)
+    started = time.perf_counter()
+    pool = play_pool(
+        min(args.pool, max(args.sizes)), args.policy, args.seed, args.processes
+    )
+    print(f"Played {len(pool)} lives in {time.perf_counter() - started:.1f}s")
+
+    total = max(args.sizes)
+    span = timedelta(days=args.days)
+    first_saved = datetime.now() - span
+    rows = saved_runs(main)
+    reports = {}
+    for size in sorted(args.sizes):
+        if size < rows:
+            print(f"== {size} rows: skipped, {workdir} already has {rows}")
+            continue
+        load_rate = None
+        if size > rows:
+            load_rate = grow(
+                main, pool, rows, size, total, first_saved, span, args.batch_size
+            )
+        player = pool_player(main, pool)
+        reports[size] = {
+            "load_rows_per_s": load_rate,
+            "file_bytes": file_size("data/bones.sqlite"),
+            "query_plans": query_plans(main, player.stats[main.STATS.PTS]),
+            "results": benchmark(main, player, args.repeat, args.min_time),
+        }
+        print_size(size, reports[size])
+        # what the benchmarked saves added counts towards the next size
+        rows = saved_runs(main)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"workdir": workdir, "sizes": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
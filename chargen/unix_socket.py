@@ -0,0 +1,22 @@
+"""
+Helpers shared by the daemons that listen on Unix sockets.
+
+Kept apart from main.py, so a daemon that does not run games does not have
+to import the game (and its logging to log.txt) to use them.
+"""
+import os
+import socket
+import sys
+
+
+def claim_socket(path):
+    """ Removes a stale socket file, refusing if a daemon is still serving it """
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    sys.exit(f"{path} is already being served")
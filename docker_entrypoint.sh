@@ -1,4 +1,4 @@
 #!/bin/sh
 USER=chargen
 chown -R $USER /chargen && su - chargen -c \
-'cd /chargen && gotty -w --title-format "Game of Centuries" pipenv --bare run python3 chargen/main.py'
+'cd /chargen && (pipenv --bare run python3 chargen/sessiond.py &) && CHARGEN_SESSION_SOCKET=data/sessions.sock gotty -w --title-format "Game of Centuries" pipenv --bare run python3 chargen/main.py'